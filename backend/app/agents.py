@@ -1,82 +1,427 @@
-from pymongo import MongoClient
+import os
+import atexit
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from bson import ObjectId
+from pymongo import UpdateOne, DESCENDING
+from pymongo.errors import BulkWriteError
 from datetime import datetime
+from app.metrics import AGENT_DOCUMENTS, AGENT_WRITE_SECONDS
+from app.mongo_utils import get_db
+from app.archive import archive_log
+from app.search import search_index
 
-# MongoDB connection
-try:
-    client = MongoClient("mongodb://localhost:27017/")
-    db = client["cease_desist_db"]
-    print("Connected to MongoDB successfully.")
-except Exception as e:
-    print(f"Failed to connect to MongoDB: {str(e)}")
-    db = None
+logger = logging.getLogger(__name__)
+
+# Write-behind configuration
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 100))  # Documents per insert_many
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", 0.5))  # Seconds before a partial batch is flushed
+WRITE_BUFFER_LIMIT = int(os.getenv("WRITE_BUFFER_LIMIT", 10000))  # Pending documents before writers block
+# Seconds an acknowledged write waits for others to share its batch, so acks cost one flush per window
+WRITE_ACK_WINDOW = float(os.getenv("WRITE_ACK_WINDOW", 0.02))
+DUPLICATE_KEY_ERROR = 11000  # MongoDB error code for an insert whose _id already exists
+# Wait for audit log entries to be written before responding (required for the compliance trail)
+AUDIT_SYNC_ACK = os.getenv("AUDIT_SYNC_ACK", "true").lower() == "true"
+
+# Collection holding the running totals shown on the dashboard
+COUNTERS_COLLECTION = "metrics_counters"
+# Collections listed on the dashboard, newest first
+DASHBOARD_COLLECTIONS = ["audit_logs", "approved_documents", "further_evaluation", "classification_logs",
+                         "datastore", "manual_review"]
+
+class WriteBehindBuffer:
+    """
+    Buffer shared by the agents that batches inserts per collection.
+    A background thread flushes each collection with insert_many once a batch is full
+    or the flush interval has passed. Writers block when the buffer is full.
+    """
+    def __init__(self, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL, limit=WRITE_BUFFER_LIMIT,
+                 ack_window=WRITE_ACK_WINDOW):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.limit = limit
+        self.ack_window = ack_window
+        self._pending = defaultdict(list)  # collection name -> [(document, future)]
+        self._size = 0
+        self._ack_deadline = None  # When the earliest write waiting for its acknowledgement must be flushed
+        self._writing = []  # [(collection name, [(document, future)])] being written
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _enqueue(self, collection_name, document, wait, block):
+        with self._cond:
+            if self._closed:
+                raise Exception("Write buffer is closed.")
+            # Back-pressure: hold writers until the flusher has made room
+            while self._size >= self.limit:
+                if not block:
+                    return None
+                self._cond.wait()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+            # Stamp a real datetime so recent-items queries can use the created_at index
+            document.setdefault("created_at", datetime.utcnow())
+            future = Future()
+            self._pending[collection_name].append((document, future))
+            self._size += 1
+            if wait and self._ack_deadline is None:
+                self._ack_deadline = time.monotonic() + self.ack_window
+            # Wake the flusher for the first pending document, an acknowledged write or a full batch
+            if wait or self._size == 1 or len(self._pending[collection_name]) >= self.batch_size:
+                self._cond.notify_all()
+            return future
+
+    def submit(self, collection_name, document, wait=False):
+        """
+        Queue a document for insertion. With wait=True, block until it has been written
+        (raising if the write failed). Returns a future resolved once the batch is written.
+        """
+        future = self._enqueue(collection_name, document, wait, block=True)
+        if wait:
+            future.result()
+        return future
+
+    async def submit_async(self, collection_name, document, wait=False):
+        """
+        Async version of submit; back-pressure and acknowledgements are awaited, not blocked on.
+        """
+        future = self._enqueue(collection_name, document, wait, block=False)
+        if future is None:
+            # Buffer is full: wait for room on a worker thread rather than on the event loop
+            future = await asyncio.to_thread(self._enqueue, collection_name, document, wait, True)
+        if wait:
+            await asyncio.wrap_future(future)
+        return future
+
+    def _take_batches(self):
+        """
+        Remove and return the pending batches (called with the lock held).
+        """
+        batches = []
+        for collection_name, items in self._pending.items():
+            for start in range(0, len(items), self.batch_size):
+                batches.append((collection_name, items[start:start + self.batch_size]))
+        self._pending = defaultdict(list)
+        self._ack_deadline = None
+        return batches
+
+    def _write(self, collection_name, items):
+        documents = [document for document, _ in items]
+        failed = {}  # index in the batch -> error
+        already_written = set()
+        try:
+            with AGENT_WRITE_SECONDS.labels(collection_name).time():
+                get_db()[collection_name].insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # Unordered: every document without a write error was inserted
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") == DUPLICATE_KEY_ERROR:
+                    # Only documents given a fixed _id collide: this one was written by an earlier attempt
+                    already_written.add(error["index"])
+                else:
+                    failed[error["index"]] = BulkWriteError({"writeErrors": [error], "nInserted": 0})
+        except Exception as e:
+            failed = {index: e for index in range(len(items))}
+
+        inserted = [
+            document for index, document in enumerate(documents) if index not in failed and index not in already_written
+        ]
+        if failed:
+            logger.error(
+                "Failed to flush documents",
+                extra={"collection": collection_name, "documents": len(failed), "error": str(next(iter(failed.values())))},
+            )
+            AGENT_DOCUMENTS.labels(collection_name, "failed").inc(len(failed))
+        if inserted:
+            logger.debug("Flushed documents", extra={"collection": collection_name, "documents": len(inserted)})
+            AGENT_DOCUMENTS.labels(collection_name, "written").inc(len(inserted))
+        for index, (_, future) in enumerate(items):
+            if index in failed:
+                future.set_exception(failed[index])
+            else:
+                future.set_result(True)
+        if inserted:
+            # The totals follow what was actually inserted, so they match the collection sizes
+            self._increment_counters(collection_name, inserted)
+
+    def _increment_counters(self, collection_name, documents):
+        """
+        Add a written batch to the per-collection and per-classification totals.
+        """
+        increments = {f"collection:{collection_name}": len(documents)}
+        if collection_name == "audit_logs":
+            for document in documents:
+                key = f"classification:{document.get('classification')}"
+                increments[key] = increments.get(key, 0) + 1
+        elif collection_name == "classification_logs":
+            # Which tier decided each document, for the LLM offload rate
+            for document in documents:
+                key = f"tier:{document.get('tier')}"
+                increments[key] = increments.get(key, 0) + 1
+        try:
+            get_db()[COUNTERS_COLLECTION].bulk_write(
+                [UpdateOne({"_id": key}, {"$inc": {"count": count}}, upsert=True) for key, count in increments.items()],
+                ordered=False,
+            )
+        except Exception as e:
+            logger.error("Failed to update counters", extra={"collection": collection_name, "error": str(e)})
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not (self._closed or self._pending):
+                    self._cond.wait()
+                deadline = time.monotonic() + self.flush_interval
+                while not (self._closed or any(len(items) >= self.batch_size for items in self._pending.values())):
+                    # Acknowledged writes shorten the wait to their window, shared by every write in it
+                    due = deadline if self._ack_deadline is None else min(deadline, self._ack_deadline)
+                    remaining = due - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batches = self._take_batches()
+                self._writing = batches
+                closing = self._closed
+
+            for collection_name, items in batches:
+                self._write(collection_name, items)
+
+            with self._cond:
+                self._writing = []
+                self._size -= sum(len(items) for _, items in batches)
+                self._cond.notify_all()  # Wake writers held by back-pressure
+                if closing and not self._pending:
+                    return
+
+    def flush(self):
+        """
+        Wait until every document queued so far has been written, raising if any write failed.
+        """
+        with self._cond:
+            pending = [future for _, items in self._writing for _, future in items]
+            pending += [future for items in self._pending.values() for _, future in items]
+            if self._pending:
+                self._ack_deadline = time.monotonic()
+                self._cond.notify_all()
+        for future in pending:
+            future.result()
+
+    def oldest_unwritten(self, collection_name):
+        """
+        The earliest created_at of a document for the collection that is queued or being
+        written, or None when everything queued for it has been written.
+        """
+        with self._cond:
+            items = self._pending.get(collection_name, [])
+            items = items + [item for name, batch in self._writing if name == collection_name for item in batch]
+            stamps = [document["created_at"] for document, _ in items if isinstance(document.get("created_at"), datetime)]
+        return min(stamps, default=None)
+
+    def close(self):
+        """
+        Flush everything still pending and stop the flusher (called on shutdown).
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
 
 class AuditAgent:
     """
     Agent responsible for logging requests for audit purposes.
     """
-    def log_request(self, data):
+    def __init__(self, buffer, index=None, sync_ack=AUDIT_SYNC_ACK):
+        self.buffer = buffer
+        self.index = index  # Full-text search index kept up to date with the audit log
+        self.sync_ack = sync_ack
+
+    def _status(self, data):
+        # The id lets clients refer back to the document (e.g. to chat about it)
+        if self.sync_ack:
+            return {"status": "Audit log created successfully", "audit_id": str(data["_id"])}
+        return {"status": "Audit log queued successfully", "audit_id": str(data["_id"])}
+
+    def _index(self, data, text):
+        # Search is secondary to the audit trail, so indexing failures are only logged
+        if self.index is None:
+            return
+        try:
+            self.index.add(data, text if text is not None else data.get("extracted_text"))
+        except Exception as e:
+            logger.error("Failed to queue audit log for search", extra={"error": str(e)})
+
+    def log_request(self, data, text=None):
+        """
+        Log a request. text is the extracted text for the search index, when the
+        entry only references it (see app/text_store.py).
+        """
+        try:
+            # Assign the id up front, since batched inserts do not report it back
+            data.setdefault("_id", ObjectId())
+            self.buffer.submit("audit_logs", data, wait=self.sync_ack)
+            logger.info("Audit log created", extra={"document": data.get("filename")})
+            self._index(data, text)
+            return self._status(data)
+        except Exception as e:
+            logger.error("Failed to log audit data", extra={"error": str(e)})
+            return {"status": f"Failed to log audit data: {str(e)}"}
+
+    async def log_request_async(self, data, text=None):
         try:
-            if db is None:  # Check if the database connection is available
-                raise Exception("Database connection not available.")
-            db["audit_logs"].insert_one(data)
-            print(f"Audit log created: {data}")
-            return {"status": "Audit log created successfully"}
+            data.setdefault("_id", ObjectId())
+            await self.buffer.submit_async("audit_logs", data, wait=self.sync_ack)
+            logger.info("Audit log created", extra={"document": data.get("filename")})
+            self._index(data, text)
+            return self._status(data)
         except Exception as e:
-            print(f"Failed to log audit data: {str(e)}")
+            logger.error("Failed to log audit data", extra={"error": str(e)})
             return {"status": f"Failed to log audit data: {str(e)}"}
 
 class DatastoreAgent:
     """
     Agent responsible for writing details to a datastore for 'Cease' requests.
     """
-    def __init__(self, db):
-        self.db = db
+    def __init__(self, buffer):
+        self.buffer = buffer
 
     def write_to_datastore(self, data):
         try:
-            if self.db is None:  # Check if the database connection is available
-                raise Exception("Database connection not available.")
-            self.db["datastore"].insert_one(data)
-            print(f"Datastore entry created: {data}")
-            return {"status": "Datastore entry created successfully"}
+            self.buffer.submit("datastore", data)
+            logger.info("Datastore entry queued", extra={"document": data.get("filename")})
+            return {"status": "Datastore entry queued successfully"}
+        except Exception as e:
+            logger.error("Failed to write to datastore", extra={"error": str(e)})
+            return {"status": f"Failed to write to datastore: {str(e)}"}
+
+    async def write_to_datastore_async(self, data):
+        try:
+            await self.buffer.submit_async("datastore", data)
+            logger.info("Datastore entry queued", extra={"document": data.get("filename")})
+            return {"status": "Datastore entry queued successfully"}
         except Exception as e:
-            print(f"Failed to write to datastore: {str(e)}")
+            logger.error("Failed to write to datastore", extra={"error": str(e)})
             return {"status": f"Failed to write to datastore: {str(e)}"}
 
 class ArchivingAgent:
     """
-    Agent responsible for archiving details to a flat file for 'Irrelevant' requests.
+    Agent responsible for archiving details to the archive log for 'Irrelevant' requests.
     """
+    def __init__(self, log):
+        self.log = log
+
+    def _status(self):
+        if self.log.fsync == "always":
+            return {"status": "Archived to file successfully"}
+        return {"status": "Archive entry queued successfully"}
+
     def archive_to_file(self, data):
         try:
-            with open("archive.txt", "a") as f:
-                f.write(f"{data['timestamp']} - {data['filename']}\n")
-            print(f"Archived to file: {data}")
-            return {"status": "Archived to file successfully"}
+            self.log.append({**data, "classification": "Irrelevant"})
+            logger.info("Archived to file", extra={"document": data["filename"]})
+            return self._status()
         except Exception as e:
-            print(f"Failed to archive to file: {str(e)}")
+            logger.error("Failed to archive to file", extra={"error": str(e)})
             return {"status": f"Failed to archive to file: {str(e)}"}
 
+    async def archive_to_file_async(self, data):
+        # Appends may wait for a disk sync; keep them off the event loop
+        return await asyncio.to_thread(self.archive_to_file, data)
+
+class ClassificationLogAgent:
+    """
+    Agent responsible for recording which classifier tier decided each document.
+    """
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def log_decision(self, data):
+        try:
+            self.buffer.submit("classification_logs", data)
+            return {"status": "Classification decision queued successfully"}
+        except Exception as e:
+            logger.error("Failed to log classification decision", extra={"error": str(e)})
+            return {"status": f"Failed to log classification decision: {str(e)}"}
+
+    async def log_decision_async(self, data):
+        try:
+            await self.buffer.submit_async("classification_logs", data)
+            return {"status": "Classification decision queued successfully"}
+        except Exception as e:
+            logger.error("Failed to log classification decision", extra={"error": str(e)})
+            return {"status": f"Failed to log classification decision: {str(e)}"}
+
 class ManualReviewAgent:
     """
     Agent responsible for presenting 'Uncertain' requests to a human agent.
     """
-    def __init__(self, db):
-        self.db = db
+    def __init__(self, buffer):
+        self.buffer = buffer
 
     def present_for_review(self, data):
         try:
-            if self.db is None:  # Check if the database connection is available
-                raise Exception("Database connection not available.")
-            self.db["manual_review"].insert_one(data)
-            print(f"Document presented for manual review: {data}")
-            return {"status": "Document presented for manual review successfully"}
+            self.buffer.submit("manual_review", data)
+            logger.info("Document queued for manual review", extra={"document": data.get("filename")})
+            return {"status": "Document queued for manual review successfully"}
+        except Exception as e:
+            logger.error("Failed to present for manual review", extra={"error": str(e)})
+            return {"status": f"Failed to present for manual review: {str(e)}"}
+
+    async def present_for_review_async(self, data):
+        try:
+            await self.buffer.submit_async("manual_review", data)
+            logger.info("Document queued for manual review", extra={"document": data.get("filename")})
+            return {"status": "Document queued for manual review successfully"}
         except Exception as e:
-            print(f"Failed to present for manual review: {str(e)}")
+            logger.error("Failed to present for manual review", extra={"error": str(e)})
             return {"status": f"Failed to present for manual review: {str(e)}"}
 
-# Instantiate agents with the shared database connection
-audit_agent = AuditAgent()
-datastore_agent = DatastoreAgent(db)
-archiving_agent = ArchivingAgent()
-manual_review_agent = ManualReviewAgent(db)
\ No newline at end of file
+def prepare_collections():
+    """
+    Create the created_at indexes used by the dashboard and, on first run, seed the
+    counters and datetime fields from the documents already stored.
+    """
+    db = get_db()
+    for collection_name in DASHBOARD_COLLECTIONS:
+        db[collection_name].create_index([("created_at", DESCENDING)])
+        # Keyset pagination of the dashboard feeds
+        db[collection_name].create_index([("created_at", DESCENDING), ("_id", DESCENDING)])
+
+    if db[COUNTERS_COLLECTION].estimated_document_count() > 0:
+        return
+    logger.info("Seeding dashboard counters from existing documents.")
+    for collection_name in DASHBOARD_COLLECTIONS:
+        # Older documents only carry the timestamp string
+        db[collection_name].update_many(
+            {"created_at": {"$exists": False}},
+            [{"$set": {"created_at": {"$dateFromString": {"dateString": "$timestamp", "onError": "$$NOW", "onNull": "$$NOW"}}}}],
+        )
+        db[COUNTERS_COLLECTION].update_one(
+            {"_id": f"collection:{collection_name}"},
+            {"$set": {"count": db[collection_name].count_documents({})}},
+            upsert=True,
+        )
+    for group in db["audit_logs"].aggregate([{"$group": {"_id": "$classification", "count": {"$sum": 1}}}]):
+        db[COUNTERS_COLLECTION].update_one(
+            {"_id": f"classification:{group['_id']}"}, {"$set": {"count": group["count"]}}, upsert=True
+        )
+
+# Shared write-behind buffer, flushed on interpreter exit if the app did not close it
+write_buffer = WriteBehindBuffer()
+atexit.register(write_buffer.close)
+
+# Instantiate agents with the shared write buffer (the audit agent also feeds the search index)
+audit_agent = AuditAgent(write_buffer, search_index)
+datastore_agent = DatastoreAgent(write_buffer)
+archiving_agent = ArchivingAgent(archive_log)
+manual_review_agent = ManualReviewAgent(write_buffer)
+classification_log_agent = ClassificationLogAgent(write_buffer)
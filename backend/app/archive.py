@@ -0,0 +1,440 @@
+"""
+Archive log for documents classified as Irrelevant.
+
+Records are appended as JSON lines to numbered segment files in ARCHIVE_DIR:
+- appends are buffered and written in batches by a background thread
+- ARCHIVE_FSYNC picks the durability: "always" (each append waits until its batch is
+  fsynced), "batch" (each batch is fsynced, appends do not wait) or "never"; a batch
+  that fails to write is retried ARCHIVE_WRITE_RETRIES times before it is dropped
+- a segment is sealed once it reaches ARCHIVE_SEGMENT_BYTES or ARCHIVE_SEGMENT_SECONDS,
+  and sealed segments are gzip-compressed, each write batch as its own gzip member
+- a SQLite sidecar index maps filename and date to (segment, offset, length), and each
+  batch to the offset of its gzip member, so lookups decompress only the members holding
+  the matching records
+
+Several server processes can share one archive: each batch is written inside a SQLite
+write transaction, which serializes the writers and keeps the index and the segment
+files consistent.
+"""
+import os
+import gzip
+import json
+import zlib
+import bisect
+import time
+import atexit
+import logging
+import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime
+from app.metrics import time_stage
+
+logger = logging.getLogger(__name__)
+
+# Archive configuration
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive_log")  # Segment files and the index
+ARCHIVE_SEGMENT_BYTES = int(os.getenv("ARCHIVE_SEGMENT_BYTES", 64 * 2**20))  # Seal a segment at this size
+ARCHIVE_SEGMENT_SECONDS = int(os.getenv("ARCHIVE_SEGMENT_SECONDS", 24 * 3600))  # ...or at this age
+ARCHIVE_COMPRESS = os.getenv("ARCHIVE_COMPRESS", "true").lower() == "true"  # gzip sealed segments
+ARCHIVE_FSYNC = os.getenv("ARCHIVE_FSYNC", "batch")  # "always", "batch" or "never"
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 500))  # Records per write at most
+ARCHIVE_FLUSH_INTERVAL = float(os.getenv("ARCHIVE_FLUSH_INTERVAL", 0.5))  # Seconds before a partial batch is written
+ARCHIVE_WRITE_RETRIES = int(os.getenv("ARCHIVE_WRITE_RETRIES", 3))  # Retries of a failed batch before it is dropped
+ARCHIVE_RETRY_DELAY = float(os.getenv("ARCHIVE_RETRY_DELAY", 0.5))  # Seconds before the first retry, doubling after
+ARCHIVE_QUERY_LIMIT = 1000  # Records returned by one query at most
+
+FSYNC_POLICIES = ("always", "batch", "never")
+
+
+class ArchiveLog:
+    """
+    Append-only, segmented archive with a buffered, process-safe writer and a sidecar index.
+    """
+    def __init__(self, directory=ARCHIVE_DIR, segment_bytes=ARCHIVE_SEGMENT_BYTES,
+                 segment_seconds=ARCHIVE_SEGMENT_SECONDS, fsync=ARCHIVE_FSYNC, compress=ARCHIVE_COMPRESS):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy '{fsync}'. Choose from: {', '.join(FSYNC_POLICIES)}.")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.fsync = fsync
+        self.compress = compress
+        self._pending = []  # [(record, future)]
+        self._writing = []  # Futures of the batch being written
+        self._urgent = False  # Set when an append is waiting for its write
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self._ready = False
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, "index.db")
+
+    def segment_path(self, segment, compressed=False):
+        return os.path.join(self.directory, f"segment-{segment:08d}.jsonl" + (".gz" if compressed else ""))
+
+    @contextmanager
+    def _connect(self):
+        # One connection per call keeps the index safe to use from any thread
+        conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            yield conn
+        finally:
+            conn.close()
+
+    def _ensure(self):
+        """
+        Create the archive directory and the index on first use.
+        """
+        if self._ready:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS segments (
+                    segment INTEGER PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    sealed INTEGER NOT NULL DEFAULT 0,
+                    compressed INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS records (
+                    id INTEGER PRIMARY KEY,
+                    filename TEXT,
+                    date TEXT NOT NULL,
+                    segment INTEGER NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL
+                )
+                """
+            )
+            # Where each write batch starts in its segment and, once compressed, where its gzip member starts
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS members (
+                    segment INTEGER NOT NULL,
+                    offset INTEGER NOT NULL,
+                    compressed_offset INTEGER,
+                    PRIMARY KEY (segment, offset)
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS records_filename_date ON records (filename, date)")
+            conn.execute("CREATE INDEX IF NOT EXISTS records_date ON records (date)")
+        self._ready = True
+
+    def append(self, record, wait=None):
+        """
+        Queue a record for the archive. With wait (the default under the "always" fsync
+        policy) this returns once the record is written and synced to disk.
+        """
+        wait = self.fsync == "always" if wait is None else wait
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise Exception("Archive log is closed.")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="archive-writer", daemon=True)
+                self._thread.start()
+            self._pending.append((record, future))
+            if wait:
+                self._urgent = True
+            if wait or len(self._pending) >= ARCHIVE_BATCH_SIZE or len(self._pending) == 1:
+                self._cond.notify_all()
+        if wait:
+            future.result()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not (self._closed or self._pending):
+                    self._cond.wait()
+                # Give a partial batch the flush interval to fill up
+                deadline = time.monotonic() + ARCHIVE_FLUSH_INTERVAL
+                while not (self._closed or self._urgent) and len(self._pending) < ARCHIVE_BATCH_SIZE:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending[:ARCHIVE_BATCH_SIZE], self._pending[ARCHIVE_BATCH_SIZE:]
+                self._writing = [future for _, future in batch]
+                self._urgent = bool(self._pending) and self._urgent
+                closing = self._closed and not self._pending
+
+            if batch:
+                self._write_with_retries(batch)
+            if closing:
+                return
+
+    def _write_with_retries(self, batch):
+        """
+        Write a batch of (record, future) pairs, retrying with backoff so that appends that
+        were not waiting for their batch (ARCHIVE_FSYNC "batch" or "never") are not lost to
+        a transient failure. A failed attempt indexes nothing, so a retry never duplicates.
+        """
+        delay = ARCHIVE_RETRY_DELAY
+        for attempt in range(ARCHIVE_WRITE_RETRIES + 1):
+            try:
+                self._write([record for record, _ in batch])
+                break
+            except Exception as e:
+                if attempt == ARCHIVE_WRITE_RETRIES:
+                    logger.error("Failed to write to the archive", extra={"records": len(batch), "error": str(e)})
+                    for _, future in batch:
+                        future.set_exception(e)
+                    return
+                logger.warning(
+                    "Retrying archive write", extra={"records": len(batch), "attempt": attempt + 1, "error": str(e)}
+                )
+                time.sleep(delay)
+                delay *= 2
+        for _, future in batch:
+            future.set_result(True)
+
+    def _write(self, records):
+        """
+        Append a batch to the open segment and index it, sealing the segment when it is full.
+        """
+        self._ensure()
+        lines = []
+        for record in records:
+            lines.append((record, (json.dumps(record, default=str) + "\n").encode("utf-8")))
+
+        sealed = None
+        with time_stage("archive_write"), self._connect() as conn:
+            # The write lock is held across processes until COMMIT
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT segment, created_at FROM segments WHERE sealed = 0").fetchone()
+                if row is None:
+                    last = conn.execute("SELECT MAX(segment) FROM segments").fetchone()[0] or 0
+                    row = {"segment": last + 1, "created_at": time.time()}
+                    conn.execute(
+                        "INSERT INTO segments (segment, created_at) VALUES (?, ?)", (row["segment"], row["created_at"])
+                    )
+                segment = row["segment"]
+
+                with open(self.segment_path(segment), "ab") as f:
+                    # Start from the real end of the file, past anything a crashed writer left unindexed
+                    offset = f.seek(0, os.SEEK_END)
+                    conn.execute("INSERT OR IGNORE INTO members (segment, offset) VALUES (?, ?)", (segment, offset))
+                    entries = []
+                    for record, line in lines:
+                        entries.append((record.get("filename"), _record_date(record), segment, offset, len(line)))
+                        offset += len(line)
+                    f.write(b"".join(line for _, line in lines))
+                    f.flush()
+                    if self.fsync != "never":
+                        os.fsync(f.fileno())
+                conn.executemany(
+                    "INSERT INTO records (filename, date, segment, offset, length) VALUES (?, ?, ?, ?, ?)", entries
+                )
+
+                if offset >= self.segment_bytes or time.time() - row["created_at"] >= self.segment_seconds:
+                    conn.execute("UPDATE segments SET sealed = 1 WHERE segment = ?", (segment,))
+                    sealed = segment
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        logger.debug("Archived records", extra={"records": len(records), "segment": segment})
+
+        if sealed is not None:
+            logger.info("Sealed archive segment", extra={"segment": sealed})
+            if self.compress:
+                # Outside the write lock, so other writers carry on with the next segment.
+                # The batch is already committed: a failure here must not make it be retried
+                try:
+                    self.compress_sealed()
+                except Exception as e:
+                    logger.error("Failed to compress sealed archive segments", extra={"error": str(e)})
+
+    def compress_sealed(self):
+        """
+        gzip every sealed segment that is not compressed yet (including any left by a crash).
+        Each write batch becomes its own gzip member, and the offset of each member is indexed
+        so a lookup starts decompressing at the member holding its record.
+        """
+        self._ensure()
+        with self._connect() as conn:
+            segments = [row["segment"] for row in conn.execute(
+                "SELECT segment FROM segments WHERE sealed = 1 AND compressed = 0"
+            )]
+        for segment in segments:
+            source = self.segment_path(segment)
+            if not os.path.exists(source):
+                continue  # Compressed by another process
+            with self._connect() as conn:
+                starts = [row["offset"] for row in conn.execute(
+                    "SELECT offset FROM members WHERE segment = ? ORDER BY offset", (segment,)
+                )]
+            with open(source, "rb") as f:
+                data = f.read()
+            # Anything before the first batch (left by a crashed writer) goes in a member of its own
+            starts = [0] + [start for start in starts if 0 < start < len(data)]
+            members = []
+            temporary = f"{self.segment_path(segment, compressed=True)}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as f_out:
+                for start, end in zip(starts, starts[1:] + [len(data)]):
+                    members.append((segment, start, f_out.tell()))
+                    # A fixed mtime keeps the members identical if two processes compress the segment
+                    f_out.write(gzip.compress(data[start:end], mtime=0))
+            os.replace(temporary, self.segment_path(segment, compressed=True))
+            with self._connect() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute("DELETE FROM members WHERE segment = ?", (segment,))
+                    conn.executemany(
+                        "INSERT INTO members (segment, offset, compressed_offset) VALUES (?, ?, ?)", members
+                    )
+                    conn.execute("UPDATE segments SET compressed = 1 WHERE segment = ?", (segment,))
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            try:
+                os.remove(source)
+            except FileNotFoundError:
+                pass
+            logger.info("Compressed archive segment", extra={"segment": segment, "members": len(members)})
+
+    def _read_segment(self, segment, entries, members):
+        """
+        Read the (id, offset, length) entries of a segment into a dict by id. In a compressed
+        segment only the gzip members holding the entries are decompressed, each once;
+        members are [(offset, compressed_offset)] sorted by offset.
+        """
+        records = {}
+        entries = sorted(entries, key=lambda entry: entry["offset"])
+        try:
+            with open(self.segment_path(segment), "rb") as f:
+                for entry in entries:
+                    f.seek(entry["offset"])
+                    records[entry["id"]] = json.loads(f.read(entry["length"]))
+            return records
+        except FileNotFoundError:
+            pass
+
+        path = self.segment_path(segment, compressed=True)
+        if not members:
+            # Compressed as a single gzip stream, before members were indexed: seeking decompresses from the start
+            with gzip.open(path, "rb") as f:
+                for entry in entries:
+                    f.seek(entry["offset"])
+                    records[entry["id"]] = json.loads(f.read(entry["length"]))
+            return records
+
+        starts = [start for start, _ in members]
+        current, data = None, b""
+        with open(path, "rb") as f:
+            for entry in entries:
+                member = bisect.bisect_right(starts, entry["offset"]) - 1
+                if member != current:
+                    current, data = member, _read_member(f, members[member][1])
+                position = entry["offset"] - starts[member]
+                records[entry["id"]] = json.loads(data[position:position + entry["length"]])
+        return records
+
+    def query(self, filename=None, date_from=None, date_to=None, limit=100):
+        """
+        Return archived records, newest first, matching a filename and/or a date range
+        (dates as YYYY-MM-DD, inclusive). Only the matching records are read from the segments.
+        """
+        self._ensure()
+        conditions, parameters = [], []
+        if filename is not None:
+            conditions.append("filename = ?")
+            parameters.append(filename)
+        if date_from is not None:
+            conditions.append("date >= ?")
+            parameters.append(date_from)
+        if date_to is not None:
+            conditions.append("date <= ?")
+            parameters.append(date_to)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        limit = max(1, min(limit, ARCHIVE_QUERY_LIMIT))
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT id, segment, offset, length FROM records {where} ORDER BY date DESC, id DESC LIMIT ?",
+                (*parameters, limit),
+            ).fetchall()
+            by_segment = {}
+            for row in rows:
+                by_segment.setdefault(row["segment"], []).append(row)
+            members = {
+                segment: [(member["offset"], member["compressed_offset"]) for member in conn.execute(
+                    "SELECT offset, compressed_offset FROM members "
+                    "WHERE segment = ? AND compressed_offset IS NOT NULL ORDER BY offset",
+                    (segment,),
+                )]
+                for segment in by_segment
+            }
+
+        records = {}
+        for segment, entries in by_segment.items():
+            records.update(self._read_segment(segment, entries, members[segment]))
+        return [records[row["id"]] for row in rows]
+
+    def flush(self):
+        """
+        Wait until everything appended so far has been written, raising if any of it failed.
+        """
+        with self._cond:
+            pending = self._writing + [future for _, future in self._pending]
+            self._urgent = True
+            self._cond.notify_all()
+        for future in pending:
+            future.result()
+
+    def close(self):
+        """
+        Write everything still pending and stop the writer (called on shutdown).
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+
+def _read_member(f, compressed_offset):
+    """
+    Decompress the single gzip member starting at compressed_offset in f.
+    """
+    f.seek(compressed_offset)
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)  # gzip header, one member only
+    parts = []
+    while not decompressor.eof:
+        chunk = f.read(64 * 1024)
+        if not chunk:
+            raise EOFError("Archive segment ends inside a gzip member.")
+        parts.append(decompressor.decompress(chunk))
+    return b"".join(parts)
+
+
+def _record_date(record):
+    """
+    The date a record is indexed under: that of its timestamp, or today.
+    """
+    timestamp = str(record.get("timestamp") or "")
+    try:
+        return datetime.strptime(timestamp[:10], "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return datetime.now().strftime("%Y-%m-%d")
+
+
+# Shared archive log, flushed on interpreter exit if the app did not close it
+archive_log = ArchiveLog()
+atexit.register(archive_log.close)
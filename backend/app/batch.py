@@ -0,0 +1,364 @@
+"""
+Process a directory tree of documents offline, without going through the HTTP API.
+
+Every PDF and scanned image (see IMAGE_EXTENSIONS) under the input directory is extracted
+and classified across a pool of worker processes, then logged and routed by the agents as
+an upload would be. This covers backfills and reprocessing, e.g. re-running classification
+after a prompt change: the result cache and near-duplicate labels are not consulted.
+
+Progress is checkpointed to a journal as each file finishes, so an interrupted run picks
+up where it stopped when started again with the same arguments. Results are written as
+JSON lines or Parquet once every file is done.
+
+Usage:
+    python -m app.batch "../Sample Docs" --output results.jsonl
+    python -m app.batch archive/ --output results.parquet --workers 4 --dry-run
+"""
+import os
+import sys
+import json
+import time
+import struct
+import signal
+import hashlib
+import logging
+import argparse
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+from bson import ObjectId
+from app import llm_utils
+from app.log import configure_logging
+from app.ocr import IMAGE_EXTENSIONS, resolve_ocr_profile, resolve_ocr_language
+from app.classifier import classify_document
+from app.pipeline import extract_file, detect_language, classification_fields, route_document
+from app.agents import write_buffer
+from app.archive import archive_log
+from app.search import search_index
+
+# Named explicitly: run with -m, this module is __main__, outside the "app" logger
+logger = logging.getLogger("app.batch")
+
+# Batch configuration
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", os.cpu_count() or 1))  # Documents processed in parallel
+BATCH_PROGRESS_INTERVAL = float(os.getenv("BATCH_PROGRESS_INTERVAL", 5))  # Seconds between progress reports
+BATCH_IN_FLIGHT = 2  # Documents queued per worker, so the pool never idles between results
+# Routed documents are marked done once their buffered writes are flushed, this many at a time at most...
+BATCH_CHECKPOINT_SIZE = int(os.getenv("BATCH_CHECKPOINT_SIZE", 100))
+BATCH_CHECKPOINT_INTERVAL = float(os.getenv("BATCH_CHECKPOINT_INTERVAL", 5))  # ...or after this many seconds
+DOCUMENT_EXTENSIONS = (".pdf",) + IMAGE_EXTENSIONS
+OUTPUT_FORMATS = ("jsonl", "parquet")
+PARQUET_ENGINES = ("pyarrow", "fastparquet")  # pandas writes Parquet through either
+
+
+def find_documents(root):
+    """
+    Return the paths of the PDFs and images under root, in a stable order.
+    """
+    paths = []
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(DOCUMENT_EXTENSIONS) and not filename.startswith("."):
+                paths.append(os.path.join(directory, filename))
+    return paths
+
+
+def document_key(root, path):
+    """
+    Identify a document by its path under root, size and modification time, so a file
+    that changes after it was processed is processed again.
+    """
+    stat = os.stat(path)
+    return f"{os.path.relpath(path, root)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def document_audit_id(root, key):
+    """
+    Derive the audit log id of a document from its key, so a document routed again after an
+    interruption keeps its id and none of its records are written twice. The id's timestamp
+    is the file's modification time, keeping ids roughly in time order like generated ones.
+    """
+    mtime_ns = int(key.rsplit(":", 1)[1])
+    digest = hashlib.sha256(f"{os.path.abspath(root)}\0{key}".encode("utf-8")).digest()
+    return ObjectId(struct.pack(">I", (mtime_ns // 10**9) & 0xFFFFFFFF) + digest[:8])
+
+
+class Checkpoint:
+    """
+    Append-only journal of finished documents, one JSON line each.
+    Documents that failed are retried on the next run.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.results = {}  # key -> result, last entry wins
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # A line cut short by an interruption
+                    self.results[entry["key"]] = entry["result"]
+        self._file = open(path, "a", encoding="utf-8")
+
+    def done(self, key):
+        return key in self.results and "error" not in self.results[key]
+
+    def record(self, key, result):
+        self.results[key] = result
+        self._file.write(json.dumps({"key": key, "result": result}, default=str) + "\n")
+        # Flushed per document: an interruption loses at most the documents still in flight
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def _init_worker(level, workers):
+    configure_logging(level=level)
+    # Every worker paces its own LLM calls, so each gets its share of the account's limits
+    llm_utils.rate_limiter = llm_utils.RateLimiter(
+        llm_utils.OPENAI_REQUESTS_PER_MINUTE / workers, llm_utils.OPENAI_TOKENS_PER_MINUTE / workers
+    )
+    # The parent handles Ctrl+C and shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def analyze_file(path, profile=None, language=None):
+    """
+    Extract, detect the language of and classify one document (runs in a worker process).
+    """
+    start = time.perf_counter()
+    extraction = extract_file(path, profile, language)
+    extracted_text = extraction["extracted_text"]
+    if not extracted_text.strip():
+        raise ValueError("No text could be extracted from the file.")
+    detection = detect_language(extracted_text)
+    decision = classify_document(extracted_text, language=detection["language"])
+    return {**extraction, **classification_fields(detection, decision), "seconds": time.perf_counter() - start}
+
+
+def route_result(filename, analysis, audit_id):
+    """
+    Log the document and trigger the agent matching its classification, as an upload would.
+    Returns the audit log id; raises if the audit log entry could not be written.
+    """
+    audit_status, agent_status = route_document(filename, {**analysis, "cache_hit": False}, audit_id)
+    if "audit_id" not in audit_status:
+        raise Exception(audit_status["status"])
+    return audit_status["audit_id"]
+
+
+def confirm_writes(checkpoint, routed):
+    """
+    Wait until the buffered writes of the routed documents (write-behind buffer, archive log
+    and search index) are done, then mark the documents done in the checkpoint. If a write
+    failed they are recorded as failed, to be routed again by the next run.
+    """
+    try:
+        write_buffer.flush()
+        archive_log.flush()
+        search_index.flush()
+        error = None
+    except Exception as e:
+        logger.error("Failed to write routed documents", extra={"documents": len(routed), "error": str(e)})
+        error = f"Routed, but its records were not all written: {e}"
+    for key, result in routed:
+        if error is not None:
+            result["error"] = error
+        checkpoint.record(key, result)
+    routed.clear()
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class Progress:
+    """
+    Report throughput and the estimated time remaining on stderr.
+    """
+    def __init__(self, total, interval=BATCH_PROGRESS_INTERVAL):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.start = time.monotonic()
+        self._last = self.start
+
+    def update(self, failed=False):
+        """
+        Count a finished document, reporting if the interval has passed or the run is complete.
+        """
+        self.done += 1
+        self.failed += failed
+        if time.monotonic() - self._last >= self.interval or self.done == self.total:
+            self.report()
+
+    def report(self):
+        now = self._last = time.monotonic()
+        elapsed = now - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        remaining = (self.total - self.done) / rate if rate > 0 else 0.0
+        print(
+            f"{self.done}/{self.total} documents, {self.failed} failed, {rate:.2f} docs/s, "
+            f"elapsed {format_duration(elapsed)}, ETA {format_duration(remaining)}",
+            file=sys.stderr, flush=True,
+        )
+
+
+def write_output(results, path, output_format):
+    """
+    Write the results as JSON lines or Parquet, in path order.
+    """
+    results = sorted(results, key=lambda result: result["path"])
+    if output_format == "parquet":
+        try:
+            pd.DataFrame(results).to_parquet(path, index=False)
+        except ImportError as e:
+            raise SystemExit(f"Parquet output needs one of {', '.join(PARQUET_ENGINES)} installed ({e}).")
+    else:
+        # Written directly, so each line keeps its own fields and types
+        with open(path, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, default=str, ensure_ascii=False) + "\n")
+
+
+def run_batch(root, checkpoint, workers=BATCH_WORKERS, profile=None, language=None, dry_run=False,
+              include_text=False, log_level="WARNING"):
+    """
+    Process every document under root not already in the checkpoint. Returns the number processed.
+    """
+    paths = [path for path in find_documents(root) if not checkpoint.done(document_key(root, path))]
+    progress = Progress(len(paths))
+    print(
+        f"{len(paths)} documents to process ({len(checkpoint.results)} in the checkpoint)"
+        + (", dry run" if dry_run else ""),
+        file=sys.stderr, flush=True,
+    )
+    if not paths:
+        return 0
+
+    # Each worker OCRs its own document's pages: a pool per worker would oversubscribe the cores
+    os.environ["OCR_WORKERS"] = "1"
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(log_level, workers),
+    )
+    pending = {}  # future -> (path, key)
+    routed = []  # (key, result) of routed documents whose writes are not confirmed yet
+    confirmed_at = time.monotonic()
+    queued = iter(paths)
+    try:
+        while True:
+            while len(pending) < workers * BATCH_IN_FLIGHT:
+                path = next(queued, None)
+                if path is None:
+                    break
+                pending[executor.submit(analyze_file, path, profile, language)] = (path, document_key(root, path))
+            if not pending:
+                break
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path, key = pending.pop(future)
+                result = {"path": os.path.relpath(path, root), "filename": os.path.basename(path)}
+                try:
+                    analysis = future.result()
+                    if not dry_run:
+                        audit_id = document_audit_id(root, key)
+                        result["audit_id"] = route_result(result["filename"], analysis, audit_id)
+                    extracted_text = analysis.pop("extracted_text")
+                    result.update(analysis, characters=len(extracted_text))
+                    if include_text:
+                        result["extracted_text"] = extracted_text
+                except Exception as e:
+                    logger.error("Failed to process document", extra={"document": path, "error": str(e)})
+                    result["error"] = str(e)
+                if dry_run or "error" in result:
+                    checkpoint.record(key, result)
+                else:
+                    # Marked done only once its writes are safe (see confirm_writes)
+                    routed.append((key, result))
+                progress.update(failed="error" in result)
+            if routed and (len(routed) >= BATCH_CHECKPOINT_SIZE or not pending
+                           or time.monotonic() - confirmed_at >= BATCH_CHECKPOINT_INTERVAL):
+                confirm_writes(checkpoint, routed)
+                confirmed_at = time.monotonic()
+    except KeyboardInterrupt:
+        for future in pending:
+            future.cancel()
+        progress.report()
+        raise SystemExit("Interrupted; run the same command again to resume from the checkpoint.")
+    finally:
+        if routed:
+            confirm_writes(checkpoint, routed)
+        executor.shutdown(wait=True, cancel_futures=True)
+        if not dry_run:
+            # Flush the buffered agent writes before reporting the run as finished
+            write_buffer.close()
+            archive_log.close()
+            search_index.close()
+    return progress.done
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Classify a directory tree of PDFs and images offline.",
+        epilog=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("input", help="Directory searched recursively for PDFs and images")
+    parser.add_argument("--output", required=True, help="Results file (.jsonl or .parquet)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, help="Output format (default: from the extension)")
+    parser.add_argument("--checkpoint", help="Progress journal (default: the output path + .checkpoint)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="Worker processes")
+    parser.add_argument("--ocr-profile", help="OCR profile: fast, balanced or accurate")
+    parser.add_argument("--language", help="Expected document language, e.g. es (detected if omitted)")
+    parser.add_argument("--dry-run", action="store_true", help="Classify only; write nothing to MongoDB")
+    parser.add_argument("--include-text", action="store_true", help="Include the extracted text in the results")
+    parser.add_argument("--log-level", default="WARNING", help="Log level for the pipeline's own logs")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.input):
+        raise SystemExit(f"Not a directory: {args.input}")
+    try:
+        resolve_ocr_profile(args.ocr_profile)
+        resolve_ocr_language(args.language)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    output_format = args.format or ("parquet" if args.output.lower().endswith(".parquet") else "jsonl")
+    if output_format == "parquet" and not any(importlib.util.find_spec(engine) for engine in PARQUET_ENGINES):
+        # Fail before the run rather than after it
+        raise SystemExit(f"Parquet output needs one of {', '.join(PARQUET_ENGINES)} installed.")
+    configure_logging(level=args.log_level)
+
+    checkpoint = Checkpoint(args.checkpoint or f"{args.output}.checkpoint")
+    start = time.monotonic()
+    try:
+        processed = run_batch(
+            args.input, checkpoint, max(1, args.workers), args.ocr_profile, args.language,
+            args.dry_run, args.include_text, args.log_level,
+        )
+    finally:
+        checkpoint.close()
+
+    # A document changed since an earlier run is listed under its latest result only
+    results = list({result["path"]: result for result in checkpoint.results.values()}.values())
+    write_output(results, args.output, output_format)
+    failed = sum(1 for result in results if "error" in result)
+    print(
+        f"Processed {processed} documents in {format_duration(time.monotonic() - start)}; "
+        f"wrote {len(results)} results ({failed} failed) to {args.output}.",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import os
+import asyncio
+import logging
+from app.ocr import OCR_WORKERS
+from app.pipeline import extract_document, classify_text_async, route_document_async
+from app.cache import result_cache
+from app.uploads import discard_upload
+from app.llm_utils import LLM_MAX_CONCURRENCY, LLM_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of documents in each stage of the bulk pipeline at any time
+BULK_OCR_CONCURRENCY = int(os.getenv("BULK_OCR_CONCURRENCY", OCR_WORKERS))
+# Enough documents classifying at once to fill every concurrent LLM request with a packed batch
+BULK_LLM_CONCURRENCY = int(os.getenv("BULK_LLM_CONCURRENCY", LLM_MAX_CONCURRENCY * LLM_BATCH_SIZE))
+BULK_DB_CONCURRENCY = int(os.getenv("BULK_DB_CONCURRENCY", 4))
+
+
+async def _process(item, ocr_slots, llm_slots, db_slots, profile=None, language=None):
+    """
+    Run one document through the OCR, classification and datastore stages.
+    Each stage only admits as many documents as its concurrency allows.
+    """
+    filename = item["filename"]
+    try:
+        analysis = await asyncio.to_thread(result_cache.get, item["digest"])
+        cache_hit = analysis is not None
+
+        if not cache_hit:
+            # OCR stage: pages fan out to the shared OCR process pool
+            async with ocr_slots:
+                extraction = await asyncio.to_thread(extract_document, item["file_location"], profile, language)
+            extracted_text = extraction["extracted_text"]
+            if not extracted_text.strip():
+                return {"index": item["index"], "filename": filename, "error": "No text could be extracted from the file."}
+
+            # LLM stage: language detection and classification
+            async with llm_slots:
+                analysis = {**extraction, **await classify_text_async(extracted_text)}
+            await asyncio.to_thread(result_cache.set, item["digest"], analysis)
+
+        # Datastore stage: audit log and classification agent
+        async with db_slots:
+            audit_status, agent_status = await route_document_async(filename, {**analysis, "cache_hit": cache_hit})
+
+        return {
+            "index": item["index"],
+            "filename": filename,
+            "classification": analysis["classification"],
+            "language": analysis["language"],
+            "classification_tier": analysis.get("classification_tier"),
+            "extraction_method": analysis.get("extraction_method"),
+            "audit_status": audit_status,
+            "agent_status": agent_status,
+            "cache_hit": cache_hit,
+        }
+    except Exception as e:
+        logger.exception("Error processing file", extra={"document": filename})
+        return {"index": item["index"], "filename": filename, "error": str(e)}
+    finally:
+        # Ensure the uploaded file is removed
+        discard_upload(item["file_location"])
+
+
+async def run_bulk_pipeline(items, profile=None, language=None):
+    """
+    Process saved uploads concurrently through the staged pipeline,
+    yielding each file's result as soon as it finishes.
+    Each item is a dict with index, filename, file_location and digest (the result cache key).
+    profile and language select the OCR profile and language pack for every file.
+    """
+    ocr_slots = asyncio.Semaphore(BULK_OCR_CONCURRENCY)
+    llm_slots = asyncio.Semaphore(BULK_LLM_CONCURRENCY)
+    db_slots = asyncio.Semaphore(BULK_DB_CONCURRENCY)
+
+    tasks = [
+        asyncio.create_task(_process(item, ocr_slots, llm_slots, db_slots, profile, language))
+        for item in items
+    ]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        # The client went away: stop the remaining work
+        for item, task in zip(items, tasks):
+            if not task.done():
+                task.cancel()
+                # A task cancelled before it started never reaches its own cleanup
+                discard_upload(item["file_location"])
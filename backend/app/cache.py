@@ -0,0 +1,136 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from app.mongo_utils import get_db
+
+logger = logging.getLogger(__name__)
+
+# Result cache configuration
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 1024))  # Entries kept in process memory
+RESULT_CACHE_MAX_DOCUMENTS = int(os.getenv("RESULT_CACHE_MAX_DOCUMENTS", 100000))  # Entries kept in MongoDB
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", 30 * 24 * 3600))  # Seconds before an entry expires
+# Seconds a result from a fallback tier is kept (0 does not cache it), so the document is classified
+# properly once the LLM is back
+RESULT_CACHE_FALLBACK_TTL = int(os.getenv("RESULT_CACHE_FALLBACK_TTL", 300))
+# Tiers that only stand in for the LLM while it is failing
+FALLBACK_TIERS = ("patterns",)
+
+# How often (in writes) the MongoDB store is trimmed back to its maximum size
+TRIM_INTERVAL = 100
+
+
+class ResultCache:
+    """
+    Content-addressed cache of pipeline results (extracted text, language, classification),
+    keyed by the SHA-256 of the uploaded bytes.
+    An in-process LRU sits in front of a MongoDB collection shared by all workers.
+    """
+    def __init__(self, collection_name="result_cache", max_items=RESULT_CACHE_SIZE,
+                 max_documents=RESULT_CACHE_MAX_DOCUMENTS, ttl=RESULT_CACHE_TTL, fallback_ttl=RESULT_CACHE_FALLBACK_TTL):
+        self.collection_name = collection_name
+        self.max_items = max_items
+        self.max_documents = max_documents
+        self.ttl = ttl
+        self.fallback_ttl = min(fallback_ttl, ttl)
+        self._lru = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._indexes_ready = False
+
+    @property
+    def collection(self):
+        return get_db()[self.collection_name]
+
+    def _ensure_indexes(self):
+        if self._indexes_ready:
+            return
+        # MongoDB removes expired entries in the background
+        self.collection.create_index("created_at", expireAfterSeconds=self.ttl)
+        self._indexes_ready = True
+
+    def _remember(self, key, value, expires_at):
+        with self._lock:
+            self._lru[key] = (expires_at, value)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_items:
+                self._lru.popitem(last=False)
+
+    def get(self, key):
+        """
+        Return the cached result for the key, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._lru.move_to_end(key)
+                    return dict(value)
+                del self._lru[key]
+
+        try:
+            document = self.collection.find_one({"_id": key})
+        except Exception as e:
+            logger.warning("Result cache lookup failed", extra={"error": str(e)})
+            return None
+        if document is None:
+            return None
+
+        # The TTL monitor only runs periodically, so check the age here as well
+        expires_at = document["created_at"] + timedelta(seconds=self.ttl)
+        if expires_at <= datetime.utcnow():
+            return None
+        value = document["result"]
+        self._remember(key, value, now + (expires_at - datetime.utcnow()).total_seconds())
+        return dict(value)
+
+    def set(self, key, value):
+        """
+        Store a result under the key in memory and in MongoDB.
+        A result decided by a fallback tier is only kept for the fallback TTL.
+        """
+        ttl = self.fallback_ttl if value.get("classification_tier") in FALLBACK_TIERS else self.ttl
+        if ttl <= 0:
+            return
+        self._remember(key, dict(value), time.time() + ttl)
+
+        try:
+            self._ensure_indexes()
+            # Entries expire ttl after created_at (see _ensure_indexes), so a shorter-lived one is stored as older
+            created_at = datetime.utcnow() - timedelta(seconds=self.ttl - ttl)
+            self.collection.replace_one(
+                {"_id": key},
+                {"_id": key, "result": dict(value), "created_at": created_at},
+                upsert=True,
+            )
+            self._writes += 1
+            if self._writes % TRIM_INTERVAL == 0:
+                self._trim()
+        except Exception as e:
+            logger.warning("Result cache write failed", extra={"error": str(e)})
+
+    def clear(self):
+        """
+        Drop every cached result, in memory and in MongoDB.
+        """
+        with self._lock:
+            self._lru.clear()
+        self.collection.delete_many({})
+
+    def _trim(self):
+        """
+        Drop the oldest entries once the store grows past its maximum size.
+        """
+        excess = self.collection.estimated_document_count() - self.max_documents
+        if excess <= 0:
+            return
+        oldest = self.collection.find({}, {"_id": 1}).sort("created_at", 1).limit(excess)
+        self.collection.delete_many({"_id": {"$in": [document["_id"] for document in oldest]}})
+
+
+# Instantiate the shared cache
+result_cache = ResultCache()
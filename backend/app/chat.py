@@ -0,0 +1,128 @@
+import os
+import re
+import math
+import logging
+from collections import Counter
+from bson import ObjectId
+from bson.errors import InvalidId
+from app.llm_utils import estimate_tokens
+from app.classifier import RELEVANT_PHRASES, clean_text
+from app.mongo_utils import get_async_db
+from app.text_store import load_text_async
+
+logger = logging.getLogger(__name__)
+
+# Chat context configuration
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", 1500))  # Tokens of document excerpts per request
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", 3000))  # Tokens of conversation history per request
+PASSAGE_CHARS = 600  # Size of the passages a document is split into for retrieval
+
+WORD = re.compile(r"\w+")
+
+
+class DocumentNotFound(Exception):
+    """
+    Raised when a chat refers to an audit log entry that does not exist.
+    """
+
+
+def split_passages(text, size=PASSAGE_CHARS):
+    """
+    Split text into passages of roughly size characters, breaking on line ends.
+    """
+    passages, current = [], ""
+    for line in text.splitlines():
+        if current and len(current) + len(line) + 1 > size:
+            passages.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        passages.append(current)
+    return passages
+
+
+def relevant_excerpts(text, query, budget=CHAT_CONTEXT_TOKENS):
+    """
+    Return the passages of the document most relevant to the query, within the token budget.
+    Passages are scored by the IDF-weighted overlap of their words with the query, and those
+    containing cease-style phrases are preferred; the chosen ones are returned in document order.
+    """
+    passages = split_passages(clean_text(text))
+    if not passages:
+        return []
+    if estimate_tokens(text) <= budget:
+        return passages
+
+    words = [Counter(word.lower() for word in WORD.findall(passage)) for passage in passages]
+    frequency = Counter(word for counts in words for word in counts)
+    query_words = {word.lower() for word in WORD.findall(query)}
+
+    def score(index):
+        overlap = sum(
+            (1 + math.log(words[index][word])) * math.log(1 + len(passages) / frequency[word])
+            for word in query_words if word in words[index]
+        )
+        # Ties go to the start of the document, where the request is usually stated
+        return overlap + (1.0 if RELEVANT_PHRASES.search(passages[index]) else 0.0), -index
+
+    chosen, used = [], 0
+    for index in sorted(range(len(passages)), key=score, reverse=True):
+        tokens = estimate_tokens(passages[index])
+        if used + tokens > budget:
+            continue
+        chosen.append(index)
+        used += tokens
+    return [passages[index] for index in sorted(chosen)]
+
+
+def trim_history(messages, budget=CHAT_HISTORY_TOKENS):
+    """
+    Keep the most recent messages that fit within the token budget (always the last one).
+    """
+    kept, used = [], 0
+    for message in reversed(messages):
+        used += estimate_tokens(message["content"])
+        if kept and used > budget:
+            break
+        kept.append(message)
+    return list(reversed(kept))
+
+
+async def find_audit_log(audit_id):
+    """
+    Return the audit log entry with the given id, or raise DocumentNotFound.
+    """
+    try:
+        object_id = ObjectId(audit_id)
+    except (InvalidId, TypeError):
+        raise DocumentNotFound(f"Invalid audit log id '{audit_id}'.")
+    entry = await get_async_db()["audit_logs"].find_one({"_id": object_id})
+    if entry is None:
+        raise DocumentNotFound(f"Audit log entry '{audit_id}' not found.")
+    return entry
+
+
+async def build_chat_messages(messages, language=None, audit_id=None):
+    """
+    Build the messages sent to the model: a system message with the document language and,
+    when an audit log id is given, excerpts of that document relevant to the latest message,
+    followed by the conversation history.
+    """
+    context = []
+    if language and language != "unknown":
+        context.append(f"The detected language of the document is '{language}'.")
+    if audit_id:
+        entry = await find_audit_log(audit_id)
+        query = messages[-1]["content"] if messages else ""
+        excerpts = relevant_excerpts(await load_text_async(entry) or "", query)
+        logger.info("Attached document excerpts", extra={"audit_id": audit_id, "excerpts": len(excerpts)})
+        context.append(
+            f"The user is asking about the document '{entry.get('filename')}', "
+            f"classified as {entry.get('classification')}. Relevant excerpts:\n"
+            + "\n---\n".join(excerpts)
+        )
+
+    history = trim_history(messages)
+    if not context:
+        return history
+    return [{"role": "system", "content": "\n".join(context)}] + history
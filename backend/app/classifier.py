@@ -1,70 +1,492 @@
+import os
 import re
-from app.llm_utils import get_llm_response
+import asyncio
+import logging
+import threading
+import joblib
+from concurrent.futures import ThreadPoolExecutor
+from app.llm_utils import estimate_tokens, get_llm_response, get_llm_response_async, llm_dispatcher
+from app.metrics import LLM_FALLBACKS, time_stage
 
-def classify_request(text, language="en"):
+logger = logging.getLogger(__name__)
+
+# Labels the classifier may return
+CLASSIFICATION_LABELS = ("Cease", "Uncertain", "Irrelevant")
+
+# Prompt budget configuration
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 1500))  # Tokens of document text per prompt
+MAX_CLASSIFICATION_CHUNKS = int(os.getenv("MAX_CLASSIFICATION_CHUNKS", 4))  # Prompts per document at most
+SPAN_CONTEXT_CHARS = int(os.getenv("SPAN_CONTEXT_CHARS", 400))  # Context kept around each relevant phrase
+LABEL_MAX_TOKENS = 5  # Enough for any single label
+# Documents up to this many tokens are packed with others into shared LLM requests
+PACKED_DOCUMENT_TOKENS = int(os.getenv("PACKED_DOCUMENT_TOKENS", 500))
+CLASSIFICATION_INSTRUCTIONS = (
+    'Classify the following text into one of three categories: "Cease", "Uncertain", or "Irrelevant".'
+)
+
+# Tiered classification configuration: the LLM is only called when both local tiers are below threshold
+RULE_CONFIDENCE_THRESHOLD = float(os.getenv("RULE_CONFIDENCE_THRESHOLD", 0.9))
+MODEL_CONFIDENCE_THRESHOLD = float(os.getenv("MODEL_CONFIDENCE_THRESHOLD", 0.9))
+CLASSIFIER_MODEL_PATH = os.getenv("CLASSIFIER_MODEL_PATH", "models/classifier.joblib")
+
+# Regular expressions for "Cease"
+CEASE_PATTERNS = [
+    r"cease and desist",
+    r"stop communication",
+    r"do\s?n[oa]t contact me",  # Matches "do not", "do nct", "do nat", etc.
+    r"cease all communications",
+    r"stop all communications",
+    r"do not reach out",
+    r"do not email me",
+    r"do not call me",
+    r"stop contacting me",
+    r"no further communication",
+    r"refrain from initiating further direct contact",  # Specific legal phrasing
+]
+
+# Keywords for "Uncertain"
+UNCERTAIN_KEYWORDS = [
+    "manual review",
+    "requires further clarification",
+    "needs clarification",
+    "unclear request",
+    "pending confirmation",
+    "verification of authority",
+]
+
+# Cease phrasing in the other languages the pipeline detects; English phrases are matched in every language
+LANGUAGE_CEASE_PATTERNS = {
+    "es": [
+        r"cese y desista",
+        r"dejen? de (contactarme|llamarme)",
+        r"no me (contacten|llamen) m[aá]s",
+        r"cesen? toda comunicaci[oó]n",
+    ],
+    "fr": [
+        r"cessez de me (contacter|harceler)",
+        r"ne me contactez plus",
+        r"cesser toute communication",
+        r"mise en demeure de cesser",
+    ],
+    "de": [
+        r"kontaktieren sie mich nicht mehr",
+        r"unterlassen sie (jede|jegliche) kontaktaufnahme",
+        r"stellen sie (jede|jegliche) kommunikation ein",
+    ],
+    "it": [r"smettete di contattarmi", r"non contattatemi pi[uù]", r"cessare ogni comunicazione"],
+    "pt": [
+        r"parem de me (contactar|contatar)",
+        r"n[aã]o me (contactem|contatem) mais",
+        r"cessar toda (a )?comunica[cç][aã]o",
+    ],
+    "nl": [r"neem geen contact meer met mij op", r"stop met het contacteren", r"staak (alle|iedere) communicatie"],
+}
+LANGUAGE_CEASE_CONFIDENCE = 0.92
+# Language names used in prompts for non-English documents
+LANGUAGE_NAMES = {"es": "Spanish", "fr": "French", "de": "German", "it": "Italian", "pt": "Portuguese", "nl": "Dutch"}
+# The model tier is trained on English letters and is only trusted for them
+MODEL_TIER_LANGUAGES = ("en", "unknown")
+
+# Confidence of the rule tier for each pattern; explicit legal phrasing is decisive, loose wording less so
+CEASE_PATTERN_CONFIDENCE = {
+    r"cease and desist": 0.97,
+    r"cease all communications": 0.97,
+    r"refrain from initiating further direct contact": 0.97,
+    r"stop all communications": 0.95,
+    r"stop contacting me": 0.93,
+    r"do\s?n[oa]t contact me": 0.92,
+    r"no further communication": 0.9,
+}
+DEFAULT_CEASE_CONFIDENCE = 0.85
+UNCERTAIN_CONFIDENCE = 0.75
+
+# All rule patterns compiled into one matcher; the named group tells which pattern matched
+RULE_MATCHER = re.compile(
+    "|".join(
+        [f"(?P<cease{i}>{pattern})" for i, pattern in enumerate(CEASE_PATTERNS)]
+        + [f"(?P<uncertain{i}>{re.escape(keyword)})" for i, keyword in enumerate(UNCERTAIN_KEYWORDS)]
+    ),
+    re.IGNORECASE,
+)
+
+# One matcher per language for the language-specific cease phrases
+LANGUAGE_RULE_MATCHERS = {
+    language: re.compile("|".join(patterns), re.IGNORECASE) for language, patterns in LANGUAGE_CEASE_PATTERNS.items()
+}
+
+# Phrases the rule tier acts on: their surroundings are always kept when a document is over budget
+KEY_PHRASES = re.compile("|".join(CEASE_PATTERNS + [re.escape(keyword) for keyword in UNCERTAIN_KEYWORDS]), re.IGNORECASE)
+# Phrases whose surroundings are kept as well while the budget allows
+RELEVANT_PHRASES = re.compile(
+    "|".join(CEASE_PATTERNS + [re.escape(keyword) for keyword in UNCERTAIN_KEYWORDS]
+             + [r"\bcease\b", r"\bdesist\b", r"\bcontact\b", r"\bcommunicat\w*", r"\bharass\w*", r"\battorney\b"]),
+    re.IGNORECASE,
+)
+
+# Lines that carry no signal: page numbers, rules, fax headers and the like
+BOILERPLATE_LINE = re.compile(r"^\s*(page\s+\d+(\s+of\s+\d+)?|[\W_\d]*|fax\s*:.*|tel\s*:.*|phone\s*:.*)\s*$", re.IGNORECASE)
+
+
+def clean_text(text):
+    """
+    Drop boilerplate lines and repeated lines (letterheads, footers) and collapse whitespace.
+    """
+    seen = set()
+    lines = []
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        key = line.lower()
+        if not line or BOILERPLATE_LINE.match(line) or key in seen:
+            continue
+        seen.add(key)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def relevant_spans(text, patterns=(RELEVANT_PHRASES,), context=SPAN_CONTEXT_CHARS):
+    """
+    Return the passages surrounding matches of any of the patterns, merged where they overlap.
+    """
+    matches = sorted((match.start(), match.end()) for pattern in patterns for match in pattern.finditer(text))
+    spans = []
+    for match_start, match_end in matches:
+        start, end = max(0, match_start - context), min(len(text), match_end + context)
+        if spans and start <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], max(spans[-1][1], end))
+        else:
+            spans.append((start, end))
+    return [text[start:end] for start, end in spans]
+
+
+def split_chunks(text, budget=PROMPT_TOKEN_BUDGET, max_chunks=MAX_CLASSIFICATION_CHUNKS):
+    """
+    Split text into at most max_chunks pieces (any number for None) of roughly budget tokens,
+    breaking on line ends.
+    """
+    limit = budget * 4
+    chunks, current = [], ""
+    for line in text.splitlines():
+        while len(line) > limit:
+            # A single line longer than the budget is cut where it falls
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if current and len(current) + len(line) + 1 > limit:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        chunks.append(current)
+    if max_chunks is not None and len(chunks) > max_chunks:
+        logger.warning("Dropping chunks over the limit", extra={"chunks": len(chunks), "kept": max_chunks})
+        chunks = chunks[:max_chunks]
+    return chunks
+
+
+def classification_instructions(language="en"):
+    """
+    Return the classification instructions, naming the document language when it is not English.
+    """
+    if language not in LANGUAGE_NAMES:
+        return CLASSIFICATION_INSTRUCTIONS
+    # The answer must stay one of the English category names whatever the document language
+    return (
+        f"{CLASSIFICATION_INSTRUCTIONS} "
+        f"The text is written in {LANGUAGE_NAMES[language]}; answer with the English category name."
+    )
+
+
+def build_classification_prompt(text, language="en"):
+    """
+    Build the OpenAI classification prompt for the extracted text.
+    """
+    # Define the classification prompt for OpenAI
+    return f"""
+    {classification_instructions(language)}
+    Answer with the category name only.
+    Text: {text}
+    Classification:
+    """
+
+
+def build_classification_texts(text, budget=PROMPT_TOKEN_BUDGET, language="en"):
+    """
+    Reduce a document to the texts the LLM needs to see within the token budget.
+    - Short documents are sent whole (minus boilerplate)
+    - Longer ones are reduced to the passages around cease-style phrases
+    - If that is still over budget, the text is split into chunks classified separately:
+      the passages around the phrases the rule tier acts on come first and are never
+      dropped, and the rest of the excerpt fills the remaining MAX_CLASSIFICATION_CHUNKS
+    """
+    text = clean_text(text)
+    if estimate_tokens(text) <= budget:
+        return [text]
+
+    spans = relevant_spans(text)
+    if spans:
+        excerpt = "\n...\n".join(spans)
+        if estimate_tokens(excerpt) <= budget:
+            return [excerpt]
+        text = excerpt
+
+    patterns = (KEY_PHRASES,) + ((LANGUAGE_RULE_MATCHERS[language],) if language in LANGUAGE_RULE_MATCHERS else ())
+    key_spans = relevant_spans(text, patterns)
+    key_chunks = split_chunks("\n...\n".join(key_spans), budget, max_chunks=None) if key_spans else []
+    if len(key_chunks) > MAX_CLASSIFICATION_CHUNKS:
+        logger.info("Classifying every key passage over the chunk limit", extra={"chunks": len(key_chunks)})
+    return key_chunks + split_chunks(text, budget, max(0, MAX_CLASSIFICATION_CHUNKS - len(key_chunks)))
+
+
+def build_classification_prompts(text, language="en", budget=PROMPT_TOKEN_BUDGET):
+    """
+    Build the prompts needed to classify a document within the token budget.
+    """
+    return [
+        build_classification_prompt(chunk, language) for chunk in build_classification_texts(text, budget, language)
+    ]
+
+
+def parse_label(response):
+    """
+    Validate the LLM output against the three labels.
+    """
+    answer = response.strip().strip("\"'.").lower()
+    for label in CLASSIFICATION_LABELS:
+        if answer.startswith(label.lower()):
+            return label
+    raise ValueError(f"Unexpected classification from LLM: {response!r}")
+
+
+def combine_labels(labels, rule_label=None):
+    """
+    Voting rule for chunked documents: a cease request anywhere in the document is binding,
+    otherwise any uncertain chunk sends the document to review, otherwise it is irrelevant.
+    rule_label is the rule tier's label: a Cease it found, even below its threshold, is a
+    lower bound on the result.
+    """
+    if rule_label == "Cease":
+        labels = [*labels, rule_label]
+    for label in CLASSIFICATION_LABELS:
+        if label in labels:
+            return label
+    return "Irrelevant"
+
+
+def score_by_rules(text, language="en"):
+    """
+    Rule tier: run the compiled matcher once over the text, plus the matcher for the
+    document language when it has one.
+    Returns (label, confidence); confidence is 0 when nothing matched.
+    """
+    cease_confidence, cease_matches, uncertain_matches = 0.0, 0, 0
+    for match in RULE_MATCHER.finditer(text):
+        group = match.lastgroup
+        if group.startswith("cease"):
+            pattern = CEASE_PATTERNS[int(group[len("cease"):])]
+            cease_confidence = max(cease_confidence, CEASE_PATTERN_CONFIDENCE.get(pattern, DEFAULT_CEASE_CONFIDENCE))
+            cease_matches += 1
+        else:
+            uncertain_matches += 1
+    if language in LANGUAGE_RULE_MATCHERS:
+        for _ in LANGUAGE_RULE_MATCHERS[language].finditer(text):
+            cease_confidence = max(cease_confidence, LANGUAGE_CEASE_CONFIDENCE)
+            cease_matches += 1
+
+    if cease_matches:
+        # Each further cease phrase adds to the evidence
+        return "Cease", min(0.99, cease_confidence + 0.03 * (cease_matches - 1))
+    if uncertain_matches:
+        return "Uncertain", UNCERTAIN_CONFIDENCE
+    # Absence of a phrase is no evidence of irrelevance
+    return "Irrelevant", 0.0
+
+
+class IncrementalClassifier:
+    """
+    Screens pages as they come out of OCR and reports when the document is decisively a
+    cease request, so the remaining pages need not be OCR'd.
+    """
+    # Characters carried over from the previous page, for phrases split across a page break
+    OVERLAP_CHARS = 200
+
+    def __init__(self, threshold=RULE_CONFIDENCE_THRESHOLD, language="en"):
+        self.threshold = threshold
+        self.language = language
+        self._tail = ""
+
+    def feed(self, page_text):
+        """
+        Add the next page; returns True once a decisive Cease match has been seen.
+        """
+        label, confidence = score_by_rules(f"{self._tail}\n{page_text}", self.language)
+        self._tail = page_text[-self.OVERLAP_CHARS:]
+        return label == "Cease" and confidence >= self.threshold
+
+
+class ModelTier:
+    """
+    TF-IDF + linear model trained offline (see app/train_classifier.py), loaded once on first use.
+    """
+    def __init__(self, path=CLASSIFIER_MODEL_PATH):
+        self.path = path
+        self._model = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                if os.path.exists(self.path):
+                    self._model = joblib.load(self.path)
+                    logger.info("Loaded classifier model", extra={"path": self.path})
+        return self._model
+
+    def score(self, text):
+        """
+        Returns (label, confidence), or (None, 0.0) when no model has been trained.
+        """
+        model = self._model if self._loaded else self._load()
+        if model is None:
+            return None, 0.0
+        probabilities = model.predict_proba([text])[0]
+        best = probabilities.argmax()
+        return str(model.classes_[best]), float(probabilities[best])
+
+
+model_tier = ModelTier()
+
+
+def _local_decision(text, language="en", rules=None):
+    """
+    Try the rule tier, then the model tier. Returns a decision, or None if the LLM is needed.
+    rules is the rule tier's (label, confidence) if already scored.
+    """
+    label, confidence = rules or score_by_rules(text, language)
+    if confidence >= RULE_CONFIDENCE_THRESHOLD:
+        return {"classification": label, "tier": "rules", "confidence": confidence}
+    if language not in MODEL_TIER_LANGUAGES:
+        return None
+
+    try:
+        label, confidence = model_tier.score(text)
+    except Exception as e:
+        logger.warning("Model tier failed", extra={"error": str(e)})
+        label, confidence = None, 0.0
+    if label in CLASSIFICATION_LABELS and confidence >= MODEL_CONFIDENCE_THRESHOLD:
+        return {"classification": label, "tier": "model", "confidence": confidence}
+    return None
+
+
+def _ask_llm(prompt):
+    with time_stage("llm"):
+        response = get_llm_response(prompt, temperature=0, max_tokens=LABEL_MAX_TOKENS)
+    return parse_label(response)
+
+
+async def _ask_llm_async(prompt):
+    with time_stage("llm"):
+        response = await get_llm_response_async(prompt, temperature=0, max_tokens=LABEL_MAX_TOKENS)
+    return parse_label(response)
+
+
+async def _ask_llm_packed(text, language="en"):
+    """
+    Classify a short text in a request shared with other documents,
+    falling back to a request of its own if the packed one fails.
+    """
+    try:
+        with time_stage("llm"):
+            label = await llm_dispatcher.classify(text, CLASSIFICATION_LABELS, classification_instructions(language))
+        return parse_label(label)
+    except Exception as e:
+        logger.warning("Packed classification failed, asking separately", extra={"error": str(e)})
+    return await _ask_llm_async(build_classification_prompt(text, language))
+
+
+def classify_document(text, language="en"):
     """
     Classify the extracted text into one of three categories:
     - Cease: Requests to stop communication.
     - Uncertain: Requests that require manual review.
     - Irrelevant: Requests that are not related to "Cease."
+    The rule and model tiers answer first; the LLM is only asked when neither is confident.
+    Returns a dict with the classification, the tier that decided it and its confidence.
     """
-    # Preprocess the text based on the detected language
-    if language != "en":
-        print(f"Preprocessing text for language: {language}")
-        # Add language-specific preprocessing here (e.g., translation, normalization)
+    with time_stage("classify"):
+        rules = score_by_rules(text, language)
+        decision = _local_decision(text, language, rules)
+    if decision is not None:
+        return decision
 
-    # Define the classification prompt for OpenAI
-    prompt = f"""
-    Classify the following text into one of three categories: "Cease", "Uncertain", or "Irrelevant".
-    Text: {text}
-    Classification:
+    prompts = build_classification_prompts(text, language)
+
+    # Try to classify using OpenAI, one request per chunk in parallel
+    try:
+        if len(prompts) == 1:
+            labels = [_ask_llm(prompts[0])]
+        else:
+            logger.info("Classifying document in chunks", extra={"chunks": len(prompts)})
+            with ThreadPoolExecutor(max_workers=len(prompts)) as pool:
+                labels = list(pool.map(_ask_llm, prompts))
+        return {"classification": combine_labels(labels, rules[0]), "tier": "llm", "confidence": None}
+    except Exception as e:
+        logger.warning("LLM classification failed, falling back to patterns", extra={"error": str(e)})
+        LLM_FALLBACKS.inc()
+
+    return {"classification": classify_by_patterns(text, language), "tier": "patterns", "confidence": None}
+
+
+async def classify_document_async(text, language="en"):
     """
+    Async version of classify_document, for use from the event loop.
+    """
+    with time_stage("classify"):
+        rules = score_by_rules(text, language)
+        decision = _local_decision(text, language, rules)
+    if decision is not None:
+        return decision
+
+    texts = build_classification_texts(text, language=language)
 
-    # Try to classify using OpenAI
+    # Try to classify using OpenAI: short documents share packed requests, long ones get one request per chunk
     try:
-        classification = get_llm_response(prompt)
-        return classification.strip()  # Ensure no extra whitespace
+        if len(texts) == 1 and estimate_tokens(texts[0]) <= PACKED_DOCUMENT_TOKENS:
+            label = await _ask_llm_packed(texts[0], language)
+            return {"classification": combine_labels([label], rules[0]), "tier": "llm", "confidence": None}
+        if len(texts) > 1:
+            logger.info("Classifying document in chunks", extra={"chunks": len(texts)})
+        labels = await asyncio.gather(
+            *(_ask_llm_async(build_classification_prompt(chunk, language)) for chunk in texts)
+        )
+        return {"classification": combine_labels(labels, rules[0]), "tier": "llm", "confidence": None}
     except Exception as e:
-        print(f"LLM classification failed: {str(e)}")
-        print("Falling back to pattern-based classification.")
-
-    # Fallback to pattern-based classification
-    text = text.lower()  # Convert to lowercase for case-insensitive matching
-
-    # Regular expressions for "Cease"
-    cease_patterns = [
-        r"cease and desist",
-        r"stop communication",
-        r"do\s?n[oa]t contact me",  # Matches "do not", "do nct", "do nat", etc.
-        r"cease all communications",
-        r"stop all communications",
-        r"do not reach out",
-        r"do not email me",
-        r"do not call me",
-        r"stop contacting me",
-        r"no further communication",
-        r"refrain from initiating further direct contact",  # Specific legal phrasing
-    ]
+        logger.warning("LLM classification failed, falling back to patterns", extra={"error": str(e)})
+        LLM_FALLBACKS.inc()
 
-    # Keywords for "Uncertain"
-    uncertain_keywords = [
-        "manual review",
-        "requires further clarification",
-        "needs clarification",
-        "unclear request",
-        "pending confirmation",
-        "verification of authority",
-    ]
+    return {"classification": classify_by_patterns(text, language), "tier": "patterns", "confidence": None}
+
+
+def classify_request(text, language="en"):
+    """
+    Classify the extracted text and return the label only.
+    """
+    return classify_document(text, language)["classification"]
 
-    # Check for "Cease" patterns
-    for pattern in cease_patterns:
-        if re.search(pattern, text):
-            return "Cease"
 
-    # Check for "Uncertain" keywords
-    for keyword in uncertain_keywords:
-        if keyword in text:
-            return "Uncertain"
+async def classify_request_async(text, language="en"):
+    """
+    Async version of classify_request, for use from the event loop.
+    """
+    return (await classify_document_async(text, language))["classification"]
 
-    # Default to "Irrelevant" if no patterns match
-    return "Irrelevant"
\ No newline at end of file
+
+def classify_by_patterns(text, language="en"):
+    """
+    Pattern-based classification, used when the LLM is unavailable.
+    """
+    # A single pass of the compiled matcher; any cease phrase wins over uncertain keywords
+    label, confidence = score_by_rules(text, language)
+    return label
@@ -0,0 +1,175 @@
+import os
+import json
+import base64
+import binascii
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING
+from app.agents import DASHBOARD_COLLECTIONS, WRITE_FLUSH_INTERVAL, write_buffer
+from app.mongo_utils import get_async_db
+
+# Feed configuration
+FEED_PAGE_SIZE = int(os.getenv("FEED_PAGE_SIZE", 50))  # Records per page by default
+FEED_MAX_PAGE_SIZE = int(os.getenv("FEED_MAX_PAGE_SIZE", 500))
+# Records younger than this may still be waiting in another process's write-behind buffer with an
+# earlier created_at, so delta reads stop short of them and pick them up on the next refresh. This
+# process's own buffer is checked directly (see read_feed)
+FEED_SETTLE_SECONDS = float(os.getenv("FEED_SETTLE_SECONDS", WRITE_FLUSH_INTERVAL + 2))
+
+# Fields listed per collection; the large text fields are never sent (the text is loaded via text_ref)
+FEED_FIELDS = {
+    "audit_logs": ["filename", "classification", "classification_tier", "language", "extraction_method",
+                   "timestamp", "text_ref", "text_length", "duplicate_cluster", "duplicate_of"],
+    "classification_logs": ["filename", "classification", "tier", "confidence", "timestamp"],
+    "datastore": ["filename", "language", "timestamp"],
+    "manual_review": ["filename", "language", "timestamp", "text_ref", "text_length", "duplicate_cluster"],
+}
+# Most recent review records grouped into duplicate clusters
+REVIEW_CLUSTER_WINDOW = int(os.getenv("REVIEW_CLUSTER_WINDOW", 2000))
+REVIEW_CLUSTER_RECORDS = 20  # Records listed per cluster at most
+# Collections whose records are posted by the dashboard itself, so have no fixed shape
+FEED_EXCLUDED_FIELDS = {"extracted_text": 0}
+# Cursor stand-in for "every record at this instant", whatever its id
+LAST_ID = ObjectId("f" * 24)
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised for a cursor that was not issued by this API.
+    """
+
+
+def encode_cursor(created_at, record_id):
+    """
+    Return the opaque cursor for a position in a feed.
+    """
+    position = {"t": created_at.isoformat(), "id": str(record_id)}
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Return the (created_at, _id) position a cursor stands for.
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(position["t"]), ObjectId(position["id"])
+    except (binascii.Error, ValueError, KeyError, TypeError, InvalidId):
+        raise InvalidCursor("Invalid cursor.")
+
+
+def _projection(collection_name):
+    if collection_name in FEED_FIELDS:
+        return {"created_at": 1, **{field: 1 for field in FEED_FIELDS[collection_name]}}
+    return FEED_EXCLUDED_FIELDS
+
+
+def _serialize(record):
+    record["id"] = str(record.pop("_id"))
+    if isinstance(record.get("created_at"), datetime):
+        record["created_at"] = record["created_at"].isoformat()
+    return record
+
+
+async def read_feed(collection_name, limit=FEED_PAGE_SIZE, cursor=None, since=None):
+    """
+    Read a page of a dashboard collection using keyset pagination on (created_at, _id).
+    - Without since, records are returned newest first; cursor continues after the previous page.
+    - With since, only records written after that position are returned, oldest first,
+      so a refresh costs work in proportion to the new activity.
+    Returns {"items", "next_cursor", "since", "has_more"}:
+    - next_cursor pages further back (None at the end of the feed)
+    - since is the position to pass on the next refresh
+    - has_more is True when a delta was cut off at limit (read again with the new since)
+    Records are identified by "id"; a refresh may repeat a record already listed. It never skips one
+    written through this process's write-behind buffer. Records from other processes (e.g. a batch
+    run) are only waited for FEED_SETTLE_SECONDS, so one whose write took longer can be skipped.
+    """
+    if collection_name not in DASHBOARD_COLLECTIONS:
+        raise KeyError(collection_name)
+    limit = max(1, min(limit, FEED_MAX_PAGE_SIZE))
+    collection = get_async_db()[collection_name]
+    # Everything created before the watermark has left this process's write-behind buffer, and has
+    # had FEED_SETTLE_SECONDS to leave those of other processes
+    watermark = datetime.utcnow() - timedelta(seconds=FEED_SETTLE_SECONDS)
+    oldest = write_buffer.oldest_unwritten(collection_name)
+    if oldest is not None:
+        watermark = min(watermark, oldest)
+
+    if since is not None:
+        created_at, record_id = decode_cursor(since)
+        query = {
+            "$or": [{"created_at": {"$gt": created_at}}, {"created_at": created_at, "_id": {"$gt": record_id}}],
+            "created_at": {"$lt": watermark},
+        }
+        documents = await (
+            collection.find(query, _projection(collection_name))
+            .sort([("created_at", ASCENDING), ("_id", ASCENDING)])
+            .limit(limit)
+            .to_list(None)
+        )
+        if documents:
+            since = encode_cursor(documents[-1]["created_at"], documents[-1]["_id"])
+        return {
+            "items": [_serialize(document) for document in documents],
+            "next_cursor": None,
+            "since": since,
+            "has_more": len(documents) == limit,
+        }
+
+    query = {}
+    if cursor is not None:
+        created_at, record_id = decode_cursor(cursor)
+        query = {"$or": [{"created_at": {"$lt": created_at}}, {"created_at": created_at, "_id": {"$lt": record_id}}]}
+    documents = await (
+        collection.find(query, _projection(collection_name))
+        .sort([("created_at", DESCENDING), ("_id", DESCENDING)])
+        .limit(limit)
+        .to_list(None)
+    )
+    next_cursor = None
+    if len(documents) == limit:
+        next_cursor = encode_cursor(documents[-1]["created_at"], documents[-1]["_id"])
+
+    if cursor is None:
+        # Refreshes start from the newest settled position listed, so unsettled records are not skipped
+        if documents and documents[0]["created_at"] < watermark:
+            since = encode_cursor(documents[0]["created_at"], documents[0]["_id"])
+        else:
+            since = encode_cursor(watermark, LAST_ID)
+    return {
+        "items": [_serialize(document) for document in documents],
+        "next_cursor": next_cursor,
+        "since": since,
+        "has_more": False,
+    }
+
+
+async def read_review_clusters(limit=FEED_PAGE_SIZE):
+    """
+    Group the most recent manual review records by near-duplicate cluster (see app/near_duplicates.py),
+    so copies of one document are reviewed together. Records without a cluster form their own.
+    Returns {"clusters": [{"cluster_id", "count", "latest", "records"}]}, most recently active first.
+    """
+    limit = max(1, min(limit, FEED_MAX_PAGE_SIZE))
+    fields = FEED_FIELDS["manual_review"]
+    pipeline = [
+        {"$sort": {"created_at": DESCENDING, "_id": DESCENDING}},
+        {"$limit": REVIEW_CLUSTER_WINDOW},
+        {"$group": {
+            "_id": {"$ifNull": ["$duplicate_cluster", {"$toString": "$_id"}]},
+            "count": {"$sum": 1},
+            "latest": {"$first": "$created_at"},
+            "records": {"$push": {"id": {"$toString": "$_id"}, **{field: f"${field}" for field in fields}}},
+        }},
+        {"$sort": {"latest": DESCENDING}},
+        {"$limit": limit},
+        {"$project": {"count": 1, "latest": 1, "records": {"$slice": ["$records", REVIEW_CLUSTER_RECORDS]}}},
+    ]
+    clusters = await get_async_db()["manual_review"].aggregate(pipeline).to_list(None)
+    for cluster in clusters:
+        cluster["cluster_id"] = cluster.pop("_id")
+        if isinstance(cluster.get("latest"), datetime):
+            cluster["latest"] = cluster["latest"].isoformat()
+    return {"clusters": clusters}
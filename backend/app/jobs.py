@@ -0,0 +1,268 @@
+import os
+import json
+import uuid
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from app.pipeline import extract_document, content_digest, cache_key, detect_language, classify_text, route_document
+from app.cache import result_cache
+from app.log import request_id_var
+from app.metrics import time_stage
+from app.uploads import spool_location, discard_upload
+
+logger = logging.getLogger(__name__)
+
+# Job queue configuration
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.db")  # SQLite file holding the durable queue
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))  # Worker threads processing jobs
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 0.5))  # Seconds between queue polls when idle
+JOB_STALE_AFTER = int(os.getenv("JOB_STALE_AFTER", 600))  # Seconds before a running job is assumed abandoned
+# Seconds between heartbeats of the jobs running here and sweeps for jobs abandoned elsewhere
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", 60))
+
+# Columns returned to clients
+JOB_FIELDS = ("id", "filename", "ocr_profile", "language", "status", "stage", "result", "error", "created_at", "updated_at")
+
+
+class JobQueue:
+    """
+    Durable queue of upload jobs backed by SQLite, processed by a pool of worker threads.
+    Each job moves through the stages: queued -> ocr -> language -> classify -> agents -> done.
+    """
+    def __init__(self, path=JOBS_DB_PATH, workers=JOB_WORKERS):
+        self.path = path
+        self.workers = workers
+        self._threads = []
+        self._running = set()  # Ids of the jobs this process is working on
+        self._running_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    payload BLOB,
+                    ocr_profile TEXT,
+                    language TEXT,
+                    status TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+            # Queues created before OCR profiles lack the per-job OCR options
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column in ("ocr_profile", "language"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+
+    @contextmanager
+    def _connect(self):
+        # One connection per call keeps the queue safe to use from any thread
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            yield conn
+        finally:
+            conn.close()
+
+    def submit(self, filename, contents, profile=None, language=None):
+        """
+        Queue a document for processing and return its job id.
+        profile and language select the OCR profile and language pack used for the job.
+        """
+        job_id = str(uuid.uuid4())
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, filename, payload, ocr_profile, language, status, stage, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 'queued', 'queued', ?, ?)",
+                (job_id, filename, sqlite3.Binary(contents), profile, language, now, now),
+            )
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """
+        Return the public view of a job, or None if it does not exist.
+        """
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _claim(self):
+        """
+        Atomically take the oldest queued job, or return None if the queue is empty.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, filename, payload, ocr_profile, language FROM jobs "
+                "WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?",
+                (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), row["id"]),
+            )
+            conn.execute("COMMIT")
+        return dict(row)
+
+    def _process(self, job):
+        """
+        Run a claimed job through the pipeline, recording each stage transition.
+        """
+        job_id, filename, contents = job["id"], job["filename"], job["payload"]
+        profile = job["ocr_profile"]
+        file_location = spool_location(filename, len(contents))
+        # Correlate the job's log lines by its id
+        request_id_var.set(job_id)
+        try:
+            digest = cache_key(content_digest(contents), profile, job["language"])
+            analysis = result_cache.get(digest)
+            cache_hit = analysis is not None
+
+            if not cache_hit:
+                self._update(job_id, stage="ocr")
+                with time_stage("save"), open(file_location, "wb") as f:
+                    f.write(contents)
+                extraction = extract_document(file_location, profile, job["language"])
+                extracted_text = extraction["extracted_text"]
+                if not extracted_text.strip():
+                    raise ValueError("No text could be extracted from the uploaded PDF.")
+
+                self._update(job_id, stage="language")
+                # The detection is remembered by text digest, so classify_text reuses it
+                detect_language(extracted_text)
+
+                self._update(job_id, stage="classify")
+                analysis = {**extraction, **classify_text(extracted_text)}
+                result_cache.set(digest, analysis)
+
+            self._update(job_id, stage="agents")
+            audit_status, agent_status = route_document(filename, {**analysis, "cache_hit": cache_hit})
+
+            result = {
+                "filename": filename,
+                "classification": analysis["classification"],
+                "language": analysis["language"],
+                "classification_tier": analysis.get("classification_tier"),
+                "extraction_method": analysis.get("extraction_method"),
+                "audit_status": audit_status,
+                "agent_status": agent_status,
+                "cache_hit": cache_hit,
+            }
+            # The payload is no longer needed once the job is done
+            self._update(job_id, status="done", stage="done", result=json.dumps(result), payload=None)
+        except Exception as e:
+            logger.exception("Job failed")
+            self._update(job_id, status="failed", error=str(e), payload=None)
+        finally:
+            discard_upload(file_location)
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                logger.exception("Failed to claim job")
+                job = None
+            if job is None:
+                # Sleep until a new job is submitted or the poll interval elapses
+                self._wakeup.wait(JOB_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            with self._running_lock:
+                self._running.add(job["id"])
+            try:
+                self._process(job)
+            finally:
+                with self._running_lock:
+                    self._running.discard(job["id"])
+
+    def requeue_stale(self):
+        """
+        Requeue the running jobs whose worker has stopped renewing them (e.g. it crashed).
+        Returns the number requeued.
+        """
+        # Running jobs are renewed by their process's heartbeat, so a stale one is no longer being worked on
+        stale = (datetime.now() - timedelta(seconds=JOB_STALE_AFTER)).strftime("%Y-%m-%d %H:%M:%S")
+        with self._connect() as conn:
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued', stage = 'queued' WHERE status = 'running' AND updated_at < ?",
+                (stale,),
+            ).rowcount
+        if requeued:
+            logger.warning("Requeued abandoned jobs", extra={"jobs": requeued})
+            self._wakeup.set()
+        return requeued
+
+    def _heartbeat(self):
+        """
+        Renew the jobs running in this process and requeue those abandoned by any other,
+        every JOB_HEARTBEAT_INTERVAL seconds until the queue stops.
+        """
+        while not self._stop.wait(JOB_HEARTBEAT_INTERVAL):
+            try:
+                with self._running_lock:
+                    running = list(self._running)
+                if running:
+                    with self._connect() as conn:
+                        conn.execute(
+                            f"UPDATE jobs SET updated_at = ? WHERE status = 'running' AND id IN ({', '.join('?' * len(running))})",
+                            (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), *running),
+                        )
+                self.requeue_stale()
+            except Exception:
+                logger.exception("Job heartbeat failed")
+
+    def start(self):
+        """
+        Requeue jobs abandoned by a crashed worker and start the worker threads
+        and the heartbeat that keeps doing so while the queue runs.
+        """
+        self.requeue_stale()
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self):
+        """
+        Stop the worker threads after their current job.
+        """
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+# Instantiate the shared job queue
+job_queue = JobQueue()
@@ -0,0 +1,157 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from langdetect import DetectorFactory, PROFILES_DIRECTORY
+from app.metrics import time_stage
+
+logger = logging.getLogger(__name__)
+
+# Seed of the detector's sampling, for consistent language detection results
+LANGUAGE_SEED = 0
+
+# Language detection configuration
+LANGUAGE_SAMPLE_CHARS = int(os.getenv("LANGUAGE_SAMPLE_CHARS", 600))  # Characters sampled from each page
+LANGUAGE_MAX_PAGES = int(os.getenv("LANGUAGE_MAX_PAGES", 8))  # Pages sampled per document at most
+LANGUAGE_CACHE_SIZE = int(os.getenv("LANGUAGE_CACHE_SIZE", 4096))  # Detections memoized in memory
+LANGUAGE_MIN_CONFIDENCE = float(os.getenv("LANGUAGE_MIN_CONFIDENCE", 0.6))  # Below this the language is not trusted
+BODY_LINE_MIN_WORDS = 5  # Shorter lines are treated as letterhead, addresses and signatures
+PAGE_CHARS = 3000  # Size of the pseudo-pages used when the page breaks are not known
+
+
+# langdetect factory holding the language profiles, loaded on first use
+_factory = None
+_factory_lock = threading.Lock()
+
+
+def get_detector_factory():
+    """
+    Return the shared langdetect factory, loading the language profiles on first use.
+    """
+    global _factory
+    with _factory_lock:
+        if _factory is None:
+            factory = DetectorFactory()
+            factory.load_profile(PROFILES_DIRECTORY)
+            factory.set_seed(LANGUAGE_SEED)
+            _factory = factory
+    return _factory
+
+
+def load_language_profiles():
+    """
+    Load the langdetect profiles (called once at startup, so no request pays for it).
+    """
+    with time_stage("language"):
+        factory = get_detector_factory()
+    logger.info("Loaded language profiles", extra={"languages": len(factory.get_lang_list())})
+
+
+def sample_page(text, limit=LANGUAGE_SAMPLE_CHARS):
+    """
+    Return at most limit characters of a page's body text.
+    Short lines (letterhead, addresses, signatures) are skipped when the page has prose,
+    and the sample is taken from the middle of the body, away from headers and footers.
+    """
+    lines = [" ".join(line.split()) for line in text.splitlines()]
+    body = [line for line in lines if len(line.split()) >= BODY_LINE_MIN_WORDS]
+    sample = " ".join(body or lines)
+    if len(sample) <= limit:
+        return sample
+    start = (len(sample) - limit) // 2
+    return sample[start:start + limit]
+
+
+def split_pages(text, page_chars=PAGE_CHARS):
+    """
+    Split text into pages on form feeds, or into fixed-size pieces if there are none.
+    """
+    if "\f" in text:
+        return text.split("\f")
+    return [text[start:start + page_chars] for start in range(0, len(text), page_chars)]
+
+
+def _detect_sample(sample):
+    """
+    Return the most likely (language, probability) of a sample, or None if langdetect cannot tell.
+    """
+    detector = get_detector_factory().create()
+    detector.append(sample)
+    try:
+        best = detector.get_probabilities()[0]
+    except Exception:
+        # No letters to go on (e.g. a page of numbers)
+        return None
+    return best.lang, best.prob
+
+
+def vote_language(pages, sample_chars=LANGUAGE_SAMPLE_CHARS, max_pages=LANGUAGE_MAX_PAGES):
+    """
+    Detect the language of each page from a bounded sample and vote across pages.
+    Votes are weighted by the page's probability and sample length, so a page of
+    letterhead counts for less than a page of prose.
+    Returns {"language", "confidence", "pages"}; the language is "unknown" when no page could be read.
+    """
+    pages = [page for page in pages if page and page.strip()]
+    if len(pages) > max_pages:
+        # Spread the sampled pages over the whole document
+        step = len(pages) / max_pages
+        pages = [pages[int(index * step)] for index in range(max_pages)]
+
+    votes, total = {}, 0.0
+    for page in pages:
+        sample = sample_page(page, sample_chars)
+        detected = _detect_sample(sample) if sample else None
+        if detected is None:
+            continue
+        language, probability = detected
+        weight = probability * len(sample)
+        votes[language] = votes.get(language, 0.0) + weight
+        total += len(sample)
+
+    if not votes:
+        return {"language": "unknown", "confidence": 0.0, "pages": 0}
+    language = max(votes, key=votes.get)
+    return {"language": language, "confidence": round(votes[language] / total, 3), "pages": len(pages)}
+
+
+class LanguageDetector:
+    """
+    Memoizes vote_language by the SHA-256 of the text, so identical texts
+    (re-uploads, retried jobs, near-identical form letters) are detected once.
+    """
+    def __init__(self, max_items=LANGUAGE_CACHE_SIZE):
+        self.max_items = max_items
+        self._lru = OrderedDict()  # text digest -> detection
+        self._lock = threading.Lock()
+
+    def detect(self, text, pages=None):
+        """
+        Detect the language of a document. pages, if given, are its page texts;
+        otherwise the text is split on form feeds or into fixed-size pieces.
+        """
+        key = hashlib.sha256(text.encode("utf-8", errors="replace")).hexdigest()
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                return self._lru[key]
+
+        with time_stage("language"):
+            detection = vote_language(pages if pages is not None else split_pages(text))
+
+        with self._lock:
+            self._lru[key] = detection
+            while len(self._lru) > self.max_items:
+                self._lru.popitem(last=False)
+        return detection
+
+
+language_detector = LanguageDetector()
+
+
+def is_confident(detection, threshold=LANGUAGE_MIN_CONFIDENCE):
+    """
+    Whether a detection is trustworthy enough to act on (e.g. to switch the OCR language pack).
+    """
+    return detection["language"] != "unknown" and detection["confidence"] >= threshold
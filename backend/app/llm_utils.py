@@ -1,24 +1,218 @@
 import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
 import openai
+import aiohttp
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Get OpenAI API key and model from environment variables
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4")
 
+# Maximum number of pooled HTTP connections to the OpenAI API
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 20))
+
+# Rate limits of the OpenAI account; requests are paced to stay under both
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", 500))
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", 40000))
+
+# Dispatcher configuration
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))  # Async requests in flight at once
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 5))  # Retries of a failed request
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 1.0))  # Seconds; doubled on every retry
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 60.0))  # Longest wait between retries
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", 8))  # Documents packed into one request at most
+LLM_BATCH_TOKENS = int(os.getenv("LLM_BATCH_TOKENS", 3000))  # Document tokens packed into one request at most
+LLM_BATCH_WINDOW = float(os.getenv("LLM_BATCH_WINDOW", 0.05))  # Seconds to wait for more documents to pack
+DEFAULT_COMPLETION_TOKENS = 500  # Assumed completion size when a request sets no max_tokens
+
+# Errors worth retrying: rate limits, timeouts, connection problems and server-side failures
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.APIError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+)
+
 # Set the OpenAI API key
 openai.api_key = OPENAI_API_KEY
 
+# Shared aiohttp session for async requests, created on first use
+_aiosession = None
+
+
+def _get_aiosession():
+    """
+    Return the shared aiohttp session, so async requests reuse pooled connections.
+    """
+    global _aiosession
+    if _aiosession is None or _aiosession.closed:
+        _aiosession = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=OPENAI_MAX_CONNECTIONS))
+    return _aiosession
+
+
+async def close_aiosession():
+    """
+    Close the shared aiohttp session (called when the application stops).
+    """
+    global _aiosession
+    if _aiosession is not None and not _aiosession.closed:
+        await _aiosession.close()
+    _aiosession = None
+
+
+def estimate_tokens(text):
+    """
+    Rough token count (about four characters per token for English text).
+    """
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute, holding at most a minute's worth.
+    reserve() takes the tokens straight away (going into debt if there are not enough) and
+    returns how long the caller must wait before using them, so threads and coroutines
+    can share one bucket.
+    """
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= min(amount, self.capacity)
+            return max(0.0, -self._tokens / self.rate)
+
+
+class RateLimiter:
+    """
+    Paces requests under the account's requests-per-minute and tokens-per-minute limits,
+    and holds every request back while the API has asked us to slow down.
+    """
+    def __init__(self, requests_per_minute=OPENAI_REQUESTS_PER_MINUTE, tokens_per_minute=OPENAI_TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._paused_until = 0.0
+
+    def reserve(self, tokens):
+        """
+        Reserve a request of the given size; returns the seconds to wait before sending it.
+        """
+        delay = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+        return max(delay, self._paused_until - time.monotonic())
+
+    def pause(self, seconds):
+        """
+        Hold back all requests for the given time (after a rate-limit response).
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+# Shared by every OpenAI request made by this process
+rate_limiter = RateLimiter()
+# Created on first use, inside the event loop
+_async_slots = None
+
+
+def _get_async_slots():
+    global _async_slots
+    if _async_slots is None:
+        _async_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _async_slots
+
+
+def _request_tokens(messages, max_tokens=None):
+    """
+    Tokens a request counts against the limit: the prompt plus the completion allowance.
+    """
+    prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+    return prompt_tokens + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+def retry_delay(error, attempt):
+    """
+    Seconds to wait before retrying: the Retry-After the API sent, if any,
+    otherwise exponential backoff with full jitter.
+    """
+    headers = getattr(error, "headers", None) or {}
+    try:
+        retry_after = float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+    # A little jitter so the waiting requests do not all return at the same instant
+    return retry_after + random.uniform(0, LLM_BACKOFF_BASE)
+
+
+def _note_failure(error, attempt):
+    delay = retry_delay(error, attempt)
+    if isinstance(error, openai.error.RateLimitError):
+        rate_limiter.pause(delay)
+    logger.warning(
+        "OpenAI request failed, retrying",
+        extra={"error": str(error), "attempt": attempt + 1, "delay": round(delay, 2)},
+    )
+    return delay
+
+
+def chat_completion(messages, max_tokens=None, **kwargs):
+    """
+    Call the ChatCompletion API under the shared rate limiter, retrying transient failures.
+    """
+    tokens = _request_tokens(messages, max_tokens)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        time.sleep(rate_limiter.reserve(tokens))
+        try:
+            return openai.ChatCompletion.create(model=OPENAI_MODEL, messages=messages, max_tokens=max_tokens, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            time.sleep(_note_failure(e, attempt))
+
+
+async def chat_completion_async(messages, max_tokens=None, **kwargs):
+    """
+    Async version of chat_completion; at most LLM_MAX_CONCURRENCY requests are in flight.
+    """
+    tokens = _request_tokens(messages, max_tokens)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        await asyncio.sleep(rate_limiter.reserve(tokens))
+        try:
+            async with _get_async_slots():
+                # openai reads the session from a context variable; without one it opens a new session per call
+                openai.aiosession.set(_get_aiosession())
+                return await openai.ChatCompletion.acreate(
+                    model=OPENAI_MODEL, messages=messages, max_tokens=max_tokens, **kwargs
+                )
+        except RETRYABLE_ERRORS as e:
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            await asyncio.sleep(_note_failure(e, attempt))
+
+
 def get_llm_response(prompt, temperature=0.7, max_tokens=1000):
     """
     Get a response from OpenAI's ChatCompletion API.
     """
     try:
-        response = openai.ChatCompletion.create(
-            model=OPENAI_MODEL,
+        response = chat_completion(
             messages=[{"role": "user", "content": prompt}],
             temperature=temperature,
             max_tokens=max_tokens,
@@ -32,11 +226,166 @@ def get_chat_response(messages, temperature=0.7):
     Get a chat response from OpenAI's ChatGPT model.
     """
     try:
-        response = openai.ChatCompletion.create(
-            model=OPENAI_MODEL,
+        response = chat_completion(
+            messages=messages,
+            temperature=temperature,
+        )
+        return response.choices[0].message["content"].strip()
+    except Exception as e:
+        raise ValueError(f"Failed to get chat response from OpenAI: {str(e)}")
+
+async def get_chat_response_async(messages, temperature=0.7):
+    """
+    Async version of get_chat_response, for use from the event loop.
+    """
+    try:
+        response = await chat_completion_async(
             messages=messages,
             temperature=temperature,
         )
         return response.choices[0].message["content"].strip()
     except Exception as e:
-        raise ValueError(f"Failed to get chat response from OpenAI: {str(e)}")
\ No newline at end of file
+        raise ValueError(f"Failed to get chat response from OpenAI: {str(e)}")
+
+async def stream_chat_response(messages, temperature=0.7):
+    """
+    Stream a chat response from OpenAI's ChatGPT model, yielding the text as it is generated.
+    Failures before the first token are retried like any other request.
+    """
+    try:
+        chunks = await chat_completion_async(
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+        )
+        async for chunk in chunks:
+            content = chunk.choices[0].delta.get("content") if chunk.choices else None
+            if content:
+                yield content
+    except Exception as e:
+        raise ValueError(f"Failed to stream chat response from OpenAI: {str(e)}")
+
+async def get_llm_response_async(prompt, temperature=0.7, max_tokens=1000):
+    """
+    Get a response from OpenAI's ChatCompletion API without blocking the event loop.
+    """
+    try:
+        response = await chat_completion_async(
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        return response.choices[0].message["content"].strip()
+    except Exception as e:
+        raise ValueError(f"Failed to get response from OpenAI: {str(e)}")
+
+
+async def classify_batch_async(texts, labels, instructions):
+    """
+    Classify several documents with one structured-output request (function calling).
+    Returns {index: label} for the documents the model answered for; labels are not validated.
+    """
+    schema = {
+        "name": "record_classifications",
+        "description": "Record the category of every document.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "classifications": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "integer"},
+                            "label": {"type": "string", "enum": list(labels)},
+                        },
+                        "required": ["id", "label"],
+                    },
+                },
+            },
+            "required": ["classifications"],
+        },
+    }
+    documents = "\n\n".join(f'<document id="{index}">\n{text}\n</document>' for index, text in enumerate(texts))
+    prompt = f"{instructions}\nClassify each of the {len(texts)} documents below.\n\n{documents}"
+    response = await chat_completion_async(
+        messages=[{"role": "user", "content": prompt}],
+        functions=[schema],
+        function_call={"name": schema["name"]},
+        temperature=0,
+        max_tokens=20 * len(texts) + 20,  # Room for one {"id", "label"} entry per document
+    )
+    arguments = json.loads(response.choices[0].message["function_call"]["arguments"])
+    return {
+        item["id"]: item["label"]
+        for item in arguments.get("classifications", [])
+        if isinstance(item, dict) and isinstance(item.get("id"), int) and "label" in item
+    }
+
+
+class LLMDispatcher:
+    """
+    Packs short documents classified concurrently into shared structured-output requests.
+    Documents are collected for up to LLM_BATCH_WINDOW seconds, or until LLM_BATCH_SIZE
+    documents or LLM_BATCH_TOKENS tokens are waiting, then sent as one request.
+    """
+    def __init__(self, batch_size=LLM_BATCH_SIZE, batch_tokens=LLM_BATCH_TOKENS, window=LLM_BATCH_WINDOW):
+        self.batch_size = batch_size
+        self.batch_tokens = batch_tokens
+        self.window = window
+        self._pending = {}  # (instructions, labels) -> [(text, tokens, future)]
+        self._timers = {}  # (instructions, labels) -> timer flushing a partial batch
+        self._tasks = set()
+
+    async def classify(self, text, labels, instructions):
+        """
+        Queue a document for the next packed request and return the model's label for it.
+        """
+        loop = asyncio.get_running_loop()
+        key = (instructions, tuple(labels))
+        tokens = estimate_tokens(text)
+        batch = self._pending.get(key, [])
+        if batch and sum(queued for _, queued, _ in batch) + tokens > self.batch_tokens:
+            self._flush(key)
+
+        future = loop.create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((text, tokens, future))
+        if len(batch) >= self.batch_size:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+        return await future
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._send(key, batch))
+            # Keep a reference until the request finishes
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, key, batch):
+        instructions, labels = key
+        try:
+            answers = await classify_batch_async([text for text, _, _ in batch], labels, instructions)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        logger.info("Packed classification request", extra={"documents": len(batch), "answered": len(answers)})
+        for index, (_, _, future) in enumerate(batch):
+            if future.done():
+                continue  # The caller was cancelled
+            if index in answers:
+                future.set_result(answers[index])
+            else:
+                future.set_exception(ValueError("Document missing from the packed response."))
+
+
+# Shared dispatcher for packed classification requests
+llm_dispatcher = LLMDispatcher()
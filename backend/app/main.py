@@ -1,20 +1,87 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel
-from app.ocr import extract_text_from_pdf
-from app.classifier import classify_request
-from app.agents import audit_agent, datastore_agent, archiving_agent, manual_review_agent, db  # Import db
-from app.llm_utils import get_llm_response
-from langdetect import detect, DetectorFactory
-from datetime import datetime
+from app.ocr import shutdown_ocr_executor, resolve_ocr_profile, resolve_ocr_language, installed_tesseract_languages
+from app.language import load_language_profiles
+from app.pipeline import analyze_document_async, route_document_async, cache_key
+from app.bulk import run_bulk_pipeline
+from app.jobs import job_queue, JOB_POLL_INTERVAL
+from app.agents import write_buffer, prepare_collections, COUNTERS_COLLECTION
+from app.mongo_utils import get_async_db, ping_async, close_clients
+from app.llm_utils import get_chat_response_async, stream_chat_response, close_aiosession
+from app.chat import build_chat_messages, DocumentNotFound
+from app.text_store import text_store, externalize_text_async
+from app.feeds import read_feed, read_review_clusters, InvalidCursor, FEED_PAGE_SIZE
+from app.archive import archive_log
+from app.search import search_index, InvalidQuery, SEARCH_PAGE_SIZE
+from app.log import configure_logging, request_id_var
+from app.metrics import HTTP_REQUEST_SECONDS, render_metrics
+from app.uploads import (
+    UploadLimitMiddleware, UploadTooLarge, save_upload, read_upload, discard_upload, UPLOAD_DISK_DIR,
+)
+from contextlib import asynccontextmanager
 import os
+import json
+import time
+import asyncio
+import logging
 import uuid
-from typing import List
+from datetime import datetime
+from typing import List, Literal, Optional
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start up and shut down shared resources with the application.
+    """
+    try:
+        await asyncio.to_thread(prepare_collections)
+    except Exception as e:
+        # Start anyway; /health/ready reports MongoDB as unavailable until it answers
+        logger.error("Could not prepare MongoDB collections", extra={"error": str(e)})
+    # Load the language detector profiles now rather than on the first request
+    await asyncio.to_thread(load_language_profiles)
+    # List the installed Tesseract language packs, which language hints are checked against
+    await asyncio.to_thread(installed_tesseract_languages)
+    job_queue.start()
+    yield
+    # Let the job workers finish their current job
+    await asyncio.to_thread(job_queue.stop)
+    # Stop the OCR worker processes
+    shutdown_ocr_executor()
+    # Close pooled connections to OpenAI
+    await close_aiosession()
+    # Flush buffered agent writes, archive entries and search entries, then close the MongoDB connection pools
+    await asyncio.to_thread(write_buffer.close)
+    await asyncio.to_thread(archive_log.close)
+    await asyncio.to_thread(search_index.close)
+    await asyncio.to_thread(close_clients)
+
+app = FastAPI(lifespan=lifespan)
+
+
+def validate_ocr_profile(ocr_profile):
+    """
+    Reject unknown OCR profile names with a 400 before any work is done.
+    """
+    try:
+        resolve_ocr_profile(ocr_profile)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-# Ensure consistent language detection results
-DetectorFactory.seed = 0
 
-app = FastAPI()
+def validate_ocr_language(language):
+    """
+    Reject language hints without an installed Tesseract language pack with a 400.
+    """
+    try:
+        resolve_ocr_language(language)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 # Enable CORS
 app.add_middleware(
@@ -23,103 +90,99 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all HTTP methods (GET, POST, etc.)
     allow_headers=["*"],  # Allow all headers
+    expose_headers=["X-Request-ID"],  # Let the frontend report the id of a failed request
 )
+# Cut off oversized request bodies while they stream in
+app.add_middleware(UploadLimitMiddleware)
+
 
-# Ensure the static directory exists
-os.makedirs("static", exist_ok=True)
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    """
+    Tag each request with an id (the caller's X-Request-ID, or a new one) for log
+    correlation, and record its latency.
+    """
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    request_id_var.set(request_id)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        # Label by route template rather than raw path to keep the series bounded
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.labels(
+            request.method, route.path if route else "unmatched", str(status)
+        ).observe(time.perf_counter() - start)
+
+# Ensure the directory for uploads too large to spool in memory exists
+os.makedirs(UPLOAD_DISK_DIR, exist_ok=True)
 
 @app.post("/upload/")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(file: UploadFile = File(...), ocr_profile: Optional[str] = None, language: Optional[str] = None):
     """
     Endpoint to handle file uploads, classify the document, and trigger agents based on the classification.
+    ?ocr_profile= (fast, balanced or accurate) and ?language= (e.g. "es") tune OCR for the document.
     """
     file_location = None
     try:
         # Validate file type
         if not file.filename.lower().endswith(".pdf"):
             raise HTTPException(status_code=400, detail="Invalid file type. Only PDF files are supported.")
+        validate_ocr_profile(ocr_profile)
+        validate_ocr_language(language)
 
-        # Generate a unique filename to avoid overwriting
-        unique_filename = f"{uuid.uuid4()}_{file.filename}"
-        file_location = f"static/{unique_filename}"
+        # Stream the upload to its spool file, hashing it on the way
+        file_location, digest, _ = await save_upload(file)
 
-        # Save the uploaded file
-        with open(file_location, "wb") as f:
-            f.write(await file.read())
-        print(f"File saved: {file_location}")
-
-        # Extract text from the PDF
-        extracted_text = extract_text_from_pdf(file_location)
+        # Extract, detect the language of and classify the document (cached by content hash)
+        analysis = await analyze_document_async(file_location, digest, ocr_profile, language)
+        extracted_text = analysis["extracted_text"]
         if not extracted_text.strip():
             raise HTTPException(status_code=400, detail="No text could be extracted from the uploaded PDF.")
-        print(f"Extracted text: {extracted_text[:100]}")  # Log first 100 characters
-
-        # Detect the language of the extracted text
-        try:
-            language = detect(extracted_text)
-            print(f"Detected language: {language}")
-        except Exception as e:
-            print(f"Language detection failed: {str(e)}")
-            language = "unknown"
+        language = analysis["language"]
+        classification = analysis["classification"]
 
-        # Classify the extracted text
-        classification = classify_request(extracted_text, language=language)
-        print(f"Classification: {classification}")
-
-        # Log the request to the audit agent
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        audit_status = audit_agent.log_request({
-            "filename": file.filename,
-            "classification": classification,
-            "timestamp": timestamp,
-            "extracted_text": extracted_text,
-            "language": language,  # Include detected language in the audit log
-        })
-
-        # Trigger the appropriate agent based on the classification
-        agent_status = None
-        if classification == "Cease":
-            agent_status = datastore_agent.write_to_datastore({
-                "filename": file.filename,
-                "timestamp": timestamp,
-                "language": language,  # Include language in the datastore
-            })
-        elif classification == "Irrelevant":
-            agent_status = archiving_agent.archive_to_file({
-                "filename": file.filename,
-                "timestamp": timestamp,
-            })
-        elif classification == "Uncertain":
-            agent_status = manual_review_agent.present_for_review({
-                "filename": file.filename,
-                "timestamp": timestamp,
-                "extracted_text": extracted_text,
-                "language": language,  # Include language for manual review
-            })
-        else:
-            agent_status = {"status": "No agent action required"}
+        # Log the request and trigger the appropriate agent
+        audit_status, agent_status = await route_document_async(file.filename, analysis)
 
         # Return the classification result and progress updates
         response = {
             "filename": file.filename,
             "classification": classification,
             "language": language,  # Include detected language in the response
+            "language_confidence": analysis.get("language_confidence"),  # Share of the page votes for it
+            "classification_tier": analysis.get("classification_tier"),  # Which classifier tier decided
+            "extraction_method": analysis.get("extraction_method"),  # Text layer, OCR or mixed
             "audit_status": audit_status,
             "agent_status": agent_status,
+            "cache_hit": analysis["cache_hit"],  # True when served from the result cache
+            "duplicate_of": analysis.get("duplicate_of"),  # Audit id of the near-duplicate whose label was reused
         }
-        print(f"Response sent to frontend: {response}")  # Debugging
+        logger.info(
+            "Upload processed",
+            extra={
+                "document": file.filename,
+                "classification": classification,
+                "tier": response["classification_tier"],
+                "cache_hit": response["cache_hit"],
+            },
+        )
         return response
 
     except HTTPException as http_exc:
         raise http_exc
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
-        print(f"Error in /upload/: {str(e)}")
+        logger.exception("Error in /upload/")
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
     finally:
         # Ensure the uploaded file is removed
-        if file_location and os.path.exists(file_location):
-            os.remove(file_location)
-            print(f"File removed: {file_location}")
+        discard_upload(file_location)
 
 
 @app.post("/review_and_approve/")
@@ -128,14 +191,14 @@ async def review_and_approve(data: dict):
     Endpoint to handle the "Review and Approve" action for uncertain classifications.
     """
     try:
-        # Save the document as "approved" in the database
-        if db is None:
-            raise Exception("Database connection not available.")
-        db["approved_documents"].insert_one(data)
-        print(f"Document approved: {data}")
+        # Rows posted back from a dashboard feed carry their listing fields; the write is stamped afresh
+        data.pop("created_at", None)
+        # Save the document as "approved" in the database, with any text moved to the text store
+        await write_buffer.submit_async("approved_documents", await externalize_text_async(data), wait=True)
+        logger.info("Document approved", extra={"document": data.get("filename")})
         return {"status": "Document approved successfully."}
     except Exception as e:
-        print(f"Failed to approve document: {str(e)}")
+        logger.exception("Failed to approve document")
         raise HTTPException(status_code=500, detail=f"Failed to approve document: {str(e)}")
 
 
@@ -145,71 +208,135 @@ async def send_for_further_evaluation(data: dict):
     Endpoint to handle the "Send for Further Evaluation" action for uncertain classifications.
     """
     try:
+        data.pop("created_at", None)
         # Log the document for further evaluation
-        if db is None:
-            raise Exception("Database connection not available.")
-        db["further_evaluation"].insert_one(data)
-        print(f"Document sent for further evaluation: {data}")
+        await write_buffer.submit_async("further_evaluation", await externalize_text_async(data), wait=True)
+        logger.info("Document sent for further evaluation", extra={"document": data.get("filename")})
         return {"status": "Document sent for further evaluation successfully."}
     except Exception as e:
-        print(f"Failed to send document for further evaluation: {str(e)}")
+        logger.exception("Failed to send document for further evaluation")
         raise HTTPException(status_code=500, detail=f"Failed to send document for further evaluation: {str(e)}")
 
 
+@app.get("/texts/{text_ref}")
+async def get_text(text_ref: str):
+    """
+    Endpoint to load the extracted text a record references (its text_ref) on demand.
+    """
+    text = await text_store.get_async(text_ref)
+    if text is None:
+        raise HTTPException(status_code=404, detail="Text not found.")
+    return {"text_ref": text_ref, "extracted_text": text}
+
+
+class ChatMessage(BaseModel):
+    role: Literal["user", "assistant"]  # System messages are built server-side (see app/chat.py)
+    content: str
+
 class ChatRequest(BaseModel):
-    messages: list  # List of messages in the format [{"role": "user", "content": "message"}]
-    language: str  # Detected language of the document (optional)
+    messages: List[ChatMessage]  # Conversation history, oldest first
+    language: Optional[str] = None  # Detected language of the document (optional)
+    audit_id: Optional[str] = None  # Audit log id of the document to discuss (optional)
+    stream: bool = False  # Stream the response as Server-Sent Events
 
 @app.post("/chat/")
 async def chat_with_openai(request: ChatRequest):
     """
     Endpoint to handle chat messages and get responses from OpenAI.
+    The whole conversation is sent; with an audit_id, excerpts of that document relevant to
+    the latest message are attached. With stream=true the response is sent as Server-Sent
+    Events, one per piece of text as it is generated, followed by a "done" event.
     """
+    if not request.messages:
+        raise HTTPException(status_code=400, detail="At least one message is required.")
+    logger.info(
+        "Chat request received",
+        extra={"messages": len(request.messages), "language": request.language, "audit_id": request.audit_id},
+    )
     try:
-        print(f"Chat request received: {request.messages}, Language: {request.language}")  # Debugging
-
-        # Include language context in the prompt
-        language_context = f"The detected language of the document is '{request.language}'.\n" if request.language else ""
-        prompt = f"{language_context}{request.messages[-1]['content']}"
+        messages = await build_chat_messages(
+            [message.model_dump() for message in request.messages], request.language, request.audit_id
+        )
+    except DocumentNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
-        response = get_llm_response(
-            prompt=prompt,  # Use the last user message with language context
-            temperature=0.7,
-            max_tokens=1000
+    if request.stream:
+        async def events():
+            characters = 0
+            try:
+                async for content in stream_chat_response(messages, temperature=0.7):
+                    characters += len(content)
+                    yield f"data: {json.dumps({'content': content})}\n\n"
+            except Exception as e:
+                # The response has started, so the error is reported in the stream
+                logger.exception("Error in /chat/ stream")
+                yield f"event: error\ndata: {json.dumps({'detail': f'Failed to get chat response: {str(e)}'})}\n\n"
+                return
+            logger.debug("Chat response", extra={"characters": characters})
+            yield "event: done\ndata: {}\n\n"
+
+        return StreamingResponse(
+            events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
         )
-        print(f"OpenAI response: {response}")  # Debugging
+
+    try:
+        response = await get_chat_response_async(messages, temperature=0.7)
+        logger.debug("Chat response", extra={"characters": len(response)})
         return {"response": response}
     except Exception as e:
-        print(f"Error in /chat/: {str(e)}")
+        logger.exception("Error in /chat/")
         raise HTTPException(status_code=500, detail=f"Failed to get chat response: {str(e)}")
-    
+
 @app.get("/dashboard/metrics/")
 async def get_dashboard_metrics():
     """
     Endpoint to fetch metrics and data for the dashboard.
+    Totals come from counters maintained as documents are written, so the cost
+    does not grow with the size of the collections.
     """
     try:
         # Fetch metrics from MongoDB
-        if db is None:
-            raise Exception("Database connection not available.")
-        total_audit_logs = db["audit_logs"].count_documents({})
-        total_approved_documents = db["approved_documents"].count_documents({})
-        total_further_evaluation = db["further_evaluation"].count_documents({})
-        total_classification_logs = db["classification_logs"].count_documents({})  # Add classification logs
-
-        # Fetch recent documents (limit to 10 for simplicity)
-        recent_audit_logs = list(db["audit_logs"].find({}, {"_id": 0}).sort("timestamp", -1).limit(10))
-        recent_approved_documents = list(db["approved_documents"].find({}, {"_id": 0}).sort("timestamp", -1).limit(10))
-        recent_further_evaluation = list(db["further_evaluation"].find({}, {"_id": 0}).sort("timestamp", -1).limit(10))
-        recent_classification_logs = list(db["classification_logs"].find({}, {"_id": 0}).sort("timestamp", -1).limit(10))  # Add classification logs
+        async_db = get_async_db()
+        counters = {
+            counter["_id"]: counter["count"]
+            for counter in await async_db[COUNTERS_COLLECTION].find({}).to_list(None)
+        }
+        classifications = {
+            key.split(":", 1)[1]: count for key, count in counters.items() if key.startswith("classification:")
+        }
+        classification_tiers = {
+            key.split(":", 1)[1]: count for key, count in counters.items() if key.startswith("tier:")
+        }
+        decided = sum(classification_tiers.values())
+        offloaded = sum(classification_tiers.get(tier, 0) for tier in ("rules", "model", "cache", "duplicate"))
+
+        # Fetch recent documents (limit to 10 for simplicity), leaving out the large text fields
+        recent_projection = {"_id": 0, "extracted_text": 0}
+
+        async def recent(collection_name):
+            cursor = async_db[collection_name].find({}, recent_projection).sort("created_at", -1).limit(10)
+            return await cursor.to_list(None)
+
+        recent_audit_logs, recent_approved_documents, recent_further_evaluation, recent_classification_logs = (
+            await asyncio.gather(
+                recent("audit_logs"),
+                recent("approved_documents"),
+                recent("further_evaluation"),
+                recent("classification_logs"),  # Add classification logs
+            )
+        )
 
         # Return metrics and recent data
         return {
             "metrics": {
-                "total_audit_logs": total_audit_logs,
-                "total_approved_documents": total_approved_documents,
-                "total_further_evaluation": total_further_evaluation,
-                "total_classification_logs": total_classification_logs,  # Add classification logs
+                "total_audit_logs": counters.get("collection:audit_logs", 0),
+                "total_approved_documents": counters.get("collection:approved_documents", 0),
+                "total_further_evaluation": counters.get("collection:further_evaluation", 0),
+                "total_classification_logs": counters.get("collection:classification_logs", 0),  # Add classification logs
+                "classifications": classifications,
+                "classification_tiers": classification_tiers,
+                # Share of documents classified without calling the LLM
+                "llm_offload_rate": offloaded / decided if decided else None,
             },
             "recent_data": {
                 "audit_logs": recent_audit_logs,
@@ -219,109 +346,237 @@ async def get_dashboard_metrics():
             },
         }
     except Exception as e:
-        print(f"Error fetching dashboard metrics: {str(e)}")
+        logger.exception("Error fetching dashboard metrics")
         raise HTTPException(status_code=500, detail=f"Failed to fetch dashboard metrics: {str(e)}")
     
-@app.post("/bulk_upload/")
-async def bulk_upload(files: List[UploadFile] = File(...)):
+@app.get("/dashboard/feeds/{collection_name}")
+async def get_dashboard_feed(
+    collection_name: str, limit: int = FEED_PAGE_SIZE, cursor: Optional[str] = None, since: Optional[str] = None
+):
     """
-    Endpoint to handle bulk file uploads, classify the documents, and trigger agents based on the classification.
+    Endpoint listing a dashboard collection a page at a time, newest first.
+    Pass the returned next_cursor as ?cursor= for the next page, and the returned since
+    as ?since= to fetch only the records written after the previous fetch.
     """
-    results = []  # Store results for all files
-    for file in files:
-        file_location = None
-        try:
-            # Validate file type
-            if not file.filename.lower().endswith(".pdf"):
-                results.append({
-                    "filename": file.filename,
-                    "error": "Invalid file type. Only PDF files are supported."
-                })
-                continue
-
-            # Generate a unique filename to avoid overwriting
-            unique_filename = f"{uuid.uuid4()}_{file.filename}"
-            file_location = f"static/{unique_filename}"
-
-            # Save the uploaded file
-            with open(file_location, "wb") as f:
-                f.write(await file.read())
-            print(f"File saved: {file_location}")
-
-            # Extract text from the PDF
-            extracted_text = extract_text_from_pdf(file_location)
-            if not extracted_text.strip():
-                results.append({
-                    "filename": file.filename,
-                    "error": "No text could be extracted from the file."
-                })
-                continue
-            print(f"Extracted text: {extracted_text[:100]}")  # Log first 100 characters
-
-            # Detect the language of the extracted text
-            try:
-                language = detect(extracted_text)
-                print(f"Detected language: {language}")
-            except Exception as e:
-                print(f"Language detection failed for {file.filename}: {str(e)}")
-                language = "unknown"
+    if cursor is not None and since is not None:
+        raise HTTPException(status_code=400, detail="Pass either cursor or since, not both.")
+    try:
+        return await read_feed(collection_name, limit, cursor, since)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown collection '{collection_name}'.")
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("Error fetching dashboard feed")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch dashboard feed: {str(e)}")
 
-            # Classify the extracted text
-            classification = classify_request(extracted_text, language=language)
-            print(f"Classification for {file.filename}: {classification}")
 
-            # Log the request to the audit agent
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            audit_status = audit_agent.log_request({
-                "filename": file.filename,
-                "classification": classification,
-                "timestamp": timestamp,
-                "extracted_text": extracted_text,
-                "language": language,  # Include detected language in the audit log
-            })
+@app.get("/dashboard/review_clusters/")
+async def get_review_clusters(limit: int = FEED_PAGE_SIZE):
+    """
+    Endpoint listing the manual review queue grouped by near-duplicate cluster,
+    most recently active cluster first.
+    """
+    try:
+        return await read_review_clusters(limit)
+    except Exception as e:
+        logger.exception("Error fetching review clusters")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch review clusters: {str(e)}")
 
-            # Trigger the appropriate agent based on the classification
-            agent_status = None
-            if classification == "Cease":
-                agent_status = datastore_agent.write_to_datastore({
-                    "filename": file.filename,
-                    "timestamp": timestamp,
-                    "language": language,  # Include language in the datastore
-                })
-            elif classification == "Irrelevant":
-                agent_status = archiving_agent.archive_to_file({
-                    "filename": file.filename,
-                    "timestamp": timestamp,
-                })
-            elif classification == "Uncertain":
-                agent_status = manual_review_agent.present_for_review({
-                    "filename": file.filename,
-                    "timestamp": timestamp,
-                    "extracted_text": extracted_text,
-                    "language": language,  # Include language for manual review
-                })
-            else:
-                agent_status = {"status": "No agent action required"}
-
-            # Append the result for this file
+
+@app.get("/archive/")
+async def query_archive(
+    filename: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None, limit: int = 100
+):
+    """
+    Endpoint to look up archived (Irrelevant) documents by filename and/or date range
+    (YYYY-MM-DD, inclusive), newest first, through the archive's index.
+    """
+    for value in (date_from, date_to):
+        if value is not None:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Invalid date '{value}'. Use YYYY-MM-DD.")
+    try:
+        records = await asyncio.to_thread(archive_log.query, filename, date_from, date_to, limit)
+        return {"records": records}
+    except Exception as e:
+        logger.exception("Error querying the archive")
+        raise HTTPException(status_code=500, detail=f"Failed to query the archive: {str(e)}")
+
+
+@app.get("/search/")
+async def search_documents(
+    q: str,
+    classification: Optional[str] = None,
+    language: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    page: int = 1,
+    limit: int = SEARCH_PAGE_SIZE,
+):
+    """
+    Endpoint to search the extracted text of processed documents, best match first.
+    Every word must match; "quoted words" match as a phrase and word* as a prefix.
+    Results can be filtered by classification, language and date range (YYYY-MM-DD, inclusive)
+    and carry an HTML-escaped snippet with the matches in <mark> tags. Load the full text via /texts/{text_ref}.
+    """
+    for value in (date_from, date_to):
+        if value is not None:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Invalid date '{value}'. Use YYYY-MM-DD.")
+    try:
+        return await asyncio.to_thread(
+            search_index.search, q, classification, language, date_from, date_to, page, limit
+        )
+    except InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("Error searching documents")
+        raise HTTPException(status_code=500, detail=f"Failed to search documents: {str(e)}")
+
+
+@app.post("/bulk_upload/")
+async def bulk_upload(
+    files: List[UploadFile] = File(...),
+    stream: bool = False,
+    ocr_profile: Optional[str] = None,
+    language: Optional[str] = None,
+):
+    """
+    Endpoint to handle bulk file uploads, classify the documents, and trigger agents based on the classification.
+    Files run concurrently through the staged pipeline. With ?stream=true each file's result is
+    sent as an NDJSON line as soon as it finishes; otherwise all results are returned together.
+    ?ocr_profile= and ?language= apply to every file.
+    """
+    validate_ocr_profile(ocr_profile)
+    validate_ocr_language(language)
+    results = []  # Results for files rejected before processing
+    items = []  # Saved uploads to run through the pipeline
+    for index, file in enumerate(files):
+        # Validate file type
+        if not file.filename.lower().endswith(".pdf"):
             results.append({
+                "index": index,
                 "filename": file.filename,
-                "classification": classification,
-                "language": language,
-                "audit_status": audit_status,
-                "agent_status": agent_status,
+                "error": "Invalid file type. Only PDF files are supported."
             })
+            continue
 
+        # Stream the upload to its spool file, hashing it on the way
+        try:
+            file_location, digest, _ = await save_upload(file)
         except Exception as e:
-            print(f"Error processing {file.filename}: {str(e)}")
-            results.append({
-                "filename": file.filename,
-                "error": str(e),
-            })
-        finally:
-            # Ensure the uploaded file is removed
-            if file_location and os.path.exists(file_location):
-                os.remove(file_location)
-                print(f"File removed: {file_location}")
+            logger.exception("Error saving file", extra={"document": file.filename})
+            results.append({"index": index, "filename": file.filename, "error": str(e)})
+            continue
+
+        items.append({
+            "index": index,
+            "filename": file.filename,
+            "file_location": file_location,
+            "digest": cache_key(digest, ocr_profile, language),
+        })
+
+    if stream:
+        async def stream_results():
+            for result in results:
+                yield json.dumps(result) + "\n"
+            async for result in run_bulk_pipeline(items, ocr_profile, language):
+                yield json.dumps(result) + "\n"
+
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+    async for result in run_bulk_pipeline(items, ocr_profile, language):
+        results.append(result)
+    # Keep the results in upload order
+    results.sort(key=lambda result: result["index"])
+    return {"results": results}
 
-    return {"results": results}
\ No newline at end of file
+
+@app.post("/jobs/", status_code=202)
+async def submit_job(file: UploadFile = File(...), ocr_profile: Optional[str] = None, language: Optional[str] = None):
+    """
+    Endpoint to queue a document for background processing.
+    Returns a job id immediately; progress is available from /jobs/{job_id}.
+    """
+    # Validate file type
+    if not file.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Invalid file type. Only PDF files are supported.")
+    validate_ocr_profile(ocr_profile)
+    validate_ocr_language(language)
+    try:
+        # The queue keeps the document itself, so it is read into memory (within the size limit)
+        contents, _ = await read_upload(file)
+        job_id = await asyncio.to_thread(job_queue.submit, file.filename, contents, ocr_profile, language)
+        logger.info("Job queued", extra={"job_id": job_id, "document": file.filename})
+        return {"job_id": job_id, "status": "queued"}
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        logger.exception("Error in /jobs/")
+        raise HTTPException(status_code=500, detail=f"Failed to queue job: {str(e)}")
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Endpoint to fetch the status, current stage and result of a job.
+    """
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """
+    Endpoint streaming a job's stage transitions as Server-Sent Events until it finishes.
+    """
+    if await asyncio.to_thread(job_queue.get, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+    async def events():
+        last_stage = None
+        while True:
+            job = await asyncio.to_thread(job_queue.get, job_id)
+            if job["stage"] != last_stage or job["status"] in ("done", "failed"):
+                last_stage = job["stage"]
+                event = "failed" if job["status"] == "failed" else job["stage"]
+                yield f"event: {event}\ndata: {json.dumps(job)}\n\n"
+                if job["status"] in ("done", "failed"):
+                    return
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Endpoint exposing pipeline and request metrics in the Prometheus text format.
+    """
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/health/live")
+async def liveness():
+    """
+    Liveness probe: the process is up and serving requests.
+    """
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+async def readiness():
+    """
+    Readiness probe: the service can take traffic only while MongoDB answers.
+    """
+    if not await ping_async():
+        raise HTTPException(status_code=503, detail="MongoDB is not reachable.")
+    return {"status": "ready"}
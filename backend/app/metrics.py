@@ -0,0 +1,44 @@
+from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+# Latency buckets from 5ms (a database batch) to 2 minutes (a long OCR run)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Pipeline stages: save, text_layer, ocr_page, language, classify (rule and model tiers), llm, archive_write,
+# search_index and search
+STAGE_SECONDS = Histogram(
+    "pipeline_stage_seconds", "Time spent in each stage of the document pipeline.", ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+# Batched agent inserts, per collection
+AGENT_WRITE_SECONDS = Histogram(
+    "agent_write_seconds", "Time taken to write a batch of agent documents to MongoDB.", ["collection"],
+    buckets=LATENCY_BUCKETS,
+)
+AGENT_DOCUMENTS = Counter(
+    "agent_documents_total", "Agent documents written to MongoDB.", ["collection", "outcome"],
+)
+CLASSIFICATIONS = Counter(
+    "classifications_total", "Documents routed, by classification and the tier that decided it.",
+    ["classification", "tier"],
+)
+LLM_FALLBACKS = Counter(
+    "llm_fallbacks_total", "LLM classifications that failed and fell back to the pattern matcher.",
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "Time taken to handle HTTP requests.", ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+def time_stage(stage):
+    """
+    Context manager (or decorator) recording the duration of a pipeline stage.
+    """
+    return STAGE_SECONDS.labels(stage).time()
+
+
+def render_metrics():
+    """
+    Return the current metrics in the Prometheus text format, with their content type.
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,17 +1,126 @@
 import os
+import logging
+import threading
 from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # MongoDB configuration
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "cease_desist_db")
 
-# Initialize MongoDB client
-client = MongoClient(MONGO_URI)
-db = client[MONGO_DB_NAME]
+# Connection pool configuration, shared by the sync and async clients
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 50))  # Connections per client at most
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))  # Connections kept open when idle
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 60000))  # Idle time before a connection is closed
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 30000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000))  # Wait for a free connection
+
+# Clients are created on first use, so importing the app never blocks on MongoDB
+_client = None
+_async_client = None
+_lock = threading.Lock()
+
+
+def client_options():
+    """
+    Options applied to every MongoDB client created by the application.
+    """
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "retryWrites": True,
+        "retryReads": True,
+    }
+
+
+def get_client():
+    """
+    Return the shared MongoDB client for worker threads, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = MongoClient(MONGO_URI, **client_options())
+                logger.info("Created MongoDB client", extra={"database": MONGO_DB_NAME})
+    return _client
+
+
+def get_async_client():
+    """
+    Return the shared async (motor) MongoDB client for the event loop, creating it on first use.
+    """
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                _async_client = AsyncIOMotorClient(MONGO_URI, **client_options())
+                logger.info("Created async MongoDB client", extra={"database": MONGO_DB_NAME})
+    return _async_client
+
+
+def get_db():
+    """
+    Return the application database on the shared client.
+    """
+    return get_client()[MONGO_DB_NAME]
+
+
+def get_async_db():
+    """
+    Return the application database on the shared async client.
+    """
+    return get_async_client()[MONGO_DB_NAME]
+
+
+def ping():
+    """
+    Readiness probe: True if MongoDB answers a ping within the server selection timeout.
+    """
+    try:
+        get_client().admin.command("ping")
+        return True
+    except Exception as e:
+        logger.warning("MongoDB ping failed", extra={"error": str(e)})
+        return False
+
+
+async def ping_async():
+    """
+    Async version of ping, for use from the event loop.
+    """
+    try:
+        await get_async_client().admin.command("ping")
+        return True
+    except Exception as e:
+        logger.warning("MongoDB ping failed", extra={"error": str(e)})
+        return False
+
+
+def close_clients():
+    """
+    Close the shared clients and their pools (called when the application stops).
+    """
+    global _client, _async_client
+    with _lock:
+        for client in (_client, _async_client):
+            if client is not None:
+                client.close()
+        _client = _async_client = None
+
 
 def log_to_mongo(collection_name, data):
     """
@@ -20,12 +129,10 @@ def log_to_mongo(collection_name, data):
     :param data: Dictionary containing the data to log.
     """
     try:
-        collection = db[collection_name]
-        print(f"Inserting into collection: {collection_name}")  # Debugging
-        print(f"Data: {data}")  # Debugging
+        collection = get_db()[collection_name]
         result = collection.insert_one(data)
-        print(f"Inserted document ID: {result.inserted_id}")  # Debugging
+        logger.debug("Inserted document", extra={"collection": collection_name, "id": str(result.inserted_id)})
         return str(result.inserted_id)
     except Exception as e:
-        print(f"Failed to log to MongoDB: {str(e)}")  # Debugging
-        raise Exception(f"Failed to log to MongoDB: {str(e)}")
\ No newline at end of file
+        logger.error("Failed to log to MongoDB", extra={"collection": collection_name, "error": str(e)})
+        raise Exception(f"Failed to log to MongoDB: {str(e)}")
@@ -0,0 +1,227 @@
+"""
+Near-duplicate index over extracted document text.
+
+Rescanned copies of a letter give slightly different OCR output, so their bytes (and the
+result cache key) differ. Each text is reduced to a MinHash signature over character
+shingles, which estimates the Jaccard similarity of two texts, and the signature is split
+into bands for locality-sensitive lookup: texts sharing any band are candidates, and the
+candidates are compared signature to signature.
+
+Entries live in the near_duplicates collection under the id of their audit log entry, with
+the cluster (the audit id of the first copy seen) that every near-duplicate joins.
+"""
+import os
+import re
+import zlib
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+from pymongo import DESCENDING
+from app.mongo_utils import get_db, get_async_db
+
+logger = logging.getLogger(__name__)
+
+# Near-duplicate configuration
+NEAR_DUPLICATE_COLLECTION = os.getenv("NEAR_DUPLICATE_COLLECTION", "near_duplicates")
+# Estimated Jaccard similarity above which a document may reuse the label of its match (see reusable_duplicate)
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", 0.8))
+NEAR_DUPLICATE_REUSE_LABELS = os.getenv("NEAR_DUPLICATE_REUSE_LABELS", "true").lower() == "true"
+NEAR_DUPLICATE_MIN_CHARS = int(os.getenv("NEAR_DUPLICATE_MIN_CHARS", 200))  # Shorter texts are never matched
+NEAR_DUPLICATE_MAX_CHARS = int(os.getenv("NEAR_DUPLICATE_MAX_CHARS", 50000))  # Text hashed per document at most
+NEAR_DUPLICATE_CANDIDATES = int(os.getenv("NEAR_DUPLICATE_CANDIDATES", 50))  # Candidates compared per lookup at most
+SHINGLE_CHARS = 5  # Character shingles survive the odd misread letter better than word shingles
+# 20 bands of 6 rows make texts with a similarity of 0.8 candidates 99.8% of the time, and 0.3 about 1.5%
+SIGNATURE_BANDS = 20
+SIGNATURE_ROWS = 6
+SIGNATURE_SIZE = SIGNATURE_BANDS * SIGNATURE_ROWS
+SIGNATURE_CACHE_SIZE = 256  # Signatures remembered by text hash (a text is looked up, then registered)
+
+MERSENNE_PRIME = (1 << 61) - 1
+SHINGLE_CHUNK = 4096  # Shingles hashed per permutation pass, to bound memory on long texts
+
+# Fixed seed: signatures must agree across processes and restarts
+_random = np.random.RandomState(1)
+PERMUTATION_A = _random.randint(1, 1 << 31, size=SIGNATURE_SIZE).astype(np.uint64)
+PERMUTATION_B = _random.randint(0, 1 << 31, size=SIGNATURE_SIZE).astype(np.uint64)
+
+NOISE = re.compile(r"[\W_]+")
+
+
+def normalize_text(text):
+    """
+    Lowercase the text and collapse punctuation and whitespace, which OCR reads inconsistently.
+    """
+    return NOISE.sub(" ", text[:NEAR_DUPLICATE_MAX_CHARS].lower()).strip()
+
+
+def minhash_signature(text):
+    """
+    Return the MinHash signature of the text's character shingles (SIGNATURE_SIZE values),
+    or None when the text is too short to compare reliably.
+    """
+    normalized = normalize_text(text)
+    if len(normalized) < NEAR_DUPLICATE_MIN_CHARS:
+        return None
+    shingles = {normalized[i:i + SHINGLE_CHARS] for i in range(len(normalized) - SHINGLE_CHARS + 1)}
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64)
+
+    # (a * h + b) mod p stays below 2**63 for 31-bit a and b and 32-bit h
+    signature = np.full(SIGNATURE_SIZE, MERSENNE_PRIME, dtype=np.uint64)
+    for start in range(0, len(hashes), SHINGLE_CHUNK):
+        chunk = hashes[start:start + SHINGLE_CHUNK]
+        permuted = (PERMUTATION_A[:, None] * chunk[None, :] + PERMUTATION_B[:, None]) % MERSENNE_PRIME
+        signature = np.minimum(signature, permuted.min(axis=1))
+    return [int(value) for value in signature]
+
+
+def signature_bands(signature):
+    """
+    Return the band keys of a signature: texts sharing any key are near-duplicate candidates.
+    """
+    bands = []
+    for band in range(SIGNATURE_BANDS):
+        rows = signature[band * SIGNATURE_ROWS:(band + 1) * SIGNATURE_ROWS]
+        digest = hashlib.blake2b(repr(rows).encode(), digest_size=8).hexdigest()
+        bands.append(f"{band}:{digest}")
+    return bands
+
+
+def estimated_similarity(signature, other):
+    """
+    Estimate the Jaccard similarity of two texts from their signatures.
+    """
+    return sum(1 for a, b in zip(signature, other) if a == b) / SIGNATURE_SIZE
+
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index of the texts already classified, stored alongside the audit log.
+    """
+    def __init__(self, collection_name=NEAR_DUPLICATE_COLLECTION, threshold=NEAR_DUPLICATE_THRESHOLD):
+        self.collection_name = collection_name
+        self.threshold = threshold
+        self._signatures = OrderedDict()  # text hash -> (signature, bands)
+        self._lock = threading.Lock()
+        self._indexes_ready = False
+
+    def fingerprint(self, text):
+        """
+        Return the (signature, bands) of a text, or (None, None) if it is too short.
+        """
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            if key in self._signatures:
+                self._signatures.move_to_end(key)
+                return self._signatures[key]
+        signature = minhash_signature(text)
+        fingerprint = (signature, signature_bands(signature) if signature else None)
+        with self._lock:
+            self._signatures[key] = fingerprint
+            while len(self._signatures) > SIGNATURE_CACHE_SIZE:
+                self._signatures.popitem(last=False)
+        return fingerprint
+
+    def _ensure_indexes(self):
+        if self._indexes_ready:
+            return
+        get_db()[self.collection_name].create_index("bands")
+        self._indexes_ready = True
+
+    def _candidates_query(self, bands):
+        return {"bands": {"$in": bands}}, {"signature": 1, "classification": 1, "cluster_id": 1, "filename": 1}
+
+    def _best_match(self, signature, candidates):
+        best = None
+        for candidate in candidates:
+            similarity = estimated_similarity(signature, candidate["signature"])
+            if similarity >= self.threshold and (best is None or similarity > best["similarity"]):
+                best = {
+                    "audit_id": str(candidate["_id"]),
+                    "cluster_id": candidate["cluster_id"],
+                    "classification": candidate.get("classification"),
+                    "filename": candidate.get("filename"),
+                    "similarity": similarity,
+                }
+        return best
+
+    def match(self, text):
+        """
+        Return the closest document already indexed whose similarity to the text reaches
+        the threshold, as {"audit_id", "cluster_id", "classification", "filename", "similarity"},
+        or None.
+        """
+        signature, bands = self.fingerprint(text)
+        if signature is None:
+            return None
+        self._ensure_indexes()
+        query, projection = self._candidates_query(bands)
+        candidates = (
+            get_db()[self.collection_name].find(query, projection)
+            .sort("_id", DESCENDING).limit(NEAR_DUPLICATE_CANDIDATES)
+        )
+        return self._best_match(signature, candidates)
+
+    async def match_async(self, text):
+        """
+        Async version of match, for use from the event loop.
+        """
+        # Hashing a long text is CPU work; keep it off the event loop
+        signature, bands = await asyncio.to_thread(self.fingerprint, text)
+        if signature is None:
+            return None
+        await asyncio.to_thread(self._ensure_indexes)
+        query, projection = self._candidates_query(bands)
+        candidates = await (
+            get_async_db()[self.collection_name].find(query, projection)
+            .sort("_id", DESCENDING).limit(NEAR_DUPLICATE_CANDIDATES)
+            .to_list(None)
+        )
+        return self._best_match(signature, candidates)
+
+    def _entry(self, audit_id, signature, bands, cluster_id, record):
+        return {
+            "_id": audit_id,
+            "signature": signature,
+            "bands": bands,
+            "cluster_id": cluster_id,
+            "classification": record.get("classification"),
+            "filename": record.get("filename"),
+            "created_at": datetime.utcnow(),
+        }
+
+    def add(self, audit_id, text, record, cluster_id=None):
+        """
+        Index the text of an audit log entry (record supplies its filename and classification).
+        The entry joins cluster_id if given, else the cluster of its closest near-duplicate,
+        else starts a cluster of its own. Returns the cluster id, or None if the text is too short.
+        """
+        signature, bands = self.fingerprint(text)
+        if signature is None:
+            return None
+        if cluster_id is None:
+            match = self.match(text)
+            cluster_id = match["cluster_id"] if match else str(audit_id)
+        get_db()[self.collection_name].insert_one(self._entry(audit_id, signature, bands, cluster_id, record))
+        return cluster_id
+
+    async def add_async(self, audit_id, text, record, cluster_id=None):
+        """
+        Async version of add, for use from the event loop.
+        """
+        signature, bands = await asyncio.to_thread(self.fingerprint, text)
+        if signature is None:
+            return None
+        if cluster_id is None:
+            match = await self.match_async(text)
+            cluster_id = match["cluster_id"] if match else str(audit_id)
+        await get_async_db()[self.collection_name].insert_one(
+            self._entry(audit_id, signature, bands, cluster_id, record)
+        )
+        return cluster_id
+
+
+near_duplicate_index = NearDuplicateIndex()
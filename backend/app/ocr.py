@@ -1,42 +1,388 @@
-import pytesseract
-from pdf2image import convert_from_path
 import os
+import time
+import logging
+import functools
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pytesseract
+from PIL import Image, ImageSequence
+from pdf2image import convert_from_path, pdfinfo_from_path
+from app.metrics import STAGE_SECONDS, time_stage
+from app.language import language_detector, vote_language, is_confident
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes used to OCR pages in parallel (defaults to one per core)
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", os.cpu_count() or 1))
+
+# Embedded text layer: pages with at least this many letters/digits skip OCR
+TEXT_LAYER_ENABLED = os.getenv("TEXT_LAYER_ENABLED", "true").lower() == "true"
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", 50))
+TEXT_LAYER_TIMEOUT = 60  # Seconds allowed for pdftotext
+
+# Named OCR profiles trading accuracy for throughput
+# - dpi: rasterization resolution
+# - grayscale: rasterize straight to 8-bit gray instead of RGB
+# - binarize: threshold the page to black and white before OCR (0 disables)
+# - psm/oem: Tesseract page segmentation and engine modes
+OCR_PROFILES = {
+    "fast": {"dpi": 150, "grayscale": True, "binarize": 160, "psm": 6, "oem": 1},
+    "balanced": {"dpi": 200, "grayscale": True, "binarize": 0, "psm": 3, "oem": 1},
+    "accurate": {"dpi": 300, "grayscale": False, "binarize": 0, "psm": 3, "oem": 1},
+}
+OCR_PROFILE = os.getenv("OCR_PROFILE", "balanced")  # Deployment default, overridable per request
+
+# Tesseract language packs for the languages langdetect reports
+TESSERACT_LANGUAGES = {
+    "en": "eng",
+    "es": "spa",
+    "fr": "fra",
+    "de": "deu",
+    "it": "ita",
+    "pt": "por",
+    "nl": "nld",
+}
+DEFAULT_TESSERACT_LANGUAGE = "eng"
+# Pick the language pack from the detected language when the caller does not name one
+OCR_DETECT_LANGUAGE = os.getenv("OCR_DETECT_LANGUAGE", "true").lower() == "true"
+
+# Scanned image files OCR'd directly (multi-page TIFFs page by page)
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+
+# Shared process pool, created on first use
+_executor = None
+
+
+def get_ocr_executor():
+    """
+    Return the shared OCR process pool, creating it on first use.
+    """
+    global _executor
+    if _executor is None:
+        # Use "spawn" so workers do not inherit the server's threads and open sockets
+        _executor = ProcessPoolExecutor(
+            max_workers=OCR_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+    return _executor
+
+
+def _init_worker():
+    # Pages are already spread across processes; one Tesseract thread each avoids oversubscribing cores
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+
+def resolve_ocr_profile(name=None):
+    """
+    Return the settings of the named OCR profile (the deployment default when no name is given).
+    """
+    name = name or OCR_PROFILE
+    if name not in OCR_PROFILES:
+        raise ValueError(f"Unknown OCR profile '{name}'. Choose from: {', '.join(OCR_PROFILES)}.")
+    return OCR_PROFILES[name]
+
+
+def tesseract_language(language=None):
+    """
+    Map a detected language code to the Tesseract language pack, defaulting to English.
+    """
+    return TESSERACT_LANGUAGES.get(language, DEFAULT_TESSERACT_LANGUAGE)
+
+
+@functools.lru_cache(maxsize=1)
+def installed_tesseract_languages():
+    """
+    Return the language packs installed for Tesseract (looked up once).
+    """
+    try:
+        return frozenset(pytesseract.get_languages(config=""))
+    except Exception as e:
+        logger.warning("Could not list the Tesseract language packs", extra={"error": str(e)})
+        return frozenset([DEFAULT_TESSERACT_LANGUAGE])
+
+
+def resolve_ocr_language(language=None):
+    """
+    Return the Tesseract language pack for a document language hint (None without a hint).
+    Raises ValueError for a language with no pack, or whose pack is not installed.
+    """
+    if language is None:
+        return None
+    if language not in TESSERACT_LANGUAGES:
+        raise ValueError(f"Unsupported language '{language}'. Choose from: {', '.join(TESSERACT_LANGUAGES)}.")
+    lang = TESSERACT_LANGUAGES[language]
+    if lang not in installed_tesseract_languages():
+        raise ValueError(f"The Tesseract language pack for '{language}' ({lang}) is not installed.")
+    return lang
+
+
+def hinted_tesseract_language(language=None):
+    """
+    Return the Tesseract language pack for a language hint, or None when there is no hint or
+    it cannot be used, in which case the pack is detected as if no hint had been given.
+    """
+    try:
+        return resolve_ocr_language(language)
+    except ValueError as e:
+        logger.warning("Ignoring the language hint", extra={"language": language, "error": str(e)})
+        return None
+
+
+def detected_tesseract_language(page_texts, on_language=None):
+    """
+    Detect the language of the given pages and return its Tesseract language pack,
+    or None when the detection is not confident or the pack is not installed.
+    on_language(language) is called with a confident detection, pack or not.
+    """
+    detection = vote_language(page_texts)
+    if not is_confident(detection):
+        return None
+    if on_language is not None:
+        on_language(detection["language"])
+    lang = tesseract_language(detection["language"])
+    if lang not in installed_tesseract_languages():
+        logger.info("No Tesseract language pack for the detected language", extra={"language": detection["language"]})
+        return None
+    return lang
+
+
+def shutdown_ocr_executor():
+    """
+    Shut down the shared OCR process pool (called when the application stops).
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+def _ocr_page(pdf_path, page_number, profile, lang):
+    """
+    Rasterize a single page of the PDF and extract its text with Tesseract.
+    Runs in a worker process; the page image never leaves memory.
+    Returns the text and the seconds taken, which the parent records.
+    """
+    start = time.perf_counter()
+    images = convert_from_path(
+        pdf_path,
+        dpi=profile["dpi"],
+        grayscale=profile["grayscale"],
+        first_page=page_number,
+        last_page=page_number,
+    )
+    page_texts = [_ocr_image(image, profile, lang) for image in images]
+    return "\n".join(page_texts), time.perf_counter() - start
+
 
-def extract_text_from_pdf(pdf_path):
+def _ocr_image(image, profile, lang):
     """
-    Extract text from a PDF file using Tesseract OCR.
-    - Converts each page of the PDF to an image
-    - Extracts text from the images
+    Extract the text of a page image with Tesseract, using the OCR profile's settings.
+    """
+    config = f"--psm {profile['psm']} --oem {profile['oem']}"
+    if profile["binarize"]:
+        threshold = profile["binarize"]
+        image = image.convert("L").point(lambda value: 255 if value > threshold else 0, "1")
+    elif profile["grayscale"]:
+        image = image.convert("L")
+    return pytesseract.image_to_string(image, lang=lang, config=config)
+
+
+def _ocr_pages(pdf_path, pages, profile, lang):
+    """
+    OCR the given pages, in parallel on the pool when there is more than one.
+    Returns an iterator over (text, seconds) for the pages in order.
+    """
+    if OCR_WORKERS <= 1 or len(pages) <= 1:
+        # Not worth the round-trip to the pool
+        return (_ocr_page(pdf_path, page, profile, lang) for page in pages)
+    # map() yields results in submission order, i.e. page order
+    count = len(pages)
+    return get_ocr_executor().map(_ocr_page, [pdf_path] * count, pages, [profile] * count, [lang] * count)
+
+
+def read_text_layer(pdf_path, page_count):
+    """
+    Return the embedded text of each page using poppler's pdftotext, or None for every
+    page if the text layer cannot be read.
     """
     try:
-        # Convert PDF to images
-        images = convert_from_path(pdf_path)
-        text = ""
-
-        # Create a temporary directory to store images
-        temp_dir = "static/temp_images"
-        os.makedirs(temp_dir, exist_ok=True)
-
-        # Extract text from each page
-        for i, image in enumerate(images):
-            # Save each page as an image file
-            image_path = os.path.join(temp_dir, f"page_{i + 1}.png")
-            image.save(image_path)
-
-            # Extract text using Tesseract
-            page_text = pytesseract.image_to_string(image_path)
-            text += page_text + "\n"
-
-        # Clean up temporary images
-        for file in os.listdir(temp_dir):
-            file_path = os.path.join(temp_dir, file)
-            # Skip hidden files (e.g., ._page_1.png)
-            if not file.startswith(".") and os.path.isfile(file_path):
-                os.remove(file_path)
-        os.rmdir(temp_dir)
+        with time_stage("text_layer"):
+            result = subprocess.run(
+                ["pdftotext", "-enc", "UTF-8", "-f", "1", "-l", str(page_count), pdf_path, "-"],
+                capture_output=True, timeout=TEXT_LAYER_TIMEOUT, check=True,
+            )
+    except Exception as e:
+        logger.warning("Could not read the text layer", extra={"error": str(e)})
+        return [None] * page_count
+    # pdftotext ends every page with a form feed
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")[:page_count]
+    return pages + [None] * (page_count - len(pages))
+
+
+def has_usable_text(text):
+    """
+    Whether a page's embedded text is substantial enough to skip OCR.
+    """
+    return text is not None and sum(character.isalnum() for character in text) >= TEXT_LAYER_MIN_CHARS
+
+
+def iter_pdf_pages(pdf_path, max_pages=None, window=None, profile=None, language=None, page_count=None,
+                   on_language=None):
+    """
+    Yield (text, method) for each page of the PDF in page order, up to max_pages pages.
+    The OCR profile and the document language (for the Tesseract language pack) are optional.
+    Pages with a usable embedded text layer are returned as-is ("text_layer"); only the
+    others are rasterized one at a time with first_page/last_page and OCR'd ("ocr").
+    OCR runs a window of pages at a time (OCR_WORKERS by default), so memory does not grow
+    with the page count and the caller can stop early.
+    Without a usable language, the pack is chosen from the language detected on the text layer,
+    or on the first OCR'd window (which is redone if the detected pack differs); on_language(language)
+    is called with that detected language before the pages it was detected on are yielded.
+    page_count saves reading the PDF's page count again when the caller already has it.
+    """
+    if page_count is None:
+        page_count = pdfinfo_from_path(pdf_path)["Pages"]
+    if max_pages:
+        page_count = min(page_count, max_pages)
+    window = window or OCR_WORKERS
+    settings = resolve_ocr_profile(profile)
+    hinted = hinted_tesseract_language(language)
+    lang = hinted or DEFAULT_TESSERACT_LANGUAGE
+    text_layer = read_text_layer(pdf_path, page_count) if TEXT_LAYER_ENABLED else [None] * page_count
+
+    detect = hinted is None and OCR_DETECT_LANGUAGE
+    if detect:
+        embedded = [text for text in text_layer if has_usable_text(text)]
+        detected = detected_tesseract_language(embedded, on_language) if embedded else None
+        if detected is not None:
+            lang, detect = detected, False
+
+    for start in range(1, page_count + 1, window):
+        pages = range(start, min(start + window, page_count + 1))
+        needs_ocr = [page for page in pages if not has_usable_text(text_layer[page - 1])]
+        ocr_texts = _ocr_pages(pdf_path, needs_ocr, settings, lang) if needs_ocr else iter(())
+        if detect and needs_ocr:
+            # The window is needed in full to detect its language before any page is yielded
+            ocr_texts = list(ocr_texts)
+            detected = detected_tesseract_language([text for text, _ in ocr_texts], on_language)
+            if detected is not None:
+                detect = False
+                if detected != lang:
+                    logger.info("Switching OCR language pack", extra={"from": lang, "to": detected})
+                    for _, seconds in ocr_texts:
+                        STAGE_SECONDS.labels("ocr_page").observe(seconds)
+                    lang = detected
+                    ocr_texts = list(_ocr_pages(pdf_path, needs_ocr, settings, lang))
+            ocr_texts = iter(ocr_texts)
+        for page in pages:
+            if has_usable_text(text_layer[page - 1]):
+                yield text_layer[page - 1], "text_layer"
+            else:
+                page_text, seconds = next(ocr_texts)
+                STAGE_SECONDS.labels("ocr_page").observe(seconds)
+                yield page_text, "ocr"
+
+
+def extract_pdf(pdf_path, stop_when=None, max_pages=None, profile=None, language=None, on_language=None):
+    """
+    Extract text from a PDF file, using the embedded text layer where there is one and
+    Tesseract OCR elsewhere.
+    - Pages are rasterized and OCR'd in parallel across the worker pool
+    - Page text is reassembled in page order
+    - stop_when(page_text) returning True ends extraction after that page
+    - max_pages caps the number of pages read
+    - profile names the OCR profile and language picks the Tesseract language pack
+    - on_language(language) receives the language detected for the pack, if any (see iter_pdf_pages)
+    Returns a dict with the text, the per-page extraction methods and the overall method
+    ("text_layer", "ocr" or "mixed").
+    """
+    try:
+        page_texts, methods = [], []
+        page_count = pdfinfo_from_path(pdf_path)["Pages"]
+        # Without early exit every page can be submitted to the pool at once
+        window = OCR_WORKERS if stop_when is not None else max(1, page_count)
+        pages = iter_pdf_pages(pdf_path, max_pages, window, profile, language, page_count, on_language)
+        try:
+            for page_text, method in pages:
+                page_texts.append(page_text)
+                methods.append(method)
+                if stop_when is not None and stop_when(page_text):
+                    logger.info("Stopping extraction early", extra={"pages": len(page_texts)})
+                    break
+        finally:
+            pages.close()
+
+        text = "\n".join(page_texts).strip()
+        if not methods:
+            method = None  # A PDF without pages
+        else:
+            method = methods[0] if len(set(methods)) == 1 else "mixed"
+        logger.info(
+            "Extracted PDF", extra={"pages": len(methods), "text_layer_pages": methods.count("text_layer")}
+        )
+        if text:
+            # Vote across the real pages while they are known; the result is memoized by the
+            # text's hash, so the language stage later finds it without re-detecting
+            language_detector.detect(text, pages=page_texts)
 
         # Return extracted text or a fallback message
-        return text.strip() if text.strip() else "No text could be extracted from the PDF."
+        return {
+            "text": text if text else "No text could be extracted from the PDF.",
+            "page_methods": methods,
+            "extraction_method": method,
+        }
+
+    except Exception as e:
+        raise ValueError(f"Failed to process the PDF: {str(e)}")
+
+
+def extract_image(image_path, profile=None, language=None):
+    """
+    Extract text from a scanned image file (see IMAGE_EXTENSIONS) with Tesseract OCR.
+    Every frame of a multi-page image is read. Without a usable language, the language pack is
+    chosen from the language detected on the first pass, which is redone if the pack differs.
+    Returns a dict shaped like extract_pdf's.
+    """
+    try:
+        settings = resolve_ocr_profile(profile)
+        hinted = hinted_tesseract_language(language)
+        lang = hinted or DEFAULT_TESSERACT_LANGUAGE
+        with Image.open(image_path) as image:
+            frames = [frame.copy() for frame in ImageSequence.Iterator(image)]
+
+        def ocr(lang):
+            page_texts = []
+            for frame in frames:
+                start = time.perf_counter()
+                page_texts.append(_ocr_image(frame, settings, lang))
+                STAGE_SECONDS.labels("ocr_page").observe(time.perf_counter() - start)
+            return page_texts
+
+        page_texts = ocr(lang)
+        if hinted is None and OCR_DETECT_LANGUAGE:
+            detected = detected_tesseract_language(page_texts)
+            if detected is not None and detected != lang:
+                logger.info("Switching OCR language pack", extra={"from": lang, "to": detected})
+                page_texts = ocr(detected)
+
+        text = "\n".join(page_texts).strip()
+        logger.info("Extracted image", extra={"pages": len(page_texts)})
+        if text:
+            language_detector.detect(text, pages=page_texts)
+        return {
+            "text": text if text else "No text could be extracted from the image.",
+            "page_methods": ["ocr"] * len(page_texts),
+            "extraction_method": "ocr",
+        }
 
     except Exception as e:
-        raise ValueError(f"Failed to process the PDF: {str(e)}")
\ No newline at end of file
+        raise ValueError(f"Failed to process the image: {str(e)}")
+
+
+def extract_text_from_pdf(pdf_path, stop_when=None, max_pages=None, profile=None, language=None):
+    """
+    Extract text from a PDF file (see extract_pdf) and return the text only.
+    """
+    return extract_pdf(pdf_path, stop_when, max_pages, profile, language)["text"]
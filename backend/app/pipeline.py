@@ -0,0 +1,431 @@
+import os
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from bson import ObjectId
+from app.ocr import extract_pdf, extract_image, IMAGE_EXTENSIONS, OCR_PROFILE
+from app.classifier import (
+    classify_document, classify_document_async, score_by_rules, IncrementalClassifier, RULE_CONFIDENCE_THRESHOLD,
+)
+from app.agents import audit_agent, datastore_agent, archiving_agent, manual_review_agent, classification_log_agent
+from app.cache import result_cache
+from app.language import language_detector
+from app.text_store import text_store
+from app.near_duplicates import near_duplicate_index, NEAR_DUPLICATE_REUSE_LABELS
+from app.metrics import CLASSIFICATIONS
+
+logger = logging.getLogger(__name__)
+
+# Stop OCR as soon as a page contains a decisive cease request
+OCR_EARLY_EXIT = os.getenv("OCR_EARLY_EXIT", "true").lower() == "true"
+# Pages read at most when no decisive cease request is found (0 reads every page)
+OCR_MAX_PAGES = int(os.getenv("OCR_MAX_PAGES", 0))
+
+
+def extract_document(file_location, profile=None, language=None):
+    """
+    Extract the PDF page by page, screening each page so extraction can stop early.
+    profile names the OCR profile and language the expected document language, if known.
+    Returns a dict with the extracted_text and the extraction_method used
+    ("text_layer", "ocr" or "mixed").
+    """
+    screener = IncrementalClassifier(language=language or "en") if OCR_EARLY_EXIT else None
+
+    def use_detected_language(detected):
+        # Without a hint, screen with the language detected on the text layer or the first OCR window
+        screener.language = detected
+
+    extraction = extract_pdf(
+        file_location,
+        stop_when=screener.feed if screener else None,
+        max_pages=OCR_MAX_PAGES or None,
+        profile=profile,
+        language=language,
+        on_language=use_detected_language if screener else None,
+    )
+    return {"extracted_text": extraction["text"], "extraction_method": extraction["extraction_method"]}
+
+
+def extract_file(file_location, profile=None, language=None):
+    """
+    Extract a PDF (see extract_document) or a scanned image file (see IMAGE_EXTENSIONS).
+    Returns a dict with the extracted_text and the extraction_method used.
+    """
+    if not file_location.lower().endswith(IMAGE_EXTENSIONS):
+        return extract_document(file_location, profile, language)
+    extraction = extract_image(file_location, profile, language)
+    return {"extracted_text": extraction["text"], "extraction_method": extraction["extraction_method"]}
+
+
+def detect_language(text):
+    """
+    Detect the language of the extracted text by voting over bounded per-page samples.
+    Returns {"language", "confidence", "pages"}; the language is "unknown" if detection fails.
+    """
+    try:
+        detection = language_detector.detect(text)
+        logger.info("Detected language", extra=detection)
+    except Exception as e:
+        logger.warning("Language detection failed", extra={"error": str(e)})
+        detection = {"language": "unknown", "confidence": 0.0, "pages": 0}
+    return detection
+
+
+def content_digest(contents):
+    """
+    Return the SHA-256 of the uploaded bytes, used as the result cache key.
+    """
+    return hashlib.sha256(contents).hexdigest()
+
+
+def cache_key(digest, profile=None, language=None):
+    """
+    Return the result cache key for a document read with the given OCR profile and language hint.
+    Results from a non-default profile or with a language hint are cached separately.
+    """
+    key = digest
+    if profile and profile != OCR_PROFILE:
+        key += f":{profile}"
+    if language:
+        key += f":lang={language}"
+    return key
+
+
+def classification_fields(detection, decision):
+    """
+    Turn a language detection and a classifier decision into the fields stored with the analysis.
+    """
+    logger.info("Classified document", extra={"classification": decision["classification"], "tier": decision["tier"]})
+    return {
+        "language": detection["language"],
+        "language_confidence": detection["confidence"],
+        "classification": decision["classification"],
+        "classification_tier": decision["tier"],  # Which tier decided: rules, model, llm or patterns
+        "classification_confidence": decision["confidence"],
+    }
+
+
+def find_near_duplicate(extracted_text):
+    """
+    Return the closest near-duplicate of the text already classified (see app/near_duplicates.py),
+    or None if there is none, label reuse is turned off or the lookup fails.
+    """
+    if not NEAR_DUPLICATE_REUSE_LABELS:
+        return None
+    try:
+        return near_duplicate_index.match(extracted_text)
+    except Exception as e:
+        logger.warning("Near-duplicate lookup failed", extra={"error": str(e)})
+        return None
+
+
+async def find_near_duplicate_async(extracted_text):
+    """
+    Async version of find_near_duplicate, for use from the event loop.
+    """
+    if not NEAR_DUPLICATE_REUSE_LABELS:
+        return None
+    try:
+        return await near_duplicate_index.match_async(extracted_text)
+    except Exception as e:
+        logger.warning("Near-duplicate lookup failed", extra={"error": str(e)})
+        return None
+
+
+def duplicate_decision(match):
+    """
+    Turn a near-duplicate match into a classifier decision that reuses the match's label.
+    """
+    logger.info(
+        "Reusing the label of a near-duplicate",
+        extra={"duplicate_of": match["audit_id"], "similarity": match["similarity"]},
+    )
+    return {"classification": match["classification"], "tier": "duplicate", "confidence": match["similarity"]}
+
+
+def duplicate_fields(match):
+    """
+    Fields stored with an analysis whose label was reused from a near-duplicate.
+    """
+    return {"duplicate_of": match["audit_id"], "duplicate_cluster": match["cluster_id"]}
+
+
+# How strongly each label asks for action: a reused label may never be weaker than the rules' finding
+LABEL_SEVERITY = {"Irrelevant": 0, "Uncertain": 1, "Cease": 2}
+# Weakest label reused from a near-duplicate. One added sentence (e.g. a cease request the rules
+# miss) barely moves the similarity of a long letter, so an Irrelevant copy is always classified
+# again; a reused Uncertain still goes to a human
+NEAR_DUPLICATE_MIN_LABEL = "Uncertain"
+
+
+def reusable_duplicate(match, rules):
+    """
+    Whether a near-duplicate's label may stand in for classifying the text, given the
+    (label, confidence) the rule tier found in it. A decisive rule match always wins, and a
+    label weaker than the rules' finding (a Cease is never downgraded) or than
+    NEAR_DUPLICATE_MIN_LABEL is not reused.
+    """
+    label, confidence = rules
+    if match is None or confidence >= RULE_CONFIDENCE_THRESHOLD:
+        return False
+    severity = LABEL_SEVERITY.get(match["classification"], -1)
+    return severity >= LABEL_SEVERITY[label] and severity >= LABEL_SEVERITY[NEAR_DUPLICATE_MIN_LABEL]
+
+
+def classify_text(extracted_text):
+    """
+    Detect the language of and classify the extracted text.
+    A text close enough to one already classified reuses its label instead, unless the rule
+    tier decides it or finds a stronger label (see reusable_duplicate).
+    Returns a dict with the language, the classification and the tier that decided it.
+    """
+    # Detect the language of the extracted text
+    detection = detect_language(extracted_text)
+
+    # The rule tier is free and runs first: a near-duplicate is only looked up when it is not decisive
+    rules = score_by_rules(extracted_text, detection["language"])
+    if rules[1] < RULE_CONFIDENCE_THRESHOLD:
+        match = find_near_duplicate(extracted_text)
+        if reusable_duplicate(match, rules):
+            return {**classification_fields(detection, duplicate_decision(match)), **duplicate_fields(match)}
+
+    # Classify the extracted text
+    decision = classify_document(extracted_text, language=detection["language"])
+    return classification_fields(detection, decision)
+
+
+async def classify_text_async(extracted_text):
+    """
+    Async version of classify_text. Language detection is CPU-bound and runs on a worker thread.
+    """
+    detection = await asyncio.to_thread(detect_language, extracted_text)
+
+    # The rule tier is free and runs first: a near-duplicate is only looked up when it is not decisive
+    rules = score_by_rules(extracted_text, detection["language"])
+    if rules[1] < RULE_CONFIDENCE_THRESHOLD:
+        match = await find_near_duplicate_async(extracted_text)
+        if reusable_duplicate(match, rules):
+            return {**classification_fields(detection, duplicate_decision(match)), **duplicate_fields(match)}
+
+    # Classify the extracted text
+    decision = await classify_document_async(extracted_text, language=detection["language"])
+    return classification_fields(detection, decision)
+
+
+def analyze_document(file_location, digest, profile=None, language=None):
+    """
+    Extract, detect the language of and classify an uploaded PDF.
+    Byte-identical documents are served from the result cache, skipping OCR and the LLM;
+    digest is the SHA-256 of the uploaded bytes (see content_digest).
+    profile and language are passed to extract_document.
+    Returns a dict with extracted_text, language, classification and cache_hit.
+    """
+    digest = cache_key(digest, profile, language)
+    cached = result_cache.get(digest)
+    if cached is not None:
+        logger.info("Result cache hit", extra={"digest": digest})
+        return {**cached, "cache_hit": True}
+
+    # Extract text from the PDF
+    extraction = extract_document(file_location, profile, language)
+    extracted_text = extraction["extracted_text"]
+    if not extracted_text.strip():
+        # Nothing worth caching
+        return {**extraction, "language": "unknown", "classification": None, "cache_hit": False}
+    logger.debug("Extracted text", extra={"characters": len(extracted_text)})
+
+    result = {**extraction, **classify_text(extracted_text)}
+    result_cache.set(digest, result)
+    return {**result, "cache_hit": False}
+
+
+async def analyze_document_async(file_location, digest, profile=None, language=None):
+    """
+    Async version of analyze_document. OCR runs on the process pool and the
+    LLM call uses the async OpenAI client, so the event loop is never blocked.
+    """
+    digest = cache_key(digest, profile, language)
+    cached = await asyncio.to_thread(result_cache.get, digest)
+    if cached is not None:
+        logger.info("Result cache hit", extra={"digest": digest})
+        return {**cached, "cache_hit": True}
+
+    # Extract text from the PDF
+    extraction = await asyncio.to_thread(extract_document, file_location, profile, language)
+    extracted_text = extraction["extracted_text"]
+    if not extracted_text.strip():
+        # Nothing worth caching
+        return {**extraction, "language": "unknown", "classification": None, "cache_hit": False}
+    logger.debug("Extracted text", extra={"characters": len(extracted_text)})
+
+    result = {**extraction, **await classify_text_async(extracted_text)}
+    await asyncio.to_thread(result_cache.set, digest, result)
+    return {**result, "cache_hit": False}
+
+
+def _text_fields(text_ref, extracted_text):
+    """
+    Fields referencing the text in the text store, or holding it inline if it could not be stored.
+    """
+    if text_ref is None:
+        return {"extracted_text": extracted_text}
+    return {"text_ref": text_ref, "text_length": len(extracted_text)}
+
+
+def _build_records(filename, analysis, text_ref=None, duplicate_cluster=None):
+    """
+    Build the audit log entry, the classification log entry and the record for the
+    agent matching the classification. text_ref is the text store reference of the
+    extracted text (see app/text_store.py) and duplicate_cluster the near-duplicate
+    cluster of the document (see app/near_duplicates.py).
+    """
+    extracted_text = analysis["extracted_text"]
+    language = analysis["language"]
+    classification = analysis["classification"]
+    # A cache hit skipped every tier, which matters when measuring the LLM offload rate
+    tier = "cache" if analysis.get("cache_hit") else analysis.get("classification_tier")
+
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    audit_record = {
+        "filename": filename,
+        "classification": classification,
+        "classification_tier": tier,
+        "timestamp": timestamp,
+        **_text_fields(text_ref, extracted_text),
+        "extraction_method": analysis.get("extraction_method"),  # Text layer or OCR
+        "language": language,  # Include detected language in the audit log
+        "duplicate_cluster": duplicate_cluster,  # Shared by the near-duplicates of a document
+        "duplicate_of": analysis.get("duplicate_of"),  # Whose label was reused, if any
+    }
+    classification_record = {
+        "filename": filename,
+        "classification": classification,
+        "tier": tier,
+        "confidence": analysis.get("classification_confidence"),
+        "timestamp": timestamp,
+    }
+
+    agent_record = None
+    if classification == "Cease":
+        agent_record = {
+            "filename": filename,
+            "timestamp": timestamp,
+            "language": language,  # Include language in the datastore
+        }
+    elif classification == "Irrelevant":
+        agent_record = {
+            "filename": filename,
+            "timestamp": timestamp,
+        }
+    elif classification == "Uncertain":
+        agent_record = {
+            "filename": filename,
+            "timestamp": timestamp,
+            **_text_fields(text_ref, extracted_text),
+            "language": language,  # Include language for manual review
+            "duplicate_cluster": duplicate_cluster,  # Lets reviewers handle copies of a document together
+        }
+    return audit_record, classification_record, agent_record
+
+
+def _fix_record_ids(audit_id, classification_record, agent_record, classification):
+    """
+    Give the records written through the write-behind buffer the audit log entry's id, so
+    a repeated insert is recognised as already written (each lives in its own collection).
+    """
+    classification_record["_id"] = audit_id
+    # Archived records go to the archive log, which has no ids
+    if agent_record is not None and classification != "Irrelevant":
+        agent_record["_id"] = audit_id
+
+
+def route_document(filename, analysis, audit_id=None):
+    """
+    Log the request to the audit agent, record the routing decision and trigger
+    the agent matching the classification. Returns the audit and agent statuses.
+    audit_id, if given, is the id of the audit log entry and of the other buffered
+    records, so routing the same document again writes none of them twice.
+    """
+    # Store the text once, by content; the records only reference it
+    try:
+        text_ref = text_store.put(analysis["extracted_text"])
+    except Exception as e:
+        logger.warning("Could not store the extracted text, keeping it inline", extra={"error": str(e)})
+        text_ref = None
+    # Index the text for near-duplicate lookups under the id its audit log entry will get
+    fixed_id = audit_id is not None
+    audit_id = audit_id or ObjectId()
+    try:
+        duplicate_cluster = near_duplicate_index.add(
+            audit_id, analysis["extracted_text"], {"filename": filename, "classification": analysis["classification"]},
+            analysis.get("duplicate_cluster"),
+        )
+    except Exception as e:
+        logger.warning("Could not index the document for near-duplicate lookups", extra={"error": str(e)})
+        duplicate_cluster = analysis.get("duplicate_cluster")
+    audit_record, classification_record, agent_record = _build_records(filename, analysis, text_ref, duplicate_cluster)
+    audit_record["_id"] = audit_id
+    if fixed_id:
+        _fix_record_ids(audit_id, classification_record, agent_record, analysis["classification"])
+    classification = analysis["classification"]
+    CLASSIFICATIONS.labels(str(classification), str(classification_record["tier"])).inc()
+
+    # Log the request to the audit agent
+    audit_status = audit_agent.log_request(audit_record, analysis["extracted_text"])
+    classification_log_agent.log_decision(classification_record)
+
+    # Trigger the appropriate agent based on the classification
+    if classification == "Cease":
+        agent_status = datastore_agent.write_to_datastore(agent_record)
+    elif classification == "Irrelevant":
+        agent_status = archiving_agent.archive_to_file(agent_record)
+    elif classification == "Uncertain":
+        agent_status = manual_review_agent.present_for_review(agent_record)
+    else:
+        agent_status = {"status": "No agent action required"}
+
+    return audit_status, agent_status
+
+
+async def route_document_async(filename, analysis, audit_id=None):
+    """
+    Async version of route_document, for use from the event loop.
+    """
+    try:
+        text_ref = await text_store.put_async(analysis["extracted_text"])
+    except Exception as e:
+        logger.warning("Could not store the extracted text, keeping it inline", extra={"error": str(e)})
+        text_ref = None
+    fixed_id = audit_id is not None
+    audit_id = audit_id or ObjectId()
+    try:
+        duplicate_cluster = await near_duplicate_index.add_async(
+            audit_id, analysis["extracted_text"], {"filename": filename, "classification": analysis["classification"]},
+            analysis.get("duplicate_cluster"),
+        )
+    except Exception as e:
+        logger.warning("Could not index the document for near-duplicate lookups", extra={"error": str(e)})
+        duplicate_cluster = analysis.get("duplicate_cluster")
+    audit_record, classification_record, agent_record = _build_records(filename, analysis, text_ref, duplicate_cluster)
+    audit_record["_id"] = audit_id
+    if fixed_id:
+        _fix_record_ids(audit_id, classification_record, agent_record, analysis["classification"])
+    classification = analysis["classification"]
+    CLASSIFICATIONS.labels(str(classification), str(classification_record["tier"])).inc()
+
+    # Log the request to the audit agent
+    audit_status = await audit_agent.log_request_async(audit_record, analysis["extracted_text"])
+    await classification_log_agent.log_decision_async(classification_record)
+
+    # Trigger the appropriate agent based on the classification
+    if classification == "Cease":
+        agent_status = await datastore_agent.write_to_datastore_async(agent_record)
+    elif classification == "Irrelevant":
+        agent_status = await archiving_agent.archive_to_file_async(agent_record)
+    elif classification == "Uncertain":
+        agent_status = await manual_review_agent.present_for_review_async(agent_record)
+    else:
+        agent_status = {"status": "No agent action required"}
+
+    return audit_status, agent_status
@@ -0,0 +1,348 @@
+"""
+Full-text search over the extracted text of processed documents.
+
+The extracted text lives compressed in the text store, where MongoDB cannot index it, so
+search uses a local SQLite FTS5 index instead:
+- documents holds the fields results are filtered on (classification, language, date),
+  each with an index
+- documents_text is the FTS5 index of the text and the filename, ranked with BM25
+
+Entries are added as the audit agent logs each document, buffered and written in batches
+by a background thread. Several server processes can share one index file; SQLite
+serializes their writes. Documents logged before the index existed are added with:
+    python -m app.search
+"""
+import os
+import re
+import html
+import time
+import atexit
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from app.metrics import time_stage
+from app.mongo_utils import get_db
+from app.text_store import load_text
+
+logger = logging.getLogger(__name__)
+
+# Search configuration
+SEARCH_DB_PATH = os.getenv("SEARCH_DB_PATH", "search.db")  # SQLite file holding the index
+SEARCH_BATCH_SIZE = int(os.getenv("SEARCH_BATCH_SIZE", 200))  # Documents indexed per transaction at most
+SEARCH_FLUSH_INTERVAL = float(os.getenv("SEARCH_FLUSH_INTERVAL", 1.0))  # Seconds before a partial batch is indexed
+SEARCH_PAGE_SIZE = 20  # Results per page by default
+SEARCH_MAX_PAGE_SIZE = 100
+# Deep pages cost as much as every page before them, so paging stops here
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", 1000))
+# BM25 is computed for every ranked match, so a common term would cost time in proportion to its
+# matches: only the most recent this many matches are ranked
+SEARCH_RANK_CANDIDATES = int(os.getenv("SEARCH_RANK_CANDIDATES", 10000))
+SEARCH_INDEX_RETRIES = int(os.getenv("SEARCH_INDEX_RETRIES", 3))  # Retries of a failed batch before it is dropped
+SEARCH_RETRY_DELAY = float(os.getenv("SEARCH_RETRY_DELAY", 0.5))  # Seconds before the first retry, doubling after
+SEARCH_MIN_PREFIX = 2  # Characters a prefix query needs, since shorter prefixes match nearly every document
+# Prefix lengths FTS5 indexes directly, so prefix queries do not scan every matching term
+PREFIX_INDEX_LENGTHS = "2 3 4"
+SNIPPET_TOKENS = 16  # Words of context around the matches in a snippet
+HIGHLIGHT_START, HIGHLIGHT_END = "<mark>", "</mark>"
+# FTS5 brackets the matches with these, which OCR text never contains, so the snippet can be
+# HTML-escaped before they become the highlight tags
+SNIPPET_START, SNIPPET_END = "\x02", "\x03"
+
+# A quoted phrase, or a single term (ending in * for a prefix query)
+QUERY_TERM = re.compile(r'"([^"]*)"|(\S+)')
+WORD = re.compile(r"\w+")
+
+# Fields stored for filtering and returned with each result
+RESULT_FIELDS = ("audit_id", "filename", "classification", "language", "timestamp", "text_ref")
+
+
+class InvalidQuery(ValueError):
+    """
+    Raised for a search query with nothing to search for.
+    """
+
+
+def build_match_query(query):
+    """
+    Translate a search query into an FTS5 MATCH expression. Every term must match:
+    - "quoted words" match as a phrase
+    - a term ending in * matches as a prefix (e.g. desist*), of at least SEARCH_MIN_PREFIX characters
+    Punctuation is ignored, so user input never reaches FTS5 as syntax.
+    """
+    terms = []
+    for phrase, term in QUERY_TERM.findall(query):
+        words = WORD.findall(phrase or term)
+        if not words:
+            continue
+        prefix = bool(term) and term.endswith("*")
+        if prefix and len(words[-1]) < SEARCH_MIN_PREFIX:
+            raise InvalidQuery(f"Prefix queries need at least {SEARCH_MIN_PREFIX} characters before the *.")
+        terms.append('"' + " ".join(words) + '"' + ("*" if prefix else ""))
+    if not terms:
+        raise InvalidQuery("The search query has no words to search for.")
+    return " AND ".join(terms)
+
+
+def highlight_snippet(snippet):
+    """
+    HTML-escape an FTS5 snippet of document text, then turn its match markers into the
+    highlight tags, so the snippet is safe to render as HTML.
+    """
+    escaped = html.escape(snippet or "")
+    return escaped.replace(SNIPPET_START, HIGHLIGHT_START).replace(SNIPPET_END, HIGHLIGHT_END)
+
+
+class SearchIndex:
+    """
+    Incrementally updated full-text index of processed documents.
+    """
+    def __init__(self, path=SEARCH_DB_PATH, batch_size=SEARCH_BATCH_SIZE, flush_interval=SEARCH_FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []  # [(record, text)]
+        self._writing = 0  # Documents taken by the writer and not yet indexed
+        self._urgent = False  # Set when a caller is waiting for the pending documents
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self._ready = False
+
+    @contextmanager
+    def _connect(self):
+        # One connection per call keeps the index safe to use from any thread
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            yield conn
+        finally:
+            conn.close()
+
+    def _ensure(self):
+        """
+        Create the tables on first use.
+        """
+        if self._ready:
+            return
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    audit_id TEXT NOT NULL UNIQUE,
+                    filename TEXT,
+                    classification TEXT,
+                    language TEXT,
+                    timestamp TEXT,
+                    date TEXT,
+                    text_ref TEXT
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS documents_date ON documents (date)")
+            conn.execute("CREATE INDEX IF NOT EXISTS documents_classification ON documents (classification, date)")
+            conn.execute("CREATE INDEX IF NOT EXISTS documents_language ON documents (language, date)")
+            # Diacritics are folded so "resilie" finds "résilié"
+            conn.execute(
+                f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS documents_text
+                USING fts5(text, filename, tokenize = 'unicode61 remove_diacritics 2', prefix = '{PREFIX_INDEX_LENGTHS}')
+                """
+            )
+        self._ready = True
+
+    def add(self, record, text):
+        """
+        Queue an audit log entry (which must have its _id) and its extracted text for indexing.
+        Returns immediately; the entry is searchable once its batch is written.
+        """
+        if not text or "_id" not in record:
+            return
+        with self._cond:
+            if self._closed:
+                raise Exception("Search index is closed.")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="search-indexer", daemon=True)
+                self._thread.start()
+            self._pending.append((record, text))
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not (self._closed or self._pending):
+                    self._cond.wait()
+                # Give a partial batch the flush interval to fill up
+                self._cond.wait_for(
+                    lambda: self._closed or self._urgent or len(self._pending) >= self.batch_size, self.flush_interval
+                )
+                batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+                self._urgent = bool(self._pending) and self._urgent
+                self._writing = len(batch)
+                closing = self._closed and not self._pending
+
+            if batch:
+                self._index_with_retries(batch)
+            with self._cond:
+                self._writing = 0
+                self._cond.notify_all()
+            if closing:
+                return
+
+    def _index_with_retries(self, batch):
+        """
+        Index a batch, retrying with backoff so a transient failure (e.g. the index locked by
+        another process) does not leave documents unsearchable. A failed attempt rolls back
+        and entries already indexed are skipped, so a retry never duplicates. A batch still
+        failing is logged; `python -m app.search` adds its documents later.
+        """
+        delay = SEARCH_RETRY_DELAY
+        for attempt in range(SEARCH_INDEX_RETRIES + 1):
+            try:
+                self.index(batch)
+                return
+            except Exception as e:
+                if attempt == SEARCH_INDEX_RETRIES:
+                    logger.error("Failed to index documents for search", extra={"documents": len(batch), "error": str(e)})
+                    return
+                logger.warning(
+                    "Retrying search indexing", extra={"documents": len(batch), "attempt": attempt + 1, "error": str(e)}
+                )
+                time.sleep(delay)
+                delay *= 2
+
+    def index(self, documents):
+        """
+        Index a batch of (audit log entry, text) pairs in one transaction, skipping entries
+        already indexed. Returns the number added.
+        """
+        self._ensure()
+        added = 0
+        with time_stage("search_index"), self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for record, text in documents:
+                    timestamp = str(record.get("timestamp") or "")
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO documents (audit_id, filename, classification, language, timestamp, "
+                        "date, text_ref) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (str(record["_id"]), record.get("filename"), record.get("classification"),
+                         record.get("language"), timestamp, timestamp[:10] or None, record.get("text_ref")),
+                    )
+                    if cursor.rowcount:
+                        conn.execute(
+                            "INSERT INTO documents_text (rowid, text, filename) VALUES (?, ?, ?)",
+                            (cursor.lastrowid, text, record.get("filename") or ""),
+                        )
+                        added += 1
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        logger.debug("Indexed documents for search", extra={"documents": added})
+        return added
+
+    def search(self, query, classification=None, language=None, date_from=None, date_to=None,
+               page=1, limit=SEARCH_PAGE_SIZE):
+        """
+        Return a page of the documents matching the query, best match first (BM25), each with
+        a snippet of the text around the matches, HTML-escaped and highlighted with <mark> tags
+        (see highlight_snippet). Filters are
+        exact matches on classification and language and an inclusive date range (YYYY-MM-DD).
+        Only the most recent SEARCH_RANK_CANDIDATES matches of the query are ranked and filtered.
+        Returns {"results", "page", "has_more"}.
+        """
+        match = build_match_query(query)
+        limit = max(1, min(limit, SEARCH_MAX_PAGE_SIZE))
+        offset = (max(1, page) - 1) * limit
+        if offset >= SEARCH_MAX_RESULTS:
+            return {"results": [], "page": page, "has_more": False}
+
+        # Matches are stored in rowid order, so the newest candidates are found without ranking any
+        conditions = [
+            "documents_text MATCH ?",
+            "documents_text.rowid >= (SELECT coalesce(min(rowid), 0) FROM "
+            "(SELECT rowid FROM documents_text WHERE documents_text MATCH ? ORDER BY rowid DESC LIMIT ?))",
+        ]
+        parameters = [match, match, SEARCH_RANK_CANDIDATES]
+        for condition, value in (("d.classification = ?", classification), ("d.language = ?", language),
+                                 ("d.date >= ?", date_from), ("d.date <= ?", date_to)):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+
+        self._ensure()
+        with time_stage("search"), self._connect() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT {', '.join(f'd.{field}' for field in RESULT_FIELDS)},
+                       snippet(documents_text, 0, ?, ?, '…', ?) AS snippet,
+                       documents_text.rank AS rank
+                FROM documents_text JOIN documents d ON d.id = documents_text.rowid
+                WHERE {' AND '.join(conditions)}
+                ORDER BY documents_text.rank
+                LIMIT ? OFFSET ?
+                """,
+                (SNIPPET_START, SNIPPET_END, SNIPPET_TOKENS, *parameters, limit + 1, offset),
+            ).fetchall()
+
+        results = []
+        for row in rows[:limit]:
+            result = {field: row[field] for field in RESULT_FIELDS}
+            # BM25 ranks lower as better; report a score where higher is better
+            result["score"] = round(-row["rank"], 4)
+            result["snippet"] = highlight_snippet(row["snippet"])
+            results.append(result)
+        return {"results": results, "page": page, "has_more": len(rows) > limit and offset + limit < SEARCH_MAX_RESULTS}
+
+    def flush(self):
+        """
+        Wait until everything queued so far has been indexed.
+        """
+        with self._cond:
+            self._urgent = True
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: not self._pending and not self._writing)
+
+    def close(self):
+        """
+        Index everything still pending and stop the writer (called on shutdown).
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+
+def index_audit_logs(index, batch_size=500):
+    """
+    Add every audit log entry not indexed yet to the search index. Returns the number added.
+    """
+    added, batch = 0, []
+    fields = {"filename": 1, "classification": 1, "language": 1, "timestamp": 1, "text_ref": 1, "extracted_text": 1}
+    for record in get_db()["audit_logs"].find({}, fields):
+        text = load_text(record)
+        if text:
+            batch.append((record, text))
+        if len(batch) >= batch_size:
+            added += index.index(batch)
+            batch = []
+    if batch:
+        added += index.index(batch)
+    return added
+
+
+# Shared search index, flushed on interpreter exit if the app did not close it
+search_index = SearchIndex()
+atexit.register(search_index.close)
+
+
+if __name__ == "__main__":
+    print(f"Indexed {index_audit_logs(search_index)} audit log entries in {SEARCH_DB_PATH}.")
@@ -1,16 +1,17 @@
-from pymongo import MongoClient
+from app.mongo_utils import get_client, get_db, ping, close_clients, MONGO_URI
 
-# MongoDB connection string
-MONGO_URI = "mongodb://localhost:27017/"
-
-# Connect to MongoDB
-client = MongoClient(MONGO_URI)
+# Check that MongoDB answers (uses MONGO_URI and the pool settings from the environment)
+print(f"Connecting to {MONGO_URI}")
+if not ping():
+    raise SystemExit("MongoDB is not reachable.")
 
 # List databases
-print("Databases:", client.list_database_names())
+print("Databases:", get_client().list_database_names())
 
-# Switch to a specific database (e.g., cease_desist_db)
-db = client["cease_desist_db"]
+# Switch to the application database (MONGO_DB_NAME, cease_desist_db by default)
+db = get_db()
 
 # List collections in the database
-print("Collections:", db.list_collection_names())
\ No newline at end of file
+print("Collections:", db.list_collection_names())
+
+close_clients()
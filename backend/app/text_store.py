@@ -0,0 +1,175 @@
+"""
+Content-addressed store for extracted document text.
+
+Texts are stored once, zlib-compressed, in the texts collection under the SHA-256 of
+the text. Audit, review and approval records keep only the reference (text_ref) and
+load the text on demand, so the hot collections stay small.
+
+Records written before the store existed keep their text inline; move it with:
+    python -m app.text_store
+"""
+import os
+import zlib
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from bson.binary import Binary
+from pymongo import UpdateOne
+from app.mongo_utils import get_db, get_async_db
+
+logger = logging.getLogger(__name__)
+
+# Text store configuration
+TEXT_STORE_COLLECTION = os.getenv("TEXT_STORE_COLLECTION", "texts")
+TEXT_COMPRESSION_LEVEL = int(os.getenv("TEXT_COMPRESSION_LEVEL", 6))  # zlib level, 1 (fastest) to 9 (smallest)
+TEXT_STORE_KNOWN_SIZE = 10000  # References remembered as stored, to skip repeated upserts of duplicates
+# Collections whose records reference the store instead of holding the text
+TEXT_COLLECTIONS = ("audit_logs", "manual_review", "approved_documents", "further_evaluation")
+
+
+def text_digest(text):
+    """
+    Return the reference of a text: the SHA-256 of its UTF-8 bytes.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class TextStore:
+    """
+    Compressed, deduplicated text blobs keyed by text hash.
+    """
+    def __init__(self, collection_name=TEXT_STORE_COLLECTION, level=TEXT_COMPRESSION_LEVEL):
+        self.collection_name = collection_name
+        self.level = level
+        self._known = OrderedDict()  # References already stored by this process
+        self._lock = threading.Lock()
+
+    def _is_known(self, ref):
+        with self._lock:
+            if ref in self._known:
+                self._known.move_to_end(ref)
+                return True
+            return False
+
+    def _remember(self, ref):
+        with self._lock:
+            self._known[ref] = True
+            while len(self._known) > TEXT_STORE_KNOWN_SIZE:
+                self._known.popitem(last=False)
+
+    def _document(self, text):
+        data = text.encode("utf-8")
+        compressed = zlib.compress(data, self.level)
+        return {
+            "data": Binary(compressed),
+            "codec": "zlib",
+            "size": len(data),
+            "compressed_size": len(compressed),
+            "created_at": datetime.utcnow(),
+        }
+
+    @staticmethod
+    def _decode(document):
+        if document is None:
+            return None
+        return zlib.decompress(document["data"]).decode("utf-8")
+
+    def put(self, text):
+        """
+        Store a text (once per distinct text) and return its reference.
+        """
+        ref = text_digest(text)
+        if not self._is_known(ref):
+            # $setOnInsert makes storing a duplicate a no-op
+            get_db()[self.collection_name].update_one({"_id": ref}, {"$setOnInsert": self._document(text)}, upsert=True)
+            self._remember(ref)
+        return ref
+
+    async def put_async(self, text):
+        """
+        Async version of put, for use from the event loop.
+        """
+        ref = text_digest(text)
+        if not self._is_known(ref):
+            # Compressing a long text is CPU work; keep it off the event loop
+            document = await asyncio.to_thread(self._document, text)
+            await get_async_db()[self.collection_name].update_one(
+                {"_id": ref}, {"$setOnInsert": document}, upsert=True
+            )
+            self._remember(ref)
+        return ref
+
+    def get(self, ref):
+        """
+        Return the text with the given reference, or None if it is not stored.
+        """
+        return self._decode(get_db()[self.collection_name].find_one({"_id": ref}, {"data": 1}))
+
+    async def get_async(self, ref):
+        """
+        Async version of get, for use from the event loop.
+        """
+        document = await get_async_db()[self.collection_name].find_one({"_id": ref}, {"data": 1})
+        return self._decode(document)
+
+
+text_store = TextStore()
+
+
+def load_text(record):
+    """
+    Return the text of a record, from the store or, for older records, inline.
+    """
+    if record.get("text_ref"):
+        return text_store.get(record["text_ref"])
+    return record.get("extracted_text")
+
+
+async def load_text_async(record):
+    """
+    Async version of load_text, for use from the event loop.
+    """
+    if record.get("text_ref"):
+        return await text_store.get_async(record["text_ref"])
+    return record.get("extracted_text")
+
+
+async def externalize_text_async(record):
+    """
+    Move a record's inline extracted_text into the store, leaving the reference behind.
+    The record is changed in place and returned.
+    """
+    text = record.pop("extracted_text", None)
+    if isinstance(text, str):
+        record["text_ref"] = await text_store.put_async(text)
+        record["text_length"] = len(text)
+    return record
+
+
+def externalize_collection(collection_name, batch_size=500):
+    """
+    Move the inline text of every record in a collection into the store. Returns the number moved.
+    """
+    db = get_db()
+    moved, updates = 0, []
+    cursor = db[collection_name].find({"extracted_text": {"$type": "string"}}, {"extracted_text": 1})
+    for record in cursor:
+        text = record["extracted_text"]
+        updates.append(UpdateOne(
+            {"_id": record["_id"]},
+            {"$set": {"text_ref": text_store.put(text), "text_length": len(text)}, "$unset": {"extracted_text": ""}},
+        ))
+        if len(updates) >= batch_size:
+            moved += db[collection_name].bulk_write(updates, ordered=False).modified_count
+            updates = []
+    if updates:
+        moved += db[collection_name].bulk_write(updates, ordered=False).modified_count
+    return moved
+
+
+if __name__ == "__main__":
+    for name in TEXT_COLLECTIONS:
+        print(f"{name}: moved the text of {externalize_collection(name)} records to {TEXT_STORE_COLLECTION}.")
@@ -0,0 +1,84 @@
+"""
+Train the TF-IDF + logistic regression model used by the classifier's model tier.
+
+Labelled examples come from the audit_logs collection (labels assigned by the
+pipeline) and the approved_documents collection (labels confirmed by a reviewer,
+which take precedence for the same filename).
+
+Usage:
+    python -m app.train_classifier --output models/classifier.joblib
+"""
+import os
+import argparse
+import joblib
+from sklearn.pipeline import Pipeline
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import classification_report
+from app.mongo_utils import get_db, ping, MONGO_URI
+from app.classifier import CLASSIFICATION_LABELS, CLASSIFIER_MODEL_PATH
+from app.text_store import load_text
+
+
+def load_examples():
+    """
+    Return (texts, labels) from the audit and approval collections.
+    """
+    examples = {}
+    projection = {"_id": 0, "filename": 1, "extracted_text": 1, "text_ref": 1, "classification": 1}
+    query = {
+        # The text is held in the text store (text_ref) or, for older records, inline
+        "$or": [{"text_ref": {"$exists": True}}, {"extracted_text": {"$exists": True}}],
+        "classification": {"$in": list(CLASSIFICATION_LABELS)},
+    }
+    db = get_db()
+    for collection_name in ("audit_logs", "approved_documents"):
+        for document in db[collection_name].find(query, projection):
+            text = load_text(document)
+            if text is None:
+                continue
+            # Later collections (reviewer decisions) overwrite earlier ones
+            key = document.get("filename") or text
+            examples[key] = (text, document["classification"])
+    texts = [text for text, _ in examples.values()]
+    labels = [label for _, label in examples.values()]
+    return texts, labels
+
+
+def build_model():
+    return Pipeline([
+        ("tfidf", TfidfVectorizer(ngram_range=(1, 2), min_df=2, sublinear_tf=True, lowercase=True)),
+        ("clf", LogisticRegression(max_iter=1000, class_weight="balanced")),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the classifier's model tier.")
+    parser.add_argument("--output", default=CLASSIFIER_MODEL_PATH, help="Where to write the model")
+    parser.add_argument("--test-size", type=float, default=0.2, help="Share of examples held out for evaluation")
+    args = parser.parse_args()
+
+    if not ping():
+        raise SystemExit(f"Database connection not available at {MONGO_URI}.")
+    texts, labels = load_examples()
+    print(f"Loaded {len(texts)} labelled documents.")
+    if len(set(labels)) < 2:
+        raise SystemExit("Need examples of at least two classes to train.")
+
+    if args.test_size > 0:
+        train_texts, test_texts, train_labels, test_labels = train_test_split(
+            texts, labels, test_size=args.test_size, random_state=0, stratify=labels
+        )
+        model = build_model().fit(train_texts, train_labels)
+        print(classification_report(test_labels, model.predict(test_texts)))
+
+    # The shipped model is trained on everything
+    model = build_model().fit(texts, labels)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    joblib.dump(model, args.output)
+    print(f"Model written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import io
+import os
+import json
+import uuid
+import asyncio
+import hashlib
+import shutil
+import logging
+import tempfile
+from app.metrics import time_stage
+
+logger = logging.getLogger(__name__)
+
+# Upload limits
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 50 * 2**20))  # Largest single file accepted
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", 500 * 2**20))  # Largest request body (bulk uploads)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 2**20))  # Bytes copied at a time
+
+# Poppler and Tesseract read documents by path, so every upload is copied to a spool file:
+# up to UPLOAD_SPOOL_LIMIT into UPLOAD_SPOOL_DIR (the temp dir on disk by default; point it at a
+# tmpfs such as /dev/shm to keep small uploads off the disk), larger ones into UPLOAD_DISK_DIR.
+# A tmpfs is small (64MB in a default Docker container), so UPLOAD_SPOOL_DIR is only used while
+# UPLOAD_SPOOL_HEADROOM bytes stay free
+UPLOAD_SPOOL_LIMIT = int(os.getenv("UPLOAD_SPOOL_LIMIT", 16 * 2**20))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", tempfile.gettempdir())
+UPLOAD_SPOOL_HEADROOM = int(os.getenv("UPLOAD_SPOOL_HEADROOM", 32 * 2**20))
+UPLOAD_DISK_DIR = os.getenv("UPLOAD_DISK_DIR", "static")
+
+
+class UploadTooLarge(Exception):
+    """
+    Raised when an upload grows past its size limit while being streamed.
+    """
+    def __init__(self, limit):
+        super().__init__(f"Upload exceeds the maximum size of {limit} bytes.")
+        self.limit = limit
+
+
+def _fits_in_spool_dir(size):
+    """
+    Whether a document of the given size may be spooled to UPLOAD_SPOOL_DIR.
+    """
+    if size is None or size > UPLOAD_SPOOL_LIMIT:
+        return False
+    try:
+        return shutil.disk_usage(UPLOAD_SPOOL_DIR).free - size >= UPLOAD_SPOOL_HEADROOM
+    except OSError:
+        return False
+
+
+def spool_location(filename, size=None):
+    """
+    Return a unique path for a document of the given size (unknown sizes go to disk).
+    """
+    directory = UPLOAD_SPOOL_DIR if _fits_in_spool_dir(size) else UPLOAD_DISK_DIR
+    # Generate a unique filename to avoid overwriting; never trust the client's directory part
+    return os.path.join(directory, f"{uuid.uuid4()}_{os.path.basename(filename)}")
+
+
+def _copy(source, destination, max_bytes):
+    """
+    Copy source to destination in chunks, hashing as it goes and stopping at max_bytes.
+    Returns the SHA-256 and the size.
+    """
+    digest, size = hashlib.sha256(), 0
+    while True:
+        chunk = source.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return digest.hexdigest(), size
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        digest.update(chunk)
+        destination.write(chunk)
+
+
+async def save_upload(file, max_bytes=MAX_UPLOAD_BYTES):
+    """
+    Stream an uploaded file to its spool location in chunks, without holding it in memory.
+    This is a second copy of the request body Starlette has already spooled (to disk above
+    1MB): it goes to disk too unless UPLOAD_SPOOL_DIR is a tmpfs.
+    Returns (file_location, digest, size); the digest is the SHA-256 of the bytes.
+    Raises UploadTooLarge (leaving nothing behind) once more than max_bytes have been read.
+    """
+    file_location = spool_location(file.filename, file.size)
+    try:
+        with time_stage("save"):
+            with open(file_location, "wb") as f:
+                # One worker thread for the whole copy rather than a hop per chunk
+                digest, size = await asyncio.to_thread(_copy, file.file, f, max_bytes)
+    except BaseException:
+        discard_upload(file_location)
+        raise
+    logger.info("File saved", extra={"document": file.filename, "bytes": size, "file_location": file_location})
+    return file_location, digest, size
+
+
+async def read_upload(file, max_bytes=MAX_UPLOAD_BYTES):
+    """
+    Read an uploaded file into memory, enforcing max_bytes while reading.
+    Returns (contents, digest).
+    """
+    buffer = io.BytesIO()
+    digest, _ = await asyncio.to_thread(_copy, file.file, buffer, max_bytes)
+    return buffer.getvalue(), digest
+
+
+def discard_upload(file_location):
+    """
+    Remove a spooled upload if it is still there.
+    """
+    if file_location and os.path.exists(file_location):
+        os.remove(file_location)
+        logger.debug("File removed", extra={"file_location": file_location})
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware rejecting request bodies larger than max_bytes with a 413.
+    The declared Content-Length is checked up front and the streamed body is counted
+    as it arrives, so an oversized upload is cut off before it is spooled in full.
+    """
+    def __init__(self, app, max_bytes=MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": f"Request body exceeds the maximum size of {self.max_bytes} bytes."}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        declared = headers.get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > self.max_bytes:
+            return await self._reject(send)
+
+        received = 0
+        exceeded = False  # Set once the body passes the limit
+        responded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise UploadTooLarge(self.max_bytes)
+            return message
+
+        async def guarded_send(message):
+            nonlocal responded
+            if exceeded:
+                # The app turned the aborted body into its own error; answer with the 413 instead
+                if message["type"] == "http.response.start" and not responded:
+                    responded = True
+                    await self._reject(send)
+                return
+            if message["type"] == "http.response.start":
+                responded = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            if responded:
+                raise
+            await self._reject(send)
@@ -1,4 +1,5 @@
 import os
+from app.archive import archive_log
 
 def write_to_datastore(filename, extracted_text, timestamp):
     """
@@ -20,8 +21,6 @@ def log_for_audit(filename, extracted_text, classification, timestamp):
 
 def archive_file(filename, timestamp):
     """
-    Archive "Irrelevant" requests by writing details to a flat file.
+    Archive "Irrelevant" requests by appending them to the archive log (see app/archive.py).
     """
-    archive_path = "static/archive.txt"
-    with open(archive_path, "a") as f:
-        f.write(f"{timestamp} - {filename} - Archived as Irrelevant\n")
\ No newline at end of file
+    archive_log.append({"timestamp": timestamp, "filename": filename, "classification": "Irrelevant"})
\ No newline at end of file
@@ -0,0 +1,78 @@
+"""
+Measure /dashboard/metrics/ latency while uploads are in flight.
+
+Polls the dashboard endpoint of a running server, first idle and then while
+a number of concurrent /upload/ requests are being processed, and prints the
+p50/p99 latency of both phases. With a non-blocking event loop the two should
+stay close.
+
+Usage:
+    python benchmarks/dashboard_latency.py --url http://localhost:8000 --pdf "../Sample Docs/LOA2.pdf"
+"""
+import argparse
+import asyncio
+import time
+import aiohttp
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def poll_dashboard(session, url, stop, interval):
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        async with session.get(f"{url}/dashboard/metrics/") as response:
+            await response.read()
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def upload(session, url, pdf_path):
+    with open(pdf_path, "rb") as f:
+        form = aiohttp.FormData()
+        form.add_field("file", f.read(), filename=pdf_path.rsplit("/", 1)[-1], content_type="application/pdf")
+    async with session.post(f"{url}/upload/", data=form) as response:
+        await response.read()
+
+
+async def measure(url, pdf_path, uploads, duration, interval):
+    async with aiohttp.ClientSession() as session:
+        # Idle phase
+        stop = asyncio.Event()
+        poller = asyncio.create_task(poll_dashboard(session, url, stop, interval))
+        await asyncio.sleep(duration)
+        stop.set()
+        idle = await poller
+
+        # Loaded phase: keep the dashboard polled until every upload has finished
+        stop = asyncio.Event()
+        poller = asyncio.create_task(poll_dashboard(session, url, stop, interval))
+        await asyncio.gather(*(upload(session, url, pdf_path) for _ in range(uploads)))
+        stop.set()
+        loaded = await poller
+
+    for name, latencies in (("idle", idle), ("loaded", loaded)):
+        print(
+            f"{name:>6}: n={len(latencies)} "
+            f"p50={percentile(latencies, 50):.1f}ms p99={percentile(latencies, 99):.1f}ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--pdf", required=True, help="PDF uploaded during the loaded phase")
+    parser.add_argument("--uploads", type=int, default=8, help="Concurrent uploads in the loaded phase")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds to measure the idle phase")
+    parser.add_argument("--interval", type=float, default=0.05, help="Seconds between dashboard polls")
+    args = parser.parse_args()
+    asyncio.run(measure(args.url, args.pdf, args.uploads, args.duration, args.interval))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""
+End-to-end benchmark of /upload/ and /bulk_upload/ on the bundled sample documents.
+
+Runs the real pipeline in-process: the text layer, OCR, language detection, the
+classifier tiers and the agents. Two local stand-ins replace the external services:
+- OpenAI: a deterministic stub that answers with a fixed label for a given text after
+  a configurable delay, for single prompts and packed function-call requests alike.
+- MongoDB: mongomock and mongomock-motor, so nothing touches a real database.
+
+The documents are the Sample Docs PDFs (LOA*, notice_*, bw_doc_*) and the archive/*.jpg
+scans. Each scan is wrapped in a single-page PDF, since the endpoints only accept PDFs.
+
+Each endpoint runs from a cold result cache. The report covers:
+- request latency percentiles
+- per-stage latency percentiles (extract, language, classify, route)
+- documents per second
+- the peak RSS of the server process and its OCR workers
+The report is written as JSON so runs can be compared.
+
+Tesseract and poppler must be installed, as for the server itself, along with
+benchmarks/requirements.txt.
+
+Usage (from the backend directory):
+    python benchmarks/pipeline_benchmark.py --output benchmark.json
+"""
+import argparse
+import asyncio
+import contextlib
+import functools
+import glob
+import hashlib
+import io
+import json
+import os
+import platform
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import mongomock
+import mongomock_motor
+import openai
+import psutil
+from openai.openai_object import OpenAIObject
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_PATTERNS = ("LOA*.pdf", "LoA*.pdf", "notice_*.pdf", "bw_doc_*.pdf")
+
+# Latencies recorded per stage during the current phase
+stage_samples = {}
+
+# Documents inside a packed classification request
+PACKED_DOCUMENT = re.compile(r'<document id="(\d+)">\n(.*?)\n</document>', re.DOTALL)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies):
+    """
+    Percentiles of a list of latencies, in milliseconds.
+    """
+    if not latencies:
+        return {"count": 0}
+    return {
+        "count": len(latencies),
+        "mean": round(sum(latencies) / len(latencies), 2),
+        "p50": round(percentile(latencies, 50), 2),
+        "p90": round(percentile(latencies, 90), 2),
+        "p99": round(percentile(latencies, 99), 2),
+        "max": round(max(latencies), 2),
+    }
+
+
+def stub_label(prompt):
+    """
+    Deterministic stand-in for the model's answer to a classification prompt.
+    Pass only the document text: the prompt's instructions name every category, so the
+    whole prompt would always be labelled Cease.
+    """
+    text = prompt.lower()
+    if "cease" in text or "stop contacting" in text or "do not contact" in text:
+        return "Cease"
+    if "dispute" in text or "verify" in text or "validation" in text:
+        return "Uncertain"
+    return "Irrelevant"
+
+
+def install_stand_ins(llm_latency):
+    """
+    Replace MongoDB and the OpenAI API with local stand-ins. Must run before the app is used.
+    """
+    import app.mongo_utils
+
+    # Hand the shared Mongo layer clients backed by one in-memory store
+    sync_client = mongomock.MongoClient()
+    app.mongo_utils._client = sync_client
+    app.mongo_utils._async_client = mongomock_motor.AsyncMongoMockClient(mock_mongo_client=sync_client)
+
+    def completion(messages, functions=None):
+        prompt = "\n".join(message["content"] for message in messages)
+        if functions:
+            # Packed request: answer through the function call, one entry per document
+            classifications = [
+                {"id": int(index), "label": stub_label(text)} for index, text in PACKED_DOCUMENT.findall(prompt)
+            ]
+            message = {
+                "role": "assistant",
+                "content": None,
+                "function_call": {
+                    "name": functions[0]["name"],
+                    "arguments": json.dumps({"classifications": classifications}),
+                },
+            }
+        else:
+            # Label only the document text, not the instructions naming the categories
+            message = {"role": "assistant", "content": stub_label(prompt.rpartition("Text:")[2])}
+        return OpenAIObject.construct_from({"choices": [{"message": message}]})
+
+    def create(model=None, messages=(), functions=None, **kwargs):
+        time.sleep(llm_latency)
+        stage_samples.setdefault("llm", []).append(llm_latency * 1000)
+        return completion(messages, functions)
+
+    async def acreate(model=None, messages=(), functions=None, **kwargs):
+        await asyncio.sleep(llm_latency)
+        stage_samples.setdefault("llm", []).append(llm_latency * 1000)
+        return completion(messages, functions)
+
+    openai.ChatCompletion.create = create
+    openai.ChatCompletion.acreate = acreate
+
+
+def timed(module, name, stage):
+    """
+    Wrap module.name so every call records its latency under the stage.
+    """
+    function = getattr(module, name)
+
+    if asyncio.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                stage_samples.setdefault(stage, []).append((time.perf_counter() - start) * 1000)
+    else:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stage_samples.setdefault(stage, []).append((time.perf_counter() - start) * 1000)
+
+    setattr(module, name, wrapper)
+
+
+def instrument_stages():
+    """
+    Time the pipeline stages wherever the endpoints look them up.
+    """
+    import app.main
+    import app.bulk
+    import app.pipeline
+
+    timed(app.pipeline, "extract_document", "extract")
+    timed(app.bulk, "extract_document", "extract")
+    timed(app.pipeline, "detect_language", "language")
+    timed(app.pipeline, "classify_document_async", "classify")
+    timed(app.main, "route_document_async", "route")
+    timed(app.bulk, "route_document_async", "route")
+
+
+def load_documents(samples_dir, scans_dir):
+    """
+    Return (filename, pdf_bytes) for the sample PDFs and the archived scans.
+    """
+    documents = []
+    paths = sorted({path for pattern in SAMPLE_PATTERNS for path in glob.glob(os.path.join(samples_dir, pattern))})
+    for path in paths:
+        with open(path, "rb") as f:
+            documents.append((os.path.basename(path), f.read()))
+
+    for path in sorted(glob.glob(os.path.join(scans_dir, "*.jpg"))):
+        if os.path.basename(path).startswith("._"):
+            continue
+        buffer = io.BytesIO()
+        with Image.open(path) as image:
+            image.convert("RGB").save(buffer, format="PDF")
+        documents.append((os.path.splitext(os.path.basename(path))[0] + ".pdf", buffer.getvalue()))
+    return documents
+
+
+class PeakRSS:
+    """
+    Sample the RSS of this process and its children (the OCR workers) in the background
+    and keep the highest total seen.
+    """
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        process = psutil.Process()
+        total = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass  # The child exited between listing and sampling
+        self.peak = max(self.peak, total)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sample()
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def reset_caches():
+    """
+    Forget every document seen so far, so each pass runs cold: the result cache, the
+    near-duplicate index (whose labels would otherwise be reused) and the per-process
+    memos of language detections, signatures and stored texts.
+    """
+    from app.cache import result_cache
+    from app.language import language_detector
+    from app.mongo_utils import get_db
+    from app.near_duplicates import near_duplicate_index
+    from app.text_store import text_store
+
+    result_cache.clear()
+    get_db().drop_collection(near_duplicate_index.collection_name)
+    near_duplicate_index._indexes_ready = False
+    get_db().drop_collection(text_store.collection_name)
+    for memo, lock in ((near_duplicate_index._signatures, near_duplicate_index._lock),
+                       (language_detector._lru, language_detector._lock),
+                       (text_store._known, text_store._lock)):
+        with lock:
+            memo.clear()
+
+
+def run_phase(client, endpoint, documents, iterations, ocr_profile):
+    """
+    Send every document through the endpoint from a cold start and report the measurements.
+    """
+    params = {"ocr_profile": ocr_profile} if ocr_profile else {}
+    request_latencies, outcomes, errors = [], Counter(), 0
+    stage_samples.clear()
+    wall = 0.0
+
+    with PeakRSS() as rss:
+        for _ in range(iterations):
+            reset_caches()
+            start = time.perf_counter()
+            if endpoint == "/upload/":
+                results = []
+                for filename, contents in documents:
+                    request_start = time.perf_counter()
+                    response = client.post(
+                        endpoint, params=params, files={"file": (filename, contents, "application/pdf")}
+                    )
+                    request_latencies.append((time.perf_counter() - request_start) * 1000)
+                    results.append(response.json() if response.status_code == 200 else {"error": response.text})
+            else:
+                files = [("files", (filename, contents, "application/pdf")) for filename, contents in documents]
+                response = client.post(endpoint, params=params, files=files)
+                request_latencies.append((time.perf_counter() - start) * 1000)
+                results = response.json()["results"] if response.status_code == 200 else [{"error": response.text}]
+            wall += time.perf_counter() - start
+
+            for result in results:
+                if "error" in result:
+                    errors += 1
+                else:
+                    outcomes[f"{result['classification']}/{result.get('classification_tier')}"] += 1
+
+    processed = len(documents) * iterations
+    return {
+        "documents": processed,
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "docs_per_second": round(processed / wall, 3) if wall else None,
+        "peak_rss_mb": round(rss.peak / 2**20, 1),
+        "request_latency_ms": summarize(request_latencies),
+        "stage_latency_ms": {stage: summarize(samples) for stage, samples in sorted(stage_samples.items())},
+        "outcomes": dict(sorted(outcomes.items())),  # classification/tier counts, to spot behaviour changes
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", default=os.path.join(BACKEND_DIR, "..", "Sample Docs"))
+    parser.add_argument("--scans", default=os.path.join(BACKEND_DIR, "archive"))
+    parser.add_argument("--iterations", type=int, default=1, help="Passes over the documents per endpoint")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Seconds the OpenAI stub takes to answer")
+    parser.add_argument("--ocr-profile", default=None, help="OCR profile to request (server default if omitted)")
+    parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    documents = load_documents(args.samples, args.scans)
+    if not documents:
+        parser.error("No sample documents found.")
+
+    # Keep the benchmark's job queue away from the server's
+    workdir = tempfile.mkdtemp(prefix="pipeline-benchmark-")
+    os.environ.setdefault("JOBS_DB_PATH", os.path.join(workdir, "jobs.db"))
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
+
+    # The server logs to stdout, which is reserved for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        install_stand_ins(args.llm_latency)
+
+        from fastapi.testclient import TestClient
+        from app.main import app
+        from app.ocr import OCR_WORKERS, OCR_PROFILE
+        instrument_stages()
+
+        with TestClient(app) as client:
+            # Warm up the OCR pool and the classifier model outside the measurements
+            filename, contents = documents[0]
+            client.post("/upload/", files={"file": (filename, contents, "application/pdf")})
+
+            endpoints = {
+                endpoint: run_phase(client, endpoint, documents, args.iterations, args.ocr_profile)
+                for endpoint in ("/upload/", "/bulk_upload/")
+            }
+
+    report = {
+        "benchmark": "pipeline",
+        "started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "ocr_workers": OCR_WORKERS,
+            "ocr_profile": args.ocr_profile or OCR_PROFILE,
+            "llm_latency_seconds": args.llm_latency,
+            "iterations": args.iterations,
+        },
+        # Identifies the document set, so reports are only compared like for like
+        "corpus": {
+            "documents": len(documents),
+            "sha256": hashlib.sha256(b"".join(contents for _, contents in documents)).hexdigest(),
+        },
+        "endpoints": endpoints,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
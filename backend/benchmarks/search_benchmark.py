@@ -0,0 +1,122 @@
+"""
+Benchmark of full-text search latency at scale.
+
+Fills a scratch search index (see app/search.py) with synthetic letters, a share of them
+using the cease vocabulary, then times queries from rare to very common terms, with and
+without filters. Nothing outside the scratch directory is touched, and no MongoDB or
+OpenAI stand-ins are needed.
+
+The report gives the latency percentiles of each query as JSON, so runs can be compared,
+e.g. with different SEARCH_RANK_CANDIDATES settings.
+
+Usage (from the backend directory):
+    python benchmarks/search_benchmark.py --documents 1000000 --output search.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = (
+    "account balance payment invoice statement customer service reference number dear sir madam "
+    "regards sincerely letter request please thank you received dated above mentioned our records "
+    "show amount due outstanding collection agency notice review information provide copy"
+).split()
+CEASE_SENTENCES = (
+    "Please cease and desist all communication with me.",
+    "Stop contacting me about this account.",
+    "I dispute this debt and request validation.",
+)
+QUERIES = ("cease", "desist", "validation", "account payment", '"stop contacting"', "outst*", "reference")
+CLASSIFICATIONS = ("Cease", "Uncertain", "Irrelevant")
+BUILD_BATCH = 5000
+
+
+def synthetic_documents(count, cease_share, seed=1):
+    """
+    Yield (record, text) pairs shaped like the audit log entries the index is fed with.
+    """
+    rng = random.Random(seed)
+    for i in range(count):
+        words = rng.choices(WORDS, k=60)
+        if rng.random() < cease_share:
+            words.append(rng.choice(CEASE_SENTENCES))
+        record = {
+            "_id": f"{i:024x}",
+            "filename": f"letter_{i}.pdf",
+            "classification": rng.choice(CLASSIFICATIONS),
+            "language": "en",
+            "timestamp": f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:00:00",
+        }
+        yield record, " ".join(words)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=1000000, help="Documents in the scratch index")
+    parser.add_argument("--cease-share", type=float, default=0.3, help="Share of documents with a cease sentence")
+    parser.add_argument("--repeats", type=int, default=20, help="Timed runs per query")
+    parser.add_argument("--index", default=None, help="Reuse (or keep) the scratch index at this path")
+    parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    sys.path.insert(0, BACKEND_DIR)
+    from app.search import SearchIndex, SEARCH_RANK_CANDIDATES
+
+    path = args.index or os.path.join(tempfile.mkdtemp(prefix="search-benchmark-"), "search.db")
+    index = SearchIndex(path)
+    build_seconds = 0.0
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        batch = []
+        for document in synthetic_documents(args.documents, args.cease_share):
+            batch.append(document)
+            if len(batch) >= BUILD_BATCH:
+                index.index(batch)
+                batch = []
+        if batch:
+            index.index(batch)
+        build_seconds = time.perf_counter() - start
+        print(f"Indexed {args.documents} documents in {build_seconds:.1f}s", file=sys.stderr)
+
+    queries = {}
+    for query in QUERIES:
+        for label, filters in (("", {}), (" [Cease, 2026-06]", {"classification": "Cease", "date_from": "2026-06-01",
+                                                               "date_to": "2026-06-30"})):
+            latencies = []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                index.search(query, **filters)
+                latencies.append((time.perf_counter() - start) * 1000)
+            queries[query + label] = {
+                "p50": round(percentile(latencies, 50), 2),
+                "p90": round(percentile(latencies, 90), 2),
+                "max": round(max(latencies), 2),
+            }
+
+    report = {
+        "documents": args.documents,
+        "rank_candidates": SEARCH_RANK_CANDIDATES,
+        "build_seconds": round(build_seconds, 1),
+        "latency_ms": queries,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -69,6 +69,7 @@ const ChatInterface = () => {
         classification,
         action,
         language: language || "Unknown", // Include detected language
+        auditId: audit_status?.audit_id, // Lets the chat refer back to this document
         auditStatus: audit_status?.status || "Audit status not available",
         agentStatus: agent_status?.status || "Agent status not available",
       });
@@ -112,28 +113,58 @@ const ChatInterface = () => {
     }
   };
 
-  // Handle sending a chat message
+  // Handle sending a chat message; the reply is streamed in as it is generated
   const handleSendMessage = async () => {
     if (!userMessage.trim()) return;
 
     const newMessages = [...messages, { role: "user", content: userMessage }];
-    setMessages(newMessages);
+    setMessages([...newMessages, { role: "assistant", content: "" }]);
     setUserMessage(""); // Clear input
     setLoading(true);
     setError(null); // Clear previous errors
 
     try {
-      const response = await axios.post("http://localhost:8000/chat/", {
-        messages: newMessages,
-        language: classificationResult?.language || "unknown", // Include detected language
+      const response = await fetch("http://localhost:8000/chat/", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+          messages: newMessages, // Full conversation history
+          language: classificationResult?.language || "unknown", // Include detected language
+          audit_id: classificationResult?.auditId, // Ground the answer in the uploaded document
+          stream: true,
+        }),
       });
+      if (!response.ok) {
+        throw new Error((await response.json()).detail);
+      }
 
-      setMessages([
-        ...newMessages,
-        { role: "assistant", content: response.data.response },
-      ]);
+      // Read Server-Sent Events: "data:" lines carry text, "event: error" ends the stream
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let reply = "";
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split("\n\n");
+        buffer = events.pop(); // Keep any incomplete event for the next read
+        for (const event of events) {
+          const dataLine = event.split("\n").find((line) => line.startsWith("data: "));
+          if (!dataLine) continue;
+          const data = JSON.parse(dataLine.slice("data: ".length));
+          if (event.startsWith("event: error")) {
+            throw new Error(data.detail);
+          }
+          if (data.content) {
+            reply += data.content;
+            setMessages([...newMessages, { role: "assistant", content: reply }]);
+          }
+        }
+      }
     } catch (error) {
       console.error("Error sending message:", error);
+      setMessages(newMessages); // Drop the unfinished reply
       setError("An error occurred while sending the message. Please try again.");
     } finally {
       setLoading(false);
@@ -1,29 +1,97 @@
-import React, { useEffect, useState } from "react";
-import { Box, Typography, Tabs, Tab, Paper, Select, MenuItem, FormControl, InputLabel, Checkbox, ListItemText } from "@mui/material";
+import React, { useCallback, useEffect, useRef, useState } from "react";
+import { Box, Typography, Tabs, Tab, Paper, Select, MenuItem, FormControl, InputLabel, Checkbox, ListItemText, Button } from "@mui/material";
 import axios from "axios";
 
+const API_URL = "http://localhost:8000";
+const PAGE_SIZE = 50; // Records fetched per page
+const REFRESH_INTERVAL_MS = 15000; // How often new records are fetched
+
+// Tabs in display order: feed collection and title
+const FEEDS = [
+  { key: "audit_logs", title: "Audit Logs" },
+  { key: "approved_documents", title: "Approved Documents" },
+  { key: "classification_logs", title: "Classification Logs" },
+  { key: "further_evaluation", title: "Further Evaluation" },
+  { key: "manual_review", title: "Manual Review" },
+];
+
+// Merge records into a list kept newest first, replacing any already listed (by id)
+const mergeRecords = (existing, records) => {
+  const seen = new Set(records.map((record) => record.id));
+  return [...records, ...existing.filter((record) => !seen.has(record.id))].sort((a, b) =>
+    a.created_at === b.created_at ? (a.id < b.id ? 1 : -1) : a.created_at < b.created_at ? 1 : -1
+  );
+};
+
 const Dashboard = () => {
   const [metrics, setMetrics] = useState(null); // Metrics data
-  const [recentData, setRecentData] = useState(null); // Recent data
+  const [feeds, setFeeds] = useState({}); // Per collection: { items, nextCursor, since }
   const [loading, setLoading] = useState(true); // Loading state
   const [error, setError] = useState(null); // Error state
   const [activeTab, setActiveTab] = useState(0); // Active sub-tab
   const [filters, setFilters] = useState({}); // Filters for each tab
+  const [reviewClusters, setReviewClusters] = useState([]); // Manual review queue grouped by near-duplicate cluster
+  const feedsRef = useRef(feeds); // Latest feeds, for the refresh timer
+  feedsRef.current = feeds;
+
+  const fetchMetrics = useCallback(async () => {
+    const response = await axios.get(`${API_URL}/dashboard/metrics/`);
+    setMetrics(response.data.metrics);
+  }, []);
+
+  const fetchReviewClusters = useCallback(async () => {
+    const response = await axios.get(`${API_URL}/dashboard/review_clusters/`, { params: { limit: PAGE_SIZE } });
+    setReviewClusters(response.data.clusters);
+  }, []);
+
+  // Fetch the first page of a feed, or the next page after its cursor
+  const fetchPage = useCallback(async (key, cursor) => {
+    const response = await axios.get(`${API_URL}/dashboard/feeds/${key}`, {
+      params: { limit: PAGE_SIZE, cursor },
+    });
+    const { items, next_cursor, since } = response.data;
+    setFeeds((prev) => {
+      const feed = prev[key] || { items: [] };
+      return {
+        ...prev,
+        [key]: {
+          items: mergeRecords(feed.items, items),
+          nextCursor: next_cursor,
+          since: cursor ? feed.since : since, // Only the first page sets where refreshes start
+        },
+      };
+    });
+  }, []);
+
+  // Fetch only the records written since the last fetch of a feed; resolves to how many there were
+  const fetchDelta = useCallback(async (key) => {
+    let since = feedsRef.current[key]?.since;
+    if (!since) return 0;
+    let received = 0;
+    let hasMore = true;
+    while (hasMore) {
+      const response = await axios.get(`${API_URL}/dashboard/feeds/${key}`, {
+        params: { limit: PAGE_SIZE, since },
+      });
+      const { items, has_more } = response.data;
+      since = response.data.since;
+      hasMore = has_more;
+      received += items.length;
+      setFeeds((prev) => ({
+        ...prev,
+        [key]: { ...prev[key], items: mergeRecords(prev[key].items, items), since: response.data.since },
+      }));
+    }
+    return received;
+  }, []);
 
   useEffect(() => {
-    const fetchMetrics = async () => {
+    const fetchDashboard = async () => {
       try {
-        const response = await axios.get("http://localhost:8000/dashboard/metrics/");
-        setMetrics(response.data.metrics);
-        setRecentData(response.data.recent_data);
+        await Promise.all([fetchMetrics(), fetchReviewClusters(), ...FEEDS.map((feed) => fetchPage(feed.key))]);
 
         // Initialize filters for each tab
-        setFilters({
-          audit_logs: {},
-          approved_documents: {},
-          classification_logs: {},
-          further_evaluation: {},
-        });
+        setFilters(Object.fromEntries(FEEDS.map((feed) => [feed.key, {}])));
       } catch (error) {
         console.error("Error fetching dashboard metrics:", error);
         setError("Failed to fetch dashboard metrics.");
@@ -32,8 +100,23 @@ const Dashboard = () => {
       }
     };
 
-    fetchMetrics();
-  }, []);
+    fetchDashboard();
+
+    // Refresh with only the new activity. The clusters are an aggregation over the review queue,
+    // so they are recomputed only when new manual review records arrived
+    const timer = setInterval(async () => {
+      try {
+        const [, ...received] = await Promise.all([fetchMetrics(), ...FEEDS.map((feed) => fetchDelta(feed.key))]);
+        const reviewIndex = FEEDS.findIndex((feed) => feed.key === "manual_review");
+        if (received[reviewIndex] > 0) {
+          await fetchReviewClusters();
+        }
+      } catch (error) {
+        console.error("Error refreshing dashboard:", error);
+      }
+    }, REFRESH_INTERVAL_MS);
+    return () => clearInterval(timer);
+  }, [fetchMetrics, fetchReviewClusters, fetchPage, fetchDelta]);
 
   const handleTabChange = (event, newValue) => {
     setActiveTab(newValue);
@@ -105,6 +188,33 @@ const Dashboard = () => {
     );
   };
 
+  // Copies of one document (near-duplicates) are listed together so they can be reviewed at once
+  const renderReviewClusters = () => (
+    <table style={{ width: "100%", borderCollapse: "collapse" }}>
+      <thead>
+        <tr>
+          {["Cluster", "Documents", "Files", "Latest"].map((title) => (
+            <th key={title} style={{ border: "1px solid #ddd", padding: "8px" }}>
+              {title}
+            </th>
+          ))}
+        </tr>
+      </thead>
+      <tbody>
+        {reviewClusters.map((cluster) => (
+          <tr key={cluster.cluster_id}>
+            <td style={{ border: "1px solid #ddd", padding: "8px" }}>{cluster.cluster_id}</td>
+            <td style={{ border: "1px solid #ddd", padding: "8px" }}>{cluster.count}</td>
+            <td style={{ border: "1px solid #ddd", padding: "8px" }}>
+              {cluster.records.map((record) => record.filename).join(", ")}
+            </td>
+            <td style={{ border: "1px solid #ddd", padding: "8px" }}>{cluster.latest}</td>
+          </tr>
+        ))}
+      </tbody>
+    </table>
+  );
+
   if (loading) {
     return <Typography>Loading...</Typography>;
   }
@@ -130,44 +240,42 @@ const Dashboard = () => {
 
       {/* Sub-Tabs for Recent Data */}
       <Tabs value={activeTab} onChange={handleTabChange} centered>
-        <Tab label="Audit Logs" />
-        <Tab label="Approved Documents" />
-        <Tab label="Classification Logs" />
-        <Tab label="Further Evaluation" />
+        {FEEDS.map((feed) => (
+          <Tab key={feed.key} label={feed.title} />
+        ))}
       </Tabs>
 
       <Box sx={{ marginTop: "20px" }}>
-        {activeTab === 0 && (
-          <Paper sx={{ padding: "20px" }}>
-            <Typography variant="h6" gutterBottom>
-              Recent Audit Logs
-            </Typography>
-            {renderTable(recentData.audit_logs, "audit_logs")}
-          </Paper>
-        )}
-        {activeTab === 1 && (
-          <Paper sx={{ padding: "20px" }}>
-            <Typography variant="h6" gutterBottom>
-              Recent Approved Documents
-            </Typography>
-            {renderTable(recentData.approved_documents, "approved_documents")}
-          </Paper>
-        )}
-        {activeTab === 2 && (
-          <Paper sx={{ padding: "20px" }}>
-            <Typography variant="h6" gutterBottom>
-              Recent Classification Logs
-            </Typography>
-            {renderTable(recentData.classification_logs, "classification_logs")}
-          </Paper>
-        )}
-        {activeTab === 3 && (
-          <Paper sx={{ padding: "20px" }}>
-            <Typography variant="h6" gutterBottom>
-              Recent Further Evaluation
-            </Typography>
-            {renderTable(recentData.further_evaluation, "further_evaluation")}
-          </Paper>
+        {FEEDS.map(
+          (feed, index) =>
+            activeTab === index && (
+              <Paper key={feed.key} sx={{ padding: "20px" }}>
+                <Typography variant="h6" gutterBottom>
+                  Recent {feed.title}
+                </Typography>
+                {feed.key === "manual_review" && (
+                  <>
+                    <Typography variant="subtitle1" gutterBottom>
+                      Grouped by duplicate cluster
+                    </Typography>
+                    {renderReviewClusters()}
+                    <Typography variant="subtitle1" sx={{ marginTop: "20px" }} gutterBottom>
+                      All records
+                    </Typography>
+                  </>
+                )}
+                {renderTable(feeds[feed.key]?.items || [], feed.key)}
+                {feeds[feed.key]?.nextCursor && (
+                  <Button
+                    variant="outlined"
+                    sx={{ marginTop: "10px" }}
+                    onClick={() => fetchPage(feed.key, feeds[feed.key].nextCursor)}
+                  >
+                    Load more
+                  </Button>
+                )}
+              </Paper>
+            )
         )}
       </Box>
     </Box>